@@ -0,0 +1,24 @@
+"""
+Shared fixtures for the benchmark suite.
+
+The benchmarks use pytest-benchmark and are kept out of the regular test run. From the
+root of this repository, compare against the tracked baselines with
+
+    python -m pytest benchmarks --benchmark-storage=benchmarks/baselines \
+        --benchmark-compare --benchmark-compare-fail=min:25%
+
+and record a new baseline with `--benchmark-save=<name>` instead of the compare options.
+"""
+import pytest
+
+from placekey.server import PlacekeyStubServer
+
+
+@pytest.fixture(scope='session')
+def stub_api_server():
+    """
+    A local stand-in for the Placekey API. Its latency and failure rates can be changed
+    by tests.
+    """
+    with PlacekeyStubServer() as server:
+        yield server
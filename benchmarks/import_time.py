@@ -0,0 +1,53 @@
+"""
+Measure how long it takes to import the placekey package in a fresh interpreter.
+
+Run with `python benchmarks/import_time.py` from the root of this repository. Use
+`python -X importtime -c "import placekey"` for a per-module breakdown.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = {
+    'import placekey': 'import placekey',
+    'geo_to_placekey': 'import placekey as pk; pk.geo_to_placekey(0.0, 0.0)',
+    'import placekey.api': 'import placekey.api',
+}
+
+HEAVY_MODULES = ['boto3', 'botocore', 'shapely', 'pandas', 'requests']
+
+TIMER = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(m for m in {heavy_modules!r} if m in sys.modules))
+"""
+
+
+def measure(statement, repeat):
+    timings = []
+    loaded = ''
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', TIMER.format(statement=statement, heavy_modules=HEAVY_MODULES)],
+            check=True, capture_output=True, text=True).stdout.split()
+        timings.append(float(output[0]))
+        loaded = output[1] if len(output) > 1 else ''
+    return timings, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10, help='number of fresh interpreters per statement')
+    args = parser.parse_args()
+
+    for name, statement in STATEMENTS.items():
+        timings, loaded = measure(statement, args.repeat)
+        print('{:<22} median {:7.1f} ms   min {:7.1f} ms   heavy modules loaded: {}'.format(
+            name, 1000 * statistics.median(timings), 1000 * min(timings), loaded or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmarks of the API client against a local stub server, with network latency and
+throttled requests.
+"""
+from unittest import mock
+
+import pytest
+
+import placekey.general
+from placekey.api import PlacekeyAPI
+from placekey.general import _json_dumps
+
+PLACES = [{'latitude': 37.7 + i * 1e-4, 'longitude': -122.4 - i * 1e-4} for i in range(500)]
+
+
+@pytest.mark.parametrize('latency,throttle_rate', [(0.0, 0.0), (0.02, 0.0), (0.02, 0.1)],
+                         ids=['no_latency', 'latency', 'latency_and_429s'])
+def test_lookup_placekeys(benchmark, stub_api_server, latency, throttle_rate):
+    stub_api_server.latency = latency
+    stub_api_server.throttle_rate = throttle_rate
+    client = PlacekeyAPI('benchmark', max_retries=10, request_limit=100000, bulk_request_limit=100000,
+                         base_url=stub_api_server.url)
+
+    result = benchmark.pedantic(lambda: client.lookup_placekeys([dict(p) for p in PLACES]),
+                                rounds=3, iterations=1)
+    assert len(result) == len(PLACES)
+    assert all('placekey' in r for r in result)
+
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_parse_bulk_responses(benchmark, backend):
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    client = PlacekeyAPI('benchmark')
+    body = _json_dumps([{'query_id': 'place_{}'.format(i), 'placekey': '227-223@5vg-82n-pgk',
+                         'address_placekey': '227@5vg-82n-pgk'} for i in range(100)])
+
+    def parse():
+        responses = [client._safe_parse_json(body) for _ in range(100)]
+        return client._responses_to_columns([r for batch in responses for r in batch])
+
+    with mock.patch.object(placekey.general, 'orjson', placekey.general.orjson if backend == 'orjson' else None):
+        columns = benchmark(parse)
+    assert len(columns['placekey']) == 10000
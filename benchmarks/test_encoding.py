@@ -0,0 +1,43 @@
+"""
+Benchmarks of conversions between geos, H3 integers and Placekeys.
+"""
+import random
+
+import pytest
+
+import placekey as pk
+
+random.seed(0)
+GEOS = [(random.uniform(-80, 80), random.uniform(-180, 180)) for _ in range(1000)]
+PLACEKEYS = [pk.geo_to_placekey(lat, long) for lat, long in GEOS]
+WHAT_PLACEKEYS = ['227-223@' + p[1:] for p in PLACEKEYS]
+# Inputs of the parametrized benchmarks, looked up by name so that the benchmark
+# parameters stored in baselines stay short
+PLACEKEY_SETS = {'where': PLACEKEYS, 'what_where': WHAT_PLACEKEYS}
+
+
+def test_geo_to_placekey(benchmark):
+    benchmark(lambda: [pk.geo_to_placekey(lat, long) for lat, long in GEOS])
+
+
+def test_placekey_to_h3_int(benchmark):
+    benchmark(lambda: [pk.placekey_to_h3_int(p) for p in PLACEKEYS])
+
+
+def test_placekeys_to_h3_ints(benchmark):
+    benchmark(pk.placekeys_to_h3_ints, PLACEKEYS)
+
+
+@pytest.mark.parametrize('placekey_set', ['where', 'what_where'])
+def test_placekey_format_is_valid(benchmark, placekey_set):
+    placekeys = PLACEKEY_SETS[placekey_set]
+    benchmark(lambda: [pk.placekey_format_is_valid(p) for p in placekeys])
+
+
+@pytest.mark.parametrize('dist', [1, 5, 20])
+def test_get_neighboring_placekeys(benchmark, dist):
+    benchmark(lambda: [pk.get_neighboring_placekeys(p, dist) for p in PLACEKEYS[:20]])
+
+
+def test_placekey_to_wkt(benchmark):
+    benchmark(lambda: [pk.placekey_to_wkt(p) for p in PLACEKEYS])
@@ -0,0 +1,20 @@
+"""
+Benchmarks of polygon coverage with Placekeys.
+"""
+import pytest
+from shapely.geometry import box
+
+import placekey as pk
+
+# Boxes of (lat, long) around San Francisco, from a city block to a county
+POLYGONS = {
+    'small': box(37.7740, -122.4200, 37.7760, -122.4175),
+    'city': box(37.7400, -122.4600, 37.7900, -122.4000),
+    'county': box(37.7000, -122.5100, 37.8100, -122.3700),
+}
+
+
+@pytest.mark.parametrize('size', list(POLYGONS))
+def test_polygon_to_placekeys(benchmark, size):
+    result = benchmark.pedantic(pk.polygon_to_placekeys, args=(POLYGONS[size],), rounds=3, iterations=1)
+    assert result['interior'] or result['boundary']
@@ -1,3 +1,11 @@
 from .placekey import *
 from .__version__ import __version__
 __all__ = ['placekey', 'api', '__version__']
+
+
+def __getattr__(name):
+    # The S3 client is created lazily by placekey.placekey
+    if name == 's3':
+        from .placekey import _get_s3_client
+        return _get_s3_client()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
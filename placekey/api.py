@@ -1,17 +1,31 @@
+import contextlib
+import contextvars
+import functools
 import itertools
-import json
 import logging
+import math
+import threading
+import weakref
 from json import JSONDecodeError
 
 import backoff
-import pandas as pd
 import requests
-from typing import Set, Dict
+import time
+from typing import Set, Dict, TYPE_CHECKING
 from ratelimit import limits, RateLimitException
-from .general import _post_request_function
+from .cache import make_cache_key
+from .general import (DeadlineExceeded, RateLimiter, _json_loads, _post_request_function, _time_remaining,
+                      request_deadline)
+from .join import join_placekeys
+from .metrics import BatchEvent
+from .placekey import geo_to_placekey
 
 from .__version__ import __version__
 
+if TYPE_CHECKING:
+    # pandas is only imported by the methods that work with DataFrames
+    import pandas as pd
+
 console_log = logging.StreamHandler()
 console_log.setFormatter(
     logging.Formatter('%(asctime)s\t%(levelname)s\t%(message)s')
@@ -20,6 +34,9 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.ERROR)
 log.handlers = [console_log]
 
+# Whether the current call logs at INFO level, whatever the level of the client's logger
+_verbose = contextvars.ContextVar('placekey_verbose', default=False)
+
 
 class PlacekeyAPI:
     """
@@ -43,13 +60,59 @@ class PlacekeyAPI:
     See the `Placekey API documentation <https://docs.placekey.io/>`_ for more
     information on how to use the API.
 
-    :param api_key: Placekey API key (string)
+    A client can be shared by several threads: the rate limiters, key rotation, cache and
+    connection pool are coordinated between them, calls don't modify the place dictionaries
+    they are given, and `verbose` only applies to the call it is passed to, without
+    changing the level of any logger.
+
+    :param api_key: Placekey API key (string), or a list of keys. Each key has its own rate
+        limits, and requests are spread across the keys. A key that keeps getting throttled
+        is taken out of rotation for a while.
     :param max_retries: Maximum number of times to retry a failed request before
         halting (int). Backoffs due to rate-limiting are included in the retry count. Defaults
         to 20.
-    :param logger: A logging object. Logs are sent to the console by default.
+    :param logger: A logging object. Logs are sent to the console by default. Calls with
+        `verbose=True` log INFO messages through it regardless of its level.
     :param user_agent_comment: A string to append to the client's user agent, which will be
         "placekey-py/{version_number} {user_agent_comment}.
+    :param cache: An optional response cache, such as a :class:`placekey.cache.SQLiteCache`.
+        Places found in the cache are not sent to the API, and successful responses are
+        added to it. Defaults to None.
+    :param request_limit: Number of single place requests allowed per `request_window`
+        seconds. Accounts with a higher quota can raise this. Defaults to 1000.
+    :param request_window: Length in seconds of the single place rate limit window.
+        Defaults to 60.
+    :param bulk_request_limit: Number of bulk requests allowed per `bulk_request_window`
+        seconds. Defaults to 10.
+    :param bulk_request_window: Length in seconds of the bulk rate limit window.
+        Defaults to 60.
+    :param rate_limiter: A :class:`placekey.general.RateLimiter` with 'single' and 'bulk'
+        endpoints, e.g. to share one budget between several clients. If given, the limits
+        above are ignored. It can't be combined with several API keys. The limiter honors
+        `Retry-After` and rate-limit headers, slows down after 429 responses and ramps back
+        up to the configured rate.
+    :param instrumentation: An optional :class:`placekey.metrics.Instrumentation`, such as
+        a :class:`placekey.metrics.MetricsAggregator`, that receives an event for every
+        request and every batch of places. Defaults to None.
+    :param base_url: Base URL of the API, such as the URL of a local
+        :class:`placekey.server.PlacekeyStubServer`. Defaults to the Placekey API.
+    :param compute_locally: If True, places with only a latitude and longitude get their
+        Placekey from :func:`placekey.geo_to_placekey` instead of the API, as long as no
+        fields other than placekey are requested. Defaults to False.
+    :param connect_timeout: Seconds to wait for a connection to the API before retrying.
+        Defaults to 10.
+    :param read_timeout: Seconds to wait for the API to send data before retrying.
+        Defaults to 60.
+    :param hedge_after: If set, a bulk request that hasn't been answered after this many
+        seconds is sent again, as long as the rate limit allows it, and whichever response
+        arrives first is used. This cuts the time lost to stalled connections at the cost
+        of some extra requests. Defaults to None.
+    :param session: A `requests.Session` to send requests with, e.g. to configure proxies.
+        It is shared by every thread that uses the client. requests doesn't guarantee that
+        a session is thread-safe: sending requests from several threads works as long as
+        the session's settings, adapters and cookies aren't changed meanwhile. Defaults to
+        None, in which case each thread gets its own session, whose pool keeps up to
+        `POOL_SIZE` connections open. Call :meth:`close` to close their connections.
 
     """
     URL = 'https://api.placekey.io/v1/placekey'
@@ -65,6 +128,10 @@ class PlacekeyAPI:
 
     DEFAULT_MAX_RETRIES = 20
 
+    CONNECT_TIMEOUT = 10
+    READ_TIMEOUT = 60
+    POOL_SIZE = 32
+
     PLACE_METADATA_CONSTANT = 'place_metadata'
 
     QUERY_PARAMETERS = {
@@ -97,6 +164,14 @@ class PlacekeyAPI:
         ['street_address', 'region', 'city'],
     ]
 
+    # Errors of places that fail validation before being sent to the API
+    MISSING_INPUTS_ERROR = ("Not enough information to look up this place. Refer to minimum inputs documentation here: "
+                            "https://docs.placekey.io/documentation/placekey-api/input-parameters/minimum-inputs")
+    INVALID_COORDINATES_ERROR = "Invalid latitude or longitude"
+
+    # Query parameters checked by validation
+    _PREFLIGHT_KEYS = sorted(set(itertools.chain.from_iterable(MIN_INPUTS)))
+
     PLACEKEY_OUTPUTS = {
         "placekey",
         "address_placekey",
@@ -110,39 +185,161 @@ class PlacekeyAPI:
         "address_confidence_score"
     }
 
+    # Outputs holding Placekeys, which can be joined locally on H3 cells
+    PLACEKEY_COLUMNS = {"placekey", "address_placekey", "building_placekey"}
+
+    KEY_MAX_THROTTLES = 3
+    KEY_COOLDOWN = 60
+
+    # Levels of bisection in a row on which every part of a failed batch fails again,
+    # after which the remaining parts are taken to fail as a whole
+    BISECT_MAX_FAILING_LEVELS = 4
+
     def __init__(self, api_key=None, max_retries=DEFAULT_MAX_RETRIES, logger=log,
-                 user_agent_comment=None):
+                 user_agent_comment=None, cache=None, request_limit=REQUEST_LIMIT,
+                 request_window=REQUEST_WINDOW, bulk_request_limit=BULK_REQUEST_LIMIT,
+                 bulk_request_window=BULK_REQUEST_WINDOW, rate_limiter=None, instrumentation=None,
+                 base_url=None, compute_locally=False, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, hedge_after=None, session=None):
         self.api_key = api_key
         self.max_retries = max_retries
         self.logger = logger
         self.user_agent_comment = user_agent_comment
-
-        self.key_ = {
-            'Content-Type': 'application/json',
-            'User-Agent': self.DEFAULT_USER_AGENT,
-            'apikey': self.api_key
-        }
+        self.cache = cache
+        self.instrumentation = instrumentation
+        self.compute_locally = compute_locally
+        if session is None:
+            session = _ThreadLocalSession(self.POOL_SIZE)
+        self.session = session
+        if base_url is not None:
+            self.URL = base_url.rstrip('/') + '/placekey'
+            self.BULK_URL = base_url.rstrip('/') + '/placekeys'
+
+        api_keys = [api_key] if api_key is None or isinstance(api_key, str) else list(api_key)
+        if not api_keys:
+            raise ValueError("At least one API key is required.")
+        if rate_limiter is not None and len(api_keys) > 1:
+            raise ValueError("A rate_limiter cannot be shared by several API keys.")
+
+        self._keys = []
+        for key in api_keys:
+            # A single limiter shared by both endpoints, so that throttling on one
+            # slows down the other as well
+            key_rate_limiter = rate_limiter or RateLimiter({
+                'single': (request_limit, request_window),
+                'bulk': (bulk_request_limit, bulk_request_window)
+            })
+            headers = {
+                'Content-Type': 'application/json',
+                'User-Agent': self.DEFAULT_USER_AGENT,
+                'apikey': key
+            }
+            if isinstance(self.user_agent_comment, str):
+                headers['User-Agent'] = (
+                        headers['User-Agent'] + " " + self.user_agent_comment).strip()
+
+            # With several keys, a key gives up after a few throttled tries so that the
+            # request can move on to another key. Other failures are retried as usual.
+            max_throttles = None if len(api_keys) == 1 else self.KEY_MAX_THROTTLES
+            self._keys.append(_APIKey(
+                api_key=key,
+                headers=headers,
+                rate_limiter=key_rate_limiter,
+                # Rate-limited function for a single requests
+                make_request=_post_request_function(
+                    headers=headers,
+                    url=self.URL,
+                    calls=request_limit,
+                    period=request_window,
+                    max_tries=self.max_retries,
+                    max_throttles=max_throttles,
+                    rate_limiter=key_rate_limiter,
+                    endpoint='single',
+                    instrumentation=instrumentation,
+                    timeout=(connect_timeout, read_timeout),
+                    session=session),
+                make_bulk_request=_post_request_function(
+                    headers=headers,
+                    url=self.BULK_URL,
+                    calls=bulk_request_limit,
+                    period=bulk_request_window,
+                    max_tries=self.max_retries,
+                    max_throttles=max_throttles,
+                    rate_limiter=key_rate_limiter,
+                    endpoint='bulk',
+                    instrumentation=instrumentation,
+                    timeout=(connect_timeout, read_timeout),
+                    hedge_after=hedge_after,
+                    session=session)
+            ))
+
+        self.key_ = self._keys[0].headers
         self.headers = self.key_
+        self.rate_limiter = self._keys[0].rate_limiter
+        if len(self._keys) == 1:
+            self.make_request = self._keys[0].make_request
+            self.make_bulk_request = self._keys[0].make_bulk_request
+        else:
+            self.make_request = functools.partial(self._make_pooled_request, 'single')
+            self.make_bulk_request = functools.partial(self._make_pooled_request, 'bulk')
+
+    @property
+    def _logger(self):
+        return _CallLogger(self.logger, {})
+
+    def close(self):
+        """
+        Close the connections of the client's sessions.
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _make_pooled_request(self, endpoint, request_data=None):
+        """
+        Make a request with the API key that can send one soonest. A key that is still
+        throttled after `KEY_MAX_THROTTLES` tries is taken out of rotation for
+        `KEY_COOLDOWN` seconds and the request moves on to the next key. When every key is
+        cooling down, the request waits for the first one to come back, as long as the
+        deadline allows it. A key that keeps failing for other reasons, such as server
+        errors or timeouts, is not tried again for this request; the error is raised once
+        every key has failed that way.
+        """
+        failed = []
+        error = None
+        for _ in range(max(self.max_retries, 1)):
+            now = time.monotonic()
+            candidates = [key for key in self._keys if key not in failed]
+            if not candidates:
+                raise error
+            key = min(candidates, key=lambda k: max(k.cooldown_until - now, k.rate_limiter.wait_time(endpoint)))
+            if key.cooldown_until > now:
+                remaining = _time_remaining()
+                if remaining is not None and key.cooldown_until - now > remaining:
+                    raise DeadlineExceeded("Every API key is cooling down past the deadline")
+                self._logger.info('Every API key is throttled, waiting %.1f seconds', key.cooldown_until - now)
+                time.sleep(key.cooldown_until - now)
+
+            try:
+                if endpoint == 'bulk':
+                    return key.make_bulk_request(request_data)
+                return key.make_request(request_data)
+            except RateLimitException as e:
+                self._logger.info('Taking a throttled API key out of rotation for %s seconds', self.KEY_COOLDOWN)
+                key.cooldown_until = time.monotonic() + self.KEY_COOLDOWN
+                error = e
+            except DeadlineExceeded:
+                raise
+            except requests.exceptions.RequestException as e:
+                self._logger.warning('Request failed with an API key, trying the next one: %s', e)
+                failed.append(key)
+                error = e
+        raise error
 
-        if isinstance(self.user_agent_comment, str):
-            self.headers['User-Agent'] = (
-                    self.headers['User-Agent'] + " " + self.user_agent_comment).strip()
-
-        # Rate-limited function for a single requests
-        self.make_request = _post_request_function(
-            headers=self.headers,
-            url=self.URL,
-            calls=self.REQUEST_LIMIT,
-            period=self.REQUEST_WINDOW,
-            max_tries=self.max_retries)
-
-        self.make_bulk_request = _post_request_function(
-            headers=self.headers,
-            url=self.BULK_URL,
-            calls=self.BULK_REQUEST_LIMIT,
-            period=self.BULK_REQUEST_WINDOW,
-            max_tries=self.max_retries)
-    
     def _has_minimum_inputs(self, user_inputs: Set[str]) -> bool:
         for inputs in self.MIN_INPUTS:
             hasRequiredInputs = True
@@ -154,7 +351,23 @@ class PlacekeyAPI:
                 return True
         return False
     
-    def _join_pandas_df(self, df1: pd.DataFrame, column_mapping_1: Dict, df2: pd.DataFrame, column_mapping_2: Dict, how: str = 'inner', on: str = "placekey", fields=None, batch_size=MAX_BATCH_SIZE, verbose=False):
+    def _join_pandas_df(self, df1: 'pd.DataFrame', column_mapping_1: Dict, df2: 'pd.DataFrame', column_mapping_2: Dict, how: str = 'inner', on: str = "placekey", fields=None, batch_size=MAX_BATCH_SIZE, verbose=False, mode=None, resolution=None, k=1):
+        """
+        Join two DataFrames on a Placekey API output. Datasets that don't contain the join
+        key yet are looked up with :meth:`_placekey_pandas_df` first.
+
+        Joins on Placekey columns are done locally on integer-encoded keys with
+        :func:`placekey.join.join_placekeys`, and other columns are joined with `pandas.merge`.
+
+        :param mode: How Placekeys match: "exact", "where", "parent" (at `resolution`) or
+            "grid" (at most `k` cells apart). See :func:`placekey.join.join_placekeys`.
+            Defaults to "exact" for Placekey columns.
+        """
+        import pandas as pd
+
+        if mode is not None and on not in self.PLACEKEY_COLUMNS:
+            raise ValueError("Join modes are only supported for Placekey columns: {}".format(self.PLACEKEY_COLUMNS))
+
         fields = [on] if fields is None else fields + [on]
         if on not in df1:
             if on in self.PLACEKEY_OUTPUTS:
@@ -166,11 +379,13 @@ class PlacekeyAPI:
                 df2 = self._placekey_pandas_df(df2, column_mapping=column_mapping_2, fields=fields, batch_size=batch_size, verbose=verbose, return_original_values=True)
             else:
                 raise ValueError("The second dataset does not contain the join key {}".format(on))
-        
+
+        if on in self.PLACEKEY_COLUMNS:
+            return join_placekeys(df1, df2, on=on, how=how, mode=mode or 'exact', resolution=resolution, k=k)
         return pd.merge(df1, df2, how=how, on=on)
             
 
-    def _placekey_pandas_df(self, df: pd.DataFrame, column_mapping: Dict, fields=None, batch_size=MAX_BATCH_SIZE, verbose=False, return_original_values=True):
+    def _placekey_pandas_df(self, df: 'pd.DataFrame', column_mapping: Dict, fields=None, batch_size=MAX_BATCH_SIZE, verbose=False, return_original_values=True, deduplicate=True, validate=True):
         """
         Takes a DataFrame and a list of column names that map to placekey input fields and returns a placekey'd pandas dataframe.
 
@@ -183,9 +398,15 @@ class PlacekeyAPI:
             Defaults to 100, and cannot exceeded 100.
         :param verbose: Boolean for whether or not to log additional information.
             Defaults to False
+        :param deduplicate: Boolean for whether or not to send duplicate rows to the API
+            only once. Defaults to True
+        :param validate: Boolean for whether or not to check rows before querying the API.
+            Rows that can't be looked up get an error without being sent. Defaults to True
 
         Returns:
-        - pd.DataFrame: The updated DataFrame with new rows for placekey outputs
+        - pd.DataFrame: A copy of the DataFrame with new columns for placekey outputs. The
+            input DataFrame is not modified. With `return_original_values=False`, only the
+            outputs, with a `temp_query_id` column of "place_<index label>" for each row.
         """
         if not self._validate_query(column_mapping):
             raise ValueError(
@@ -194,34 +415,155 @@ class PlacekeyAPI:
         if not self._has_minimum_inputs(column_mapping.keys()):
             raise ValueError(
                 "The inputted DataFrame doesn't have enough information. Refer to minimum inputs documentation here: https://docs.placekey.io/documentation/placekey-api/input-parameters/minimum-inputs")
-        
-        temp_query_id = 'temp_query_id'
-        df[temp_query_id] = ''
-        places = []
-        for i, row in df.iterrows():
-            place = {}
-            for place_key, column_name in column_mapping.items():
-                if column_name in df.columns and pd.notna(row[column_name]):
-                    place[place_key] = row[column_name]
-            query_id = self.DEFAULT_QUERY_ID_PREFIX + str(i)
-            place['query_id'] = query_id
-            df.at[i, temp_query_id] = query_id
-            places.append(place)
-        result = self.lookup_placekeys(places=places, fields=fields, batch_size=batch_size, verbose=verbose)
-        result_df = pd.DataFrame(result).rename(columns={"query_id": temp_query_id})
+
+        if return_original_values:
+            existing = [column for column in self._output_columns(fields) if column in df.columns]
+            if existing:
+                raise ValueError("The DataFrame already has output columns: {}".format(existing))
+
+        import pandas as pd
+
+        places = self._pandas_df_to_places(df, column_mapping)
+        query_ids = pd.Index([place['query_id'] for place in places])
+        invalid = []
+        if validate:
+            # Validate the columns directly rather than the place dictionaries
+            errors = self._preflight_errors(
+                {key: df[column].to_numpy(dtype=object) for key, column in column_mapping.items()
+                 if key in self._PREFLIGHT_KEYS and column in df.columns}, len(df))
+            invalid = [{'query_id': place['query_id'], 'error': error}
+                       for place, error in zip(places, errors) if error is not None]
+            places = [place for place, error in zip(places, errors) if error is None]
+        result = self.lookup_placekeys(places=places, fields=fields, batch_size=batch_size, verbose=verbose,
+                                       deduplicate=deduplicate, validate=False) + invalid
+        result_df = pd.DataFrame(self._responses_to_columns(result))
+
+        # Results are attached to the rows by position
+        positions = query_ids.get_indexer(result_df['query_id'])
+        order = positions.argsort(kind='stable')
+        positions = positions[order]
+        result_df = result_df.iloc[order].reset_index(drop=True)
 
         if not return_original_values:
-            return result_df
-        merged_df = pd.merge(df, result_df, how='inner', on=temp_query_id).drop([temp_query_id], axis=1)
-        return merged_df
+            # Callers identify rows by their index label
+            result_df['query_id'] = [self.DEFAULT_QUERY_ID_PREFIX + str(label) for label in df.index[positions]]
+            return result_df.rename(columns={'query_id': 'temp_query_id'})
+        result_df = result_df.drop(columns=['query_id']).set_axis(df.index[positions])
+        return pd.concat([df.iloc[positions], result_df], axis=1)
+
+    def _pandas_df_to_places(self, df: 'pd.DataFrame', column_mapping: Dict):
+        """
+        Build place dictionaries from the mapped columns of a DataFrame, leaving out
+        missing values. The `query_id` of each place is based on its row position.
+        """
+        mapping = {place_key: column_name for place_key, column_name in column_mapping.items()
+                   if column_name in df.columns}
+        inputs = df[list(mapping.values())]
+        place_keys = list(mapping.keys())
+        values = inputs.to_numpy(dtype=object)
+        present = inputs.notna().to_numpy()
+
+        return [
+            dict(((k, v) for k, v, p in zip(place_keys, row, row_present) if p),
+                 query_id=self.DEFAULT_QUERY_ID_PREFIX + str(i))
+            for i, (row, row_present) in enumerate(zip(values, present))
+        ]
         
 
+    def placekey_file(self, input_path: str, output_path: str, column_mapping: Dict, fields=None,
+                      chunksize=100000, batch_size=MAX_BATCH_SIZE, verbose=False, input_format=None):
+        """
+        Add Placekeys to a CSV or Parquet file and write the result to a Parquet file. The
+        input is read and looked up one chunk at a time, so the whole file is never held in
+        memory. Each chunk goes through :meth:`_placekey_pandas_df`. Use a client with a
+        `cache` to avoid re-sending places that repeat across chunks.
+
+        This method requires pyarrow.
+
+        Args:
+        :param input_path (str): Path of the input CSV or Parquet file.
+        :param output_path (str): Path of the output Parquet file.
+        :param column_mapping (dict): Mapping from placekey input fields to column names.
+        :param fields: A list of requested parameters other than placekey. For example: address_placekey, building_placekey
+            Defaults to None
+        :param chunksize: Integer for the number of rows read and looked up at a time.
+            Defaults to 100000.
+        :param batch_size: Integer for the number of places to lookup in a single batch.
+            Defaults to 100, and cannot exceeded 100.
+        :param verbose: Boolean for whether or not to log additional information.
+            Defaults to False
+        :param input_format: Either "csv" or "parquet". Defaults to None, in which case the
+            format is inferred from the file extension.
+
+        Returns:
+        - int: The number of rows written to the output file
+        """
+        import pandas as pd
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("placekey_file requires pyarrow. Install it with `pip install pyarrow`.")
+
+        if input_format is None:
+            input_format = 'parquet' if input_path.lower().endswith(('.parquet', '.pq')) else 'csv'
+        if input_format == 'csv':
+            # Read everything but coordinates as strings so that every chunk has the same
+            # schema and values such as postal codes keep their leading zeros
+            coordinate_columns = {column_mapping.get('latitude'), column_mapping.get('longitude')}
+            columns = pd.read_csv(input_path, nrows=0).columns
+            chunks = pd.read_csv(
+                input_path, chunksize=chunksize,
+                dtype={c: 'float64' if c in coordinate_columns else 'string' for c in columns})
+        elif input_format == 'parquet':
+            parquet_file = pq.ParquetFile(input_path)
+            columns = parquet_file.schema_arrow.names
+            chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunksize))
+        else:
+            raise ValueError("input_format must be either 'csv' or 'parquet'")
+
+        # Checked before anything is looked up or written
+        output_columns = self._output_columns(fields)
+        existing = [column for column in output_columns if column in columns]
+        if existing:
+            raise ValueError("The input file already has output columns: {}".format(existing))
+
+        writer = None
+        rows_written = 0
+        with _verbosity(verbose):
+            try:
+                for i, chunk in enumerate(chunks):
+                    out = self._placekey_pandas_df(chunk, column_mapping, fields=fields, batch_size=batch_size,
+                                                   verbose=verbose)
+                    out = out.reindex(columns=list(chunk.columns) + output_columns)
+                    out[output_columns] = out[output_columns].astype(object).where(out[output_columns].notna(), None)
+                    table = pa.Table.from_pandas(out, preserve_index=False)
+
+                    if writer is None:
+                        schema = pa.schema([
+                            pa.field(f.name, pa.string())
+                            if f.name in output_columns or pa.types.is_null(f.type) else f
+                            for f in table.schema
+                        ])
+                        writer = pq.ParquetWriter(output_path, schema)
+                    writer.write_table(table.cast(writer.schema))
+                    rows_written += len(out)
+                    self._logger.info('Wrote chunk %s (%s rows in total)', i, rows_written)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+        return rows_written
+
     def lookup_placekey(self,
                         fields=None,
+                        validate=True,
                         **kwargs):
         """
         Lookup the Placekey for a single place.
 
+        :param validate: Boolean for whether or not to check the place before querying the
+            API, as in :meth:`lookup_placekeys`. Defaults to True
         :kwargs: Place fields can be passed to this method as keyword arguments. The allowed
             keyword arguments are ['latitude', 'longitude', 'location_name','street_address',
             'city', 'region', 'postal_code', 'iso_country_code', 'query_id', 'place_metadata']
@@ -233,26 +575,61 @@ class PlacekeyAPI:
             raise ValueError(
                 "Query contains keys other than: {}".format(self.QUERY_PARAMETERS))
 
+        if validate:
+            error = self._preflight_errors({key: [kwargs.get(key)] for key in self._PREFLIGHT_KEYS}, 1)[0]
+            if error is not None:
+                return {'query_id': kwargs.get('query_id', '0'), 'error': error}
+
+        if self.compute_locally and not fields:
+            local = self._compute_locally(dict(kwargs, query_id=kwargs.get('query_id', '0')))
+            if local is not None:
+                return local
+
+        if self.cache is not None:
+            # The same key as in lookup_placekeys, so that both share cached responses
+            cache_key = make_cache_key(self._normalize_query(kwargs), fields)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return dict(cached, query_id=kwargs.get('query_id', '0'))
+
         payload = {"query": kwargs}
         if fields:
             payload['options'] = {'fields': fields}
 
+        start = time.monotonic()
         result = self.make_request(payload)
+        response = self._safe_parse_json(result.content)
+        self._record_batch('single', 1, response, start)
+
+        if self.cache is not None and self._is_cacheable(response):
+            self.cache.set(cache_key, self._strip_query_id(response))
 
-        return self._safe_parse_json(result.text)
+        return response
 
     def lookup_placekeys(self,
                          places,
                          fields=None,
                          batch_size=MAX_BATCH_SIZE,
-                         verbose=False):
+                         verbose=False,
+                         deduplicate=True,
+                         validate=True,
+                         deadline=None,
+                         output='records'):
         """
         Lookup Placekeys for an iterable of places specified by place dictionaries.
         This method checks that the place dictionaries are valid before querying
         the API, and it will return partial results if it encounters a fatal error.
-        Places without a `query_id` will have one generated for them based on their
-        index in `places`, e.g., "place_0" for the first item in the list, but a
-        user-provided `query_id` will be passed through as is.
+        Batches that fail as a whole are split to isolate the places that cause the
+        failure, so that only those places get an error. Places without a `query_id`
+        will have one generated for them based on their index in `places`, e.g.,
+        "place_0" for the first item in the list, but a user-provided `query_id` will
+        be passed through as is.
+
+        If the client was created with a `cache`, places found in it are returned without
+        querying the API and only the remaining places are sent in bulk batches. Places
+        that are identical up to whitespace and case are only sent once, and the response
+        is returned for each of them. If the client was created with `compute_locally`,
+        places with only a latitude and longitude are not sent to the API either.
 
         This function is a wrapper for `lookup_batch`, and that function may be
         used if different error handling or logic around batch processing is desired.
@@ -266,71 +643,230 @@ class PlacekeyAPI:
             Defaults to 100, and cannot exceeded 100.
         :param verbose: Boolean for whether or not to log additional information.
             Defaults to False
-
-        :return: A list of Placekey API responses for each place (list(dict))
+        :param deduplicate: Boolean for whether or not to send duplicate places to the API
+            only once. Defaults to True
+        :param validate: Boolean for whether or not to check places before querying the
+            API. Places without one of the `MIN_INPUTS` combinations, where blank strings
+            count as missing, or with an invalid latitude or longitude get an error without
+            being sent. Defaults to True
+        :param deadline: Number of seconds the requests to the API may take in total,
+            including retries, backoff and rate limiting. Once it has passed, no more
+            requests are made and the places processed so far are returned. Defaults to
+            None, for no deadline.
+        :param output: "records" for a list of responses, "columns" for a dictionary mapping
+            each output to a numpy array with a value (or None) per response, or "arrow" for
+            a `pyarrow.Table` with a column per output. Defaults to "records"
+
+        :return: The Placekey API responses for each place, as a list of dictionaries or in
+            the columnar format given by `output`
 
         """
         if batch_size > self.MAX_BATCH_SIZE:
             raise ValueError("Batch size cannot exceed {}.".format(self.MAX_BATCH_SIZE))
+        if output not in ('records', 'columns', 'arrow'):
+            raise ValueError("output must be one of 'records', 'columns' or 'arrow'")
 
-        if not all([self._validate_query(a) for a in places]):
+        places = list(places)
+        if not all(self._validate_query(a) for a in places):
             raise ValueError(
                 "Some queries contain keys other than: {}".format(self.QUERY_PARAMETERS))
 
-        if verbose:
-            self.logger.setLevel(logging.INFO)
-            logging.getLogger('backoff').setLevel(logging.INFO)
-        else:
-            self.logger.setLevel(logging.ERROR)
-            logging.getLogger('backoff').setLevel(logging.ERROR)
+        with _verbosity(verbose):
+            responses = self._lookup_places(places, fields, batch_size, deduplicate, validate, deadline)
+        if output == 'columns':
+            return self._responses_to_columns(responses)
+        if output == 'arrow':
+            return self._responses_to_arrow(responses)
+        return responses
 
-        # Add a query_id to each place that doesn't have one
-        for i, place in enumerate(places):
-            if 'query_id' not in place:
-                place['query_id'] = self.DEFAULT_QUERY_ID_PREFIX + str(i)
+    def _lookup_places(self, places, fields, batch_size, deduplicate, validate, deadline):
+        """
+        The body of :meth:`lookup_placekeys`, once the arguments are checked.
+        """
+        # Give a query_id to each place that doesn't have one, in a copy of the place
+        places = [place if 'query_id' in place else dict(place, query_id=self.DEFAULT_QUERY_ID_PREFIX + str(i))
+                  for i, place in enumerate(places)]
+
+        # Responses that don't need the API, or None for places that do
+        local = [None] * len(places)
+        if validate:
+            start = time.monotonic()
+            errors = self._preflight_errors(
+                {key: [place.get(key) for place in places] for key in self._PREFLIGHT_KEYS}, len(places))
+            invalid = [i for i, error in enumerate(errors) if error is not None]
+            for i in invalid:
+                local[i] = {'query_id': places[i]['query_id'], 'error': errors[i]}
+            if invalid:
+                self._logger.info('%s of %s places failed validation', len(invalid), len(places))
+            if self.instrumentation is not None:
+                self.instrumentation.record_batch(BatchEvent(
+                    'preflight', len(places), len(invalid), time.monotonic() - start))
+
+        if self.compute_locally and not fields:
+            start = time.monotonic()
+            computed = 0
+            for i, place in enumerate(places):
+                if local[i] is None:
+                    local[i] = self._compute_locally(place)
+                    computed += local[i] is not None
+            if self.instrumentation is not None:
+                self.instrumentation.record_batch(BatchEvent(
+                    'local', computed, 0, time.monotonic() - start))
+
+        remote_places = [place for place, response in zip(places, local) if response is None]
+        if not remote_places:
+            return local
+        with request_deadline(deadline):
+            remote = self._lookup_remote(remote_places, fields, batch_size, deduplicate)
+        if len(remote_places) == len(places):
+            return remote
+
+        remote_by_id = {res.get('query_id'): res for res in remote}
+        return [response if response is not None else remote_by_id[place['query_id']]
+                for place, response in zip(places, local)
+                if response is not None or place['query_id'] in remote_by_id]
+
+    def _lookup_remote(self, places, fields, batch_size, deduplicate):
+        """
+        Look up places with the API, serving what can be served from the cache and
+        sending duplicates only once.
+        """
+        if self.cache is None and not deduplicate:
+            return self._lookup_uncached(places, fields=fields, batch_size=batch_size)
+
+        keys = [make_cache_key(self._normalize_query(place), fields) for place in places]
+        cached = self.cache.get_many(keys) if self.cache is not None else {}
+
+        # Only send places that aren't cached, and only the first of several duplicates
+        pending = []
+        representatives = {}
+        for place, key in zip(places, keys):
+            if key in cached or (deduplicate and key in representatives):
+                continue
+            representatives.setdefault(key, place['query_id'])
+            pending.append(place)
+        self._logger.info('Sending %s of %s places to the API', len(pending), len(places))
+
+        fetched = self._lookup_uncached(pending, fields=fields, batch_size=batch_size)
+        fetched_by_id = {res.get('query_id'): res for res in fetched}
+
+        if self.cache is not None:
+            self.cache.set_many({
+                key: self._strip_query_id(fetched_by_id[query_id])
+                for key, query_id in representatives.items()
+                if self._is_cacheable(fetched_by_id.get(query_id))
+            })
+
+        # Fan the responses back out to every place
+        result_list = []
+        for place, key in zip(places, keys):
+            query_id = place['query_id']
+            if key in cached:
+                result_list.append(dict(cached[key], query_id=query_id))
+            elif query_id in fetched_by_id:
+                result_list.append(fetched_by_id[query_id])
+            elif deduplicate and representatives.get(key) in fetched_by_id:
+                result_list.append(dict(fetched_by_id[representatives[key]], query_id=query_id))
+        return result_list
 
+    def _lookup_uncached(self, places, fields=None, batch_size=MAX_BATCH_SIZE):
+        """
+        Send places to the API in batches, stopping at the first fatal error.
+
+        A batch that fails as a whole, with a batch-wide `error` or a server `message`, is
+        split in two and each half that fails is split again, level by level, until the
+        places that fail are isolated. Only those places get the error. If every part
+        fails on `BISECT_MAX_FAILING_LEVELS` levels in a row, the remaining parts are
+        taken to fail as a whole, which bounds the cost of batches where every place
+        fails. If the server keeps answering with messages and no request succeeds, the
+        failure is taken to be server-wide and processing stops.
+
+        :param places: A list of place dictionaries, each with a `query_id`.
+        :param fields: A list of requested parameters other than placekey.
+        :param batch_size: Integer for the number of places to lookup in a single batch.
+
+        :return: A list of Placekey API responses for the processed places (list(dict))
+
+        """
         results = []
+        # Enough failures to bisect a batch down to a single place, twice
+        max_server_failures = 2 * math.ceil(math.log2(max(batch_size, 2))) + 2
+        server_failures = 0
+
+        def send(batch):
+            """
+            :return: The responses for a batch, or None if it failed as a whole, and the
+                error it failed with
+            """
+            nonlocal server_failures
+            res = self._lookup_batch(batch, fields=fields)
+            if isinstance(res, list) and (res or not batch):
+                server_failures = 0
+                return res, None
+
+            if isinstance(res, dict) and 'error' in res:
+                self._logger.info('All queries in a batch of %s had errors', len(batch))
+                return None, res['error']
+
+            # Server-side messages and unparseable responses
+            error = res.get('message', 'Invalid response') if isinstance(res, dict) else 'Invalid response'
+            self._logger.warning('Batch of %s failed: %s', len(batch), error)
+            server_failures += 1
+            if server_failures > max_server_failures:
+                raise _ServerFailure(error)
+            return None, error
+
+        def bisect(batch, error):
+            """
+            :return: The responses for a batch that failed as a whole with `error`
+            """
+            # Responses by the position of their first place in the batch
+            parts = {}
+            # The parts of the current level that failed, as (start, end, error) tuples
+            failing = [(0, len(batch), error)]
+            failing_levels = 0
+            while failing:
+                next_failing = []
+                sent = 0
+                for start, end, part_error in failing:
+                    if end - start == 1 or failing_levels >= self.BISECT_MAX_FAILING_LEVELS:
+                        parts[start] = [{'query_id': place['query_id'], 'error': part_error}
+                                        for place in batch[start:end]]
+                        continue
+                    middle = (start + end) // 2
+                    for half_start, half_end in ((start, middle), (middle, end)):
+                        res, half_error = send(batch[half_start:half_end])
+                        sent += 1
+                        if res is not None:
+                            parts[half_start] = res
+                        else:
+                            next_failing.append((half_start, half_end, half_error))
+                failing_levels = failing_levels + 1 if sent and len(next_failing) == sent else 0
+                failing = next_failing
+            return list(itertools.chain.from_iterable(parts[start] for start in sorted(parts)))
+
         for i in range(0, len(places), batch_size):
             max_batch_idx = min(i + batch_size, len(places))
-            batch_query_ids = [p['query_id'] for p in places[i:max_batch_idx]]
+            batch = places[i:max_batch_idx]
 
             try:
-                res = self._lookup_batch(
-                    places[i:max_batch_idx],
-                    fields=fields
-                )
-            except RateLimitException:
-                self.logger.error(
+                res, error = send(batch)
+                results.append(res if res is not None else bisect(batch, error))
+            except (RateLimitException, requests.exceptions.RequestException):
+                self._logger.error(
                     'Fatal error encountered. Returning processed items at size %s of %s', i, len(places))
                 break
-            except requests.exceptions.RequestException:
-                self.logger.error(
-                    'Fatal error encountered. Returning processed items at size %s of %s', i, len(places))
+            except _ServerFailure as e:
+                self._logger.error(str(e))
+                self._logger.error('Returning completed queries')
                 break
 
-            # Catch case where all queries in batch having an error,
-            # and generate rows for individual items.
-            if isinstance(res, dict) and 'error' in res:
-                self.logger.info(
-                    'All queries in batch (%s, %s) had errors', i, max_batch_idx)
-
-                res = [{'query_id': query_id, 'error': res['error']}
-                       for query_id in batch_query_ids]
-
-            # Catch other server-side errors
-            elif 'message' in res:
-                self.logger.error(res['message'])
-                self.logger.error('Returning completed queries')
-                break
-
-            results.append(res)
-
             if max_batch_idx % (10 * batch_size) == 0 and i > 0:
-                self.logger.info('Processed %s items', max_batch_idx)
+                self._logger.info('Processed %s items', max_batch_idx)
 
         result_list = list(itertools.chain.from_iterable(results))
-        self.logger.info('Processed %s items', len(result_list))
-        self.logger.info('Done')
+        self._logger.info('Processed %s items', len(result_list))
+        self._logger.info('Done')
 
         return result_list
 
@@ -360,32 +896,334 @@ class PlacekeyAPI:
         if fields:
             batch_payload['options'] = {"fields": fields}
 
+        start = time.monotonic()
         result = self.make_bulk_request(batch_payload)
+        response = self._safe_parse_json(result.content)
+        self._record_batch('bulk', len(places), response, start)
+
+        return response
 
-        return self._safe_parse_json(result.text)
+    def _record_batch(self, endpoint, batch_size, response, start):
+        """
+        Send a :class:`placekey.metrics.BatchEvent` for a parsed response to the
+        instrumentation, if any.
+        """
+        if self.instrumentation is None:
+            return
+        if isinstance(response, list) and response:
+            row_errors = sum(1 for r in response if isinstance(r, dict) and 'error' in r)
+        elif isinstance(response, dict) and 'error' not in response and 'message' not in response:
+            row_errors = 0
+        else:
+            # Batch-wide errors and unparseable responses fail every place
+            row_errors = batch_size
+        self.instrumentation.record_batch(
+            BatchEvent(endpoint, batch_size, row_errors, time.monotonic() - start))
+
+    @staticmethod
+    def _compute_locally(place):
+        """
+        :return: The response for a place with only a latitude and longitude, computed
+            without the API, or None if the place needs the API
+        """
+        if not {'latitude', 'longitude'} <= set(place) <= {'latitude', 'longitude', 'query_id'}:
+            return None
+        try:
+            lat, long = float(place['latitude']), float(place['longitude'])
+        except (TypeError, ValueError):
+            return None
+        # Invalid coordinates are left to the API, which reports the error
+        if not (-90 <= lat <= 90 and -180 <= long <= 180):
+            return None
+        return {'query_id': place['query_id'], 'placekey': geo_to_placekey(lat, long)}
 
     def _validate_query(self, query_dict):
-        query_dict_keys = query_dict.keys()
-        top_level_check = set(query_dict_keys).issubset(self.QUERY_PARAMETERS)
-        place_metadata_check = set(query_dict.get(self.PLACE_METADATA_CONSTANT).keys()).issubset(
-            self.PLACE_METADATA_PARAMETERS) if (self.PLACE_METADATA_CONSTANT in query_dict_keys) else True
-        return top_level_check and place_metadata_check
+        # Key views compare as sets without copying the keys
+        if not query_dict.keys() <= self.QUERY_PARAMETERS:
+            return False
+        if self.PLACE_METADATA_CONSTANT in query_dict:
+            return query_dict[self.PLACE_METADATA_CONSTANT].keys() <= self.PLACE_METADATA_PARAMETERS
+        return True
+
+    def _preflight_errors(self, columns, n):
+        """
+        Check a batch of places column by column for problems that would make the API
+        reject them: missing minimum inputs, where blank strings count as missing, and
+        coordinates that aren't numbers or are out of bounds.
+
+        :param columns: A dictionary mapping query parameters to sequences of `n` values,
+            with None or NaN for missing values. Parameters that no place has can be left out.
+        :param n: The number of places (int)
+
+        :return: A list of error messages, with None for the places that pass (list)
+        """
+        import numpy as np
+        import pandas as pd
+
+        present = {}
+        for key in self._PREFLIGHT_KEYS:
+            if key not in columns:
+                present[key] = np.zeros(n, dtype=bool)
+                continue
+            values = pd.Series(np.asarray(columns[key], dtype=object), dtype=object)
+            try:
+                blank = values.str.strip().eq('').fillna(False).to_numpy(dtype=bool)
+            except AttributeError:
+                # No strings in the column
+                blank = np.zeros(n, dtype=bool)
+            present[key] = values.notna().to_numpy() & ~blank
+
+        has_inputs = np.zeros(n, dtype=bool)
+        for inputs in self.MIN_INPUTS:
+            has_inputs |= np.logical_and.reduce([present[key] for key in inputs])
+
+        bad_coordinates = np.zeros(n, dtype=bool)
+        for key, bound in (('latitude', 90), ('longitude', 180)):
+            if key in columns:
+                values = pd.to_numeric(pd.Series(np.asarray(columns[key], dtype=object)), errors='coerce')
+                in_bounds = (values.abs() <= bound).to_numpy()
+                bad_coordinates |= present[key] & ~in_bounds
+
+        errors = np.full(n, None, dtype=object)
+        errors[~has_inputs] = self.MISSING_INPUTS_ERROR
+        errors[bad_coordinates] = self.INVALID_COORDINATES_ERROR
+        return errors.tolist()
+
+    @classmethod
+    def _normalize_query(cls, query_dict):
+        """
+        Normalize whitespace and case in the values of a place dictionary, and drop its
+        `query_id`, so that equivalent places compare equal.
+        """
+        normalized = {}
+        for key, value in query_dict.items():
+            if key == 'query_id':
+                continue
+            if isinstance(value, str):
+                value = ' '.join(value.split()).lower()
+            elif isinstance(value, dict):
+                value = cls._normalize_query(value)
+            normalized[key] = value
+        return normalized
+
+    @staticmethod
+    def _is_cacheable(response):
+        return isinstance(response, dict) and 'error' not in response and 'message' not in response
+
+    @staticmethod
+    def _strip_query_id(response):
+        return {k: v for k, v in response.items() if k != 'query_id'}
+
+    @staticmethod
+    def _output_columns(fields):
+        """
+        :return: The columns that lookups add to a DataFrame: placekey, the other requested
+            fields and error
+        """
+        return ['placekey'] + [f for f in (fields or []) if f != 'placekey'] + ['error']
+
+    @staticmethod
+    def _responses_to_columns(responses):
+        """
+        Gather the values of each output of a list of responses into a numpy array, with
+        None where a response doesn't have the output. `query_id` always comes first.
+        """
+        import numpy as np
+
+        names = {'query_id': None}
+        for response in responses:
+            names.update(dict.fromkeys(response))
+        return {name: np.fromiter((response.get(name) for response in responses), dtype=object,
+                                  count=len(responses))
+                for name in names}
+
+    @classmethod
+    def _responses_to_arrow(cls, responses):
+        """
+        Build a `pyarrow.Table` with a column per output of a list of responses.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("Arrow output requires pyarrow. Install it with `pip install pyarrow`.")
+
+        arrays = {}
+        for name, values in cls._responses_to_columns(responses).items():
+            try:
+                arrays[name] = pa.array(values, type=pa.string() if name == 'query_id' else None, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Outputs with values of several types are kept as strings
+                arrays[name] = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+        return pa.table(arrays)
 
     def _safe_parse_json(self, result):
         """
         Safely parse JSON response.
 
         Parameters:
-            result (str): JSON string.
+            result (bytes or str): JSON document.
 
         Returns:
             dict: Parsed JSON dictionary or empty list if parsing fails.
         """
         try:
-            return json.loads(result)
+            return _json_loads(result)
         except JSONDecodeError:
-            self.logger.error("JSONDecodeError parsing, returning empty list")
+            self._logger.error("JSONDecodeError parsing, returning empty list")
             return []
         except Exception as e:
-            self.logger.error(f"Error parsing: {e}, returning empty list")
-            return []
\ No newline at end of file
+            self._logger.error(f"Error parsing: {e}, returning empty list")
+            return []
+
+
+@contextlib.contextmanager
+def _verbosity(verbose):
+    token = _verbose.set(verbose)
+    try:
+        yield
+    finally:
+        _verbose.reset(token)
+
+
+class _CallLogger(logging.LoggerAdapter):
+    """
+    Log through a client's logger, letting INFO messages through during verbose calls
+    without changing the level of the logger, which other threads may be using.
+    """
+
+    def isEnabledFor(self, level):
+        return (_verbose.get() and level >= logging.INFO) or self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.isEnabledFor(level):
+            msg, kwargs = self.process(msg, kwargs)
+            self.logger._log(level, msg, args, **kwargs)
+
+
+class _ServerFailure(Exception):
+    """
+    Raised when the API keeps failing whole batches, whatever places they contain.
+    """
+
+
+class _ThreadLocalSession:
+    """
+    A `requests.Session` for each thread, as sessions aren't guaranteed to be thread-safe.
+    It can be used in place of a session for sending requests. A thread's session is
+    closed when the thread ends, so short-lived threads don't accumulate open sessions.
+    """
+
+    def __init__(self, pool_size):
+        self.pool_size = pool_size
+        self._local = threading.local()
+        # Only the threads' holders keep their sessions alive
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """
+        :return: The session of the calling thread, created on first use
+        """
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            holder = _SessionHolder(session)
+            # The thread-local holder is released when its thread ends
+            weakref.finalize(holder, session.close)
+            self._local.holder = holder
+            with self._lock:
+                self._sessions.add(session)
+        return holder.session
+
+    def post(self, *args, **kwargs):
+        return self.session.post(*args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self.session.get(*args, **kwargs)
+
+    def close(self):
+        """
+        Close the connections of the sessions of every live thread.
+        """
+        with self._lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.close()
+
+
+class _SessionHolder:
+    """
+    Holds the session of a thread in a `threading.local`.
+    """
+
+    __slots__ = ('session', '__weakref__')
+
+    def __init__(self, session):
+        self.session = session
+
+
+class _APIKey:
+    """
+    The request functions, rate limiter and health of a single API key.
+    """
+
+    def __init__(self, api_key, headers, rate_limiter, make_request, make_bulk_request):
+        self.api_key = api_key
+        self.headers = headers
+        self.rate_limiter = rate_limiter
+        self.make_request = make_request
+        self.make_bulk_request = make_bulk_request
+        self.cooldown_until = 0.0
+
+
+# Clients shared by the partitions looked up in a process, keyed by their settings
+_partition_clients = {}
+_partition_clients_lock = threading.Lock()
+
+
+def _lookup_partition(df, column_mapping, fields, concurrency, client_kwargs):
+    """
+    Look up the places of one partition of a distributed DataFrame, for
+    :mod:`placekey.spark` and :mod:`placekey.dask`.
+
+    The partitions looked up in a process share one client, and so one rate limiter. Its
+    rate limits are divided by `concurrency`, the number of processes looking up partitions
+    at once, so that together they stay within the limits of the API key.
+
+    :return: `df` with a column per output, in the order of
+        :meth:`PlacekeyAPI._output_columns`, and None for missing values
+    """
+    client = _partition_client(concurrency, client_kwargs)
+    output_columns = client._output_columns(fields)
+    out = client._placekey_pandas_df(df, column_mapping, fields=fields)
+    out = out.reindex(columns=list(df.columns) + output_columns)
+    out[output_columns] = out[output_columns].astype(object).where(out[output_columns].notna(), None)
+    return out
+
+
+def _partition_client(concurrency, client_kwargs):
+    key = repr((concurrency, sorted(client_kwargs.items())))
+    with _partition_clients_lock:
+        client = _partition_clients.get(key)
+        if client is None:
+            kwargs = dict(client_kwargs)
+            for limit, window in (('request_limit', 'request_window'),
+                                  ('bulk_request_limit', 'bulk_request_window')):
+                kwargs[limit], kwargs[window] = _share_rate_limit(
+                    kwargs.get(limit, getattr(PlacekeyAPI, limit.upper())),
+                    kwargs.get(window, getattr(PlacekeyAPI, window.upper())), concurrency)
+            client = _partition_clients[key] = PlacekeyAPI(**kwargs)
+        return client
+
+
+def _share_rate_limit(calls, period, shares):
+    """
+    :return: The (calls, period) limit of one of `shares` clients sharing a rate limit
+    """
+    if calls >= shares:
+        return calls // shares, period
+    return 1, period * shares / calls
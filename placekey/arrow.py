@@ -0,0 +1,296 @@
+"""
+Apache Arrow and Parquet I/O for Placekey columns.
+
+A Placekey column is stored either as a dictionary-encoded string array, or as the H3
+indexes of the where parts in a uint64 array with the :class:`PlacekeyType` extension
+type. Conversions between the two run on the Arrow buffers with numpy, without creating
+a Python string per row. Only the rare Placekeys that contain a replaced profanity go
+through the scalar code in :mod:`placekey.placekey`.
+
+"""
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    raise ImportError("placekey.arrow requires pyarrow. Install it with `pip install placekey[parquet]`.")
+
+from .placekey import (ALPHABET, ALPHABET_LENGTH, BASE_CELL_SHIFT, BASE_RESOLUTION, CODE_LENGTH,
+                       HEADER_INT, PADDING_CHAR, REPLACEMENT_CHARS, REPLACEMENT_MAP, TUPLE_LENGTH,
+                       UNUSED_RESOLUTION_FILLER, _decode_to_h3_int, _encode_h3_int)
+
+EXTENSION_NAME = 'placekey.h3'
+ENCODINGS = ('h3', 'dictionary')
+WHERE_LENGTH = CODE_LENGTH + CODE_LENGTH // TUPLE_LENGTH - 1
+PLACEKEY_LENGTH = WHERE_LENGTH + 1
+
+_SHORT_SHIFT = np.uint64(3 * (15 - BASE_RESOLUTION))
+_SHORT_MASK = np.uint64(2 ** 52 - 1)
+_UNSHORTEN_OFFSET = np.uint64(HEADER_INT + UNUSED_RESOLUTION_FILLER - BASE_CELL_SHIFT)
+_POWERS = np.array([ALPHABET_LENGTH ** i for i in range(CODE_LENGTH - 1, -1, -1)], dtype=np.uint64)
+_ALPHABET_BYTES = np.frombuffer(ALPHABET.encode('ascii'), dtype=np.uint8)
+# Byte value -> digit, with -1 for the padding character and -2 for anything invalid
+_DIGITS = np.full(256, -2, dtype=np.int8)
+_DIGITS[_ALPHABET_BYTES] = np.arange(ALPHABET_LENGTH)
+_DIGITS[ord(PADDING_CHAR)] = -1
+_CODE_POSITIONS = np.array([i for i in range(WHERE_LENGTH) if (i + 1) % (TUPLE_LENGTH + 1)])
+_DASH_POSITIONS = np.array([i for i in range(WHERE_LENGTH) if not (i + 1) % (TUPLE_LENGTH + 1)])
+
+
+class PlacekeyType(pa.ExtensionType):
+    """
+    Arrow extension type for Placekey where parts, stored as uint64 H3 indexes.
+    """
+
+    def __init__(self):
+        super().__init__(pa.uint64(), EXTENSION_NAME)
+
+    def __arrow_ext_serialize__(self):
+        return b''
+
+    @classmethod
+    def __arrow_ext_deserialize__(cls, storage_type, serialized):
+        return cls()
+
+    def __reduce__(self):
+        return PlacekeyType, ()
+
+
+try:
+    pa.register_extension_type(PlacekeyType())
+except pa.ArrowKeyError:
+    # Already registered, e.g. when this module is reloaded
+    pass
+
+
+def encode_placekeys(h3_array):
+    """
+    Encode H3 indexes into Placekeys.
+
+    :param h3_array: Arrow array of H3 indexes, either with the :class:`PlacekeyType` type
+        or as integers. Chunked arrays are converted chunk by chunk
+    :return: Arrow string array of Placekeys, with nulls where the input is null
+
+    """
+    if isinstance(h3_array, pa.ChunkedArray):
+        return pa.chunked_array([encode_placekeys(c) for c in h3_array.chunks], type=pa.string())
+    if isinstance(h3_array.type, PlacekeyType):
+        h3_array = h3_array.storage
+    h3_array = h3_array.cast(pa.uint64())
+
+    n = len(h3_array)
+    h3_ints = h3_array.fill_null(0).to_numpy(zero_copy_only=False)
+    chars = np.empty((n, PLACEKEY_LENGTH), dtype=np.uint8)
+    chars[:, 0] = ord('@')
+    chars[:, 1 + _DASH_POSITIONS] = ord('-')
+    chars[:, 1 + _CODE_POSITIONS] = _encode_digits(h3_ints)
+
+    # Profanities are replaced by the scalar code, which keeps the same length
+    profane = _contains_any(chars[:, 1 + _CODE_POSITIONS], [k for k, _ in REPLACEMENT_MAP])
+    for row in np.flatnonzero(profane):
+        if h3_array[row].is_valid:
+            chars[row] = np.frombuffer(_encode_h3_int(int(h3_ints[row])).encode('ascii'), dtype=np.uint8)
+
+    offsets = np.arange(0, (n + 1) * PLACEKEY_LENGTH, PLACEKEY_LENGTH, dtype=np.int32)
+    validity = h3_array.is_valid().buffers()[1] if h3_array.null_count else None
+    return pa.StringArray.from_buffers(n, pa.py_buffer(offsets), pa.py_buffer(chars.tobytes()),
+                                       validity, h3_array.null_count)
+
+
+def decode_placekeys(placekey_array):
+    """
+    Decode Placekeys into H3 indexes of their where parts. What parts are ignored.
+
+    :param placekey_array: Arrow string array of Placekeys, which may be dictionary
+        encoded, in which case only the dictionary is decoded. Chunked arrays are
+        converted chunk by chunk
+    :return: Arrow array of :class:`PlacekeyType`, with nulls for missing Placekeys and
+        Placekeys whose where part can't be decoded
+
+    """
+    if isinstance(placekey_array, pa.ChunkedArray):
+        return pa.chunked_array([decode_placekeys(c) for c in placekey_array.chunks], type=PlacekeyType())
+    if pa.types.is_dictionary(placekey_array.type):
+        decoded = decode_placekeys(placekey_array.dictionary).storage
+        return pa.ExtensionArray.from_storage(PlacekeyType(), decoded.take(placekey_array.indices))
+
+    placekey_array = placekey_array.cast(pa.large_string())
+    n = len(placekey_array)
+    _, offsets_buffer, data_buffer = placekey_array.buffers()
+    offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[placekey_array.offset:placekey_array.offset + n + 1]
+    data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.zeros(0, np.uint8)
+    if not len(data):
+        data = np.zeros(1, dtype=np.uint8)
+    starts, ends = offsets[:-1], offsets[1:]
+    lengths = ends - starts
+
+    # A where part alone, or a single '@' followed by the where part
+    at_signs = pc.count_substring(placekey_array, '@').fill_null(0).to_numpy(zero_copy_only=False)
+    valid = placekey_array.is_valid().to_numpy(zero_copy_only=False) & (
+        ((lengths == WHERE_LENGTH) & (at_signs == 0)) | ((lengths > WHERE_LENGTH) & (at_signs == 1)))
+    where_starts = np.where(valid, ends - WHERE_LENGTH, 0)
+    chars = np.take(data, where_starts[:, None] + np.arange(WHERE_LENGTH), mode='clip')
+    valid &= (chars[:, _DASH_POSITIONS] == ord('-')).all(axis=1)
+    valid &= (lengths == WHERE_LENGTH) | (np.take(data, where_starts - 1, mode='clip') == ord('@'))
+
+    code = chars[:, _CODE_POSITIONS]
+    digits = _DIGITS[code]
+    is_replacement = np.isin(code, np.frombuffer(REPLACEMENT_CHARS.encode('ascii'), dtype=np.uint8))
+    replaced = is_replacement.any(axis=1)
+    # Padding is only allowed in the first tuple; leading padding is the same as zeros
+    padding = digits == -1
+    leading = np.cumprod(padding, axis=1).astype(bool)
+    irregular_padding = (padding & ~leading).any(axis=1)
+    valid &= ~(digits[:, TUPLE_LENGTH:] == -1).any(axis=1)
+    valid &= ~((digits == -2) & ~is_replacement).any(axis=1)
+
+    short = (np.maximum(digits, 0).astype(np.uint64) * _POWERS).sum(axis=1, dtype=np.uint64)
+    h3_ints = (short << _SHORT_SHIFT) + _UNSHORTEN_OFFSET
+
+    # Rows with replaced profanities or padding inside the first tuple use the scalar code
+    for row in np.flatnonzero(valid & (replaced | irregular_padding)):
+        where = chars[row].tobytes().decode('ascii')
+        h3_ints[row] = _decode_to_h3_int(where)
+
+    storage = pa.array(h3_ints, type=pa.uint64(), mask=~valid)
+    return pa.ExtensionArray.from_storage(PlacekeyType(), storage)
+
+
+def to_placekey_column(array, encoding='dictionary'):
+    """
+    Convert a Placekey column to one of the Arrow encodings.
+
+    The "h3" encoding only keeps where parts, so string columns that hold Placekeys with
+    a what part, or values that aren't Placekeys, can't be converted to it without losing
+    data. Use :func:`decode_placekeys` to keep the where parts of such a column.
+
+    :param array: Arrow array of Placekeys, as strings (possibly dictionary encoded) or as
+        :class:`PlacekeyType`
+    :param encoding: "h3" for a :class:`PlacekeyType` column, or "dictionary" for a
+        dictionary-encoded string column. Default is "dictionary"
+    :return: Arrow array
+    :raises ValueError: If `encoding` is "h3" and the column has Placekeys with a what
+        part or values that can't be decoded
+
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError("encoding must be one of {}".format(", ".join(ENCODINGS)))
+    is_h3 = isinstance(array.type, PlacekeyType)
+    if encoding == 'h3':
+        if is_h3:
+            return array
+        decoded = decode_placekeys(array)
+        lost = _count_lost(array, decoded)
+        if lost:
+            raise ValueError(
+                "{} values have a what part or aren't Placekeys, and can't be stored in the 'h3' encoding. "
+                "Use the 'dictionary' encoding, or decode_placekeys to keep where parts only".format(lost))
+        return decoded
+    if is_h3:
+        array = encode_placekeys(array)
+    return array if pa.types.is_dictionary(array.type) else pc.dictionary_encode(array)
+
+
+def convert_placekey_columns(table, columns=('placekey',), encoding='dictionary'):
+    """
+    Convert Placekey columns of an Arrow table with :func:`to_placekey_column`.
+
+    :param table: Arrow table
+    :param columns: Names of the Placekey columns. Columns missing from the table are
+        ignored. Default is ("placekey",)
+    :param encoding: "h3" or "dictionary". Default is "dictionary"
+    :return: Arrow table
+
+    """
+    for column in columns:
+        if column in table.column_names:
+            i = table.column_names.index(column)
+            table = table.set_column(i, column, to_placekey_column(table.column(i), encoding))
+    return table
+
+
+def read_placekey_parquet(path, columns=None, placekey_columns=('placekey',), encoding=None):
+    """
+    Read a Parquet file into an Arrow table, with its Placekey columns in one of the
+    Arrow encodings. Files written with :func:`write_placekey_parquet` keep their
+    :class:`PlacekeyType` columns without any conversion.
+
+    :param path: Path of the Parquet file (string)
+    :param columns: Columns to read. Defaults to every column
+    :param placekey_columns: Names of the Placekey columns. Default is ("placekey",)
+    :param encoding: "h3" or "dictionary". Defaults to None, which keeps
+        :class:`PlacekeyType` columns as they are and reads string columns with the
+        "dictionary" encoding
+    :return: Arrow table
+
+    """
+    import pyarrow.parquet as pq
+
+    string_columns = [c for c in placekey_columns if columns is None or c in columns]
+    table = pq.read_table(path, columns=columns, read_dictionary=string_columns)
+    if encoding is None:
+        return table
+    return convert_placekey_columns(table, placekey_columns, encoding)
+
+
+def write_placekey_parquet(table, path, placekey_columns=('placekey',), encoding='dictionary', **kwargs):
+    """
+    Write an Arrow table to a Parquet file, with its Placekey columns in one of the
+    Arrow encodings.
+
+    :param table: Arrow table
+    :param path: Path of the Parquet file (string)
+    :param placekey_columns: Names of the Placekey columns. Default is ("placekey",)
+    :param encoding: "h3" or "dictionary". The "h3" encoding is smaller but only holds
+        where parts, see :func:`to_placekey_column`. Default is "dictionary"
+    :param kwargs: Additional arguments for `pyarrow.parquet.write_table`
+
+    """
+    import pyarrow.parquet as pq
+
+    pq.write_table(convert_placekey_columns(table, placekey_columns, encoding), path, **kwargs)
+
+
+def _count_lost(array, decoded):
+    """
+    :return: The number of non-null values of a string column that its decoded where
+        parts don't represent: values that can't be decoded and Placekeys with a what part
+    """
+    if isinstance(array, pa.ChunkedArray):
+        return sum(_count_lost(c, d) for c, d in zip(array.chunks, decoded.chunks))
+    if pa.types.is_dictionary(array.type):
+        lengths = pc.utf8_length(array.dictionary).take(array.indices)
+    else:
+        lengths = pc.utf8_length(array)
+    present = array.is_valid().to_numpy(zero_copy_only=False)
+    decodable = decoded.storage.is_valid().to_numpy(zero_copy_only=False)
+    lengths = lengths.fill_null(0).to_numpy(zero_copy_only=False)
+    return int((present & (~decodable | (lengths > PLACEKEY_LENGTH))).sum())
+
+
+def _encode_digits(h3_ints):
+    """
+    :return: The base 28 digits of the shortened H3 indexes as ASCII characters, with
+        leading zeros replaced by padding
+    """
+    short = ((h3_ints + np.uint64(BASE_CELL_SHIFT)) & _SHORT_MASK) >> _SHORT_SHIFT
+    digits = (short[:, None] // _POWERS) % np.uint64(ALPHABET_LENGTH)
+    chars = _ALPHABET_BYTES[digits.astype(np.intp)]
+    # Like the scalar encoder, a zero is encoded as a single digit
+    leading_zeros = np.cumprod(digits[:, :-1] == 0, axis=1).astype(bool)
+    leading_zeros = np.hstack([leading_zeros, np.zeros((len(digits), 1), dtype=bool)])
+    chars[leading_zeros] = ord(PADDING_CHAR)
+    return chars
+
+
+def _contains_any(chars, patterns):
+    """
+    :return: Boolean array of the rows of a character matrix that contain any pattern
+    """
+    rows = chars.copy().view('S{}'.format(chars.shape[1])).ravel()
+    found = np.zeros(len(rows), dtype=bool)
+    for pattern in patterns:
+        found |= np.char.find(rows, pattern.encode('ascii')) >= 0
+    return found
@@ -0,0 +1,169 @@
+"""
+Persistent caching of Placekey API responses. A cache can be passed to
+:class:`placekey.api.PlacekeyAPI` so that places which have already been looked
+up are served locally instead of being sent to the API again.
+
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def make_cache_key(query, fields=None):
+    """
+    Build a canonical key for a place dictionary and a list of requested fields.
+    The `query_id` of the place is ignored, as it does not affect the response.
+
+    :param query: A place dictionary (dict)
+    :param fields: A list of requested parameters other than placekey (list)
+    :return: A hex digest identifying the query (string)
+
+    """
+    canonical = {
+        'query': {k: v for k, v in query.items() if k != 'query_id'},
+        'fields': sorted(set(fields)) if fields else []
+    }
+    serialized = json.dumps(canonical, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class SQLiteCache:
+    """
+    A Placekey API response cache stored in a SQLite file. Responses are stored
+    without their `query_id` and keyed by :func:`make_cache_key`.
+
+    :param path: Path of the SQLite file. Use ":memory:" for a cache that is not
+        persisted (string)
+    :param ttl: Number of seconds a response stays valid. Defaults to None, in
+        which case responses never expire (float)
+    :param max_entries: Maximum number of responses to keep. The oldest responses
+        are evicted once this is exceeded. Defaults to None (unbounded) (int)
+
+    """
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)')
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)')
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Look up a single response.
+
+        :param key: Cache key (string)
+        :return: The cached response (dict) or None
+
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Look up several responses at once.
+
+        :param keys: An iterable of cache keys
+        :return: A dictionary mapping each key that was found to its response (dict)
+
+        """
+        keys = list(set(keys))
+        found = {}
+        with self._lock:
+            oldest = time.time() - self.ttl if self.ttl is not None else None
+            # Stay below SQLite's limit on the number of bound parameters
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                query = 'SELECT key, response FROM responses WHERE key IN ({})'.format(
+                    ','.join('?' * len(chunk)))
+                params = list(chunk)
+                if oldest is not None:
+                    query += ' AND created_at >= ?'
+                    params.append(oldest)
+                for key, response in self._conn.execute(query, params):
+                    found[key] = json.loads(response)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set(self, key, response):
+        """
+        Store a single response.
+
+        :param key: Cache key (string)
+        :param response: Placekey API response (dict)
+
+        """
+        self.set_many({key: response})
+
+    def set_many(self, responses):
+        """
+        Store several responses at once.
+
+        :param responses: A dictionary mapping cache keys to responses (dict)
+
+        """
+        if not responses:
+            return
+        now = time.time()
+        rows = [(k, json.dumps(v), now) for k, v in responses.items()]
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)',
+                rows)
+            self._evict()
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Remove every response from the cache and reset the hit-rate statistics.
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return: A dictionary with the number of hits, misses, the hit rate and the
+            number of stored responses
+
+        """
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries
+            }
+
+    def close(self):
+        """
+        Close the underlying SQLite connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._conn.execute(
+                'DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                'DELETE FROM responses WHERE key IN ('
+                'SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,))
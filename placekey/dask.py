@@ -0,0 +1,110 @@
+"""
+Placekey functions for Dask DataFrames.
+
+Each function runs the vectorized functions of :mod:`placekey.parallel` and
+:mod:`placekey.placekey` on every partition with `map_partitions`, so that the work is
+spread by the Dask scheduler instead of a process pool::
+
+    from placekey.dask import map_geo_to_placekey
+
+    ddf['placekey'] = map_geo_to_placekey(ddf['latitude'], ddf['longitude'])
+
+"""
+
+import pandas as pd
+
+try:
+    import dask.dataframe as dd
+except ImportError:
+    raise ImportError("placekey.dask requires dask. Install it with `pip install dask[dataframe]`.")
+
+from . import parallel
+from .api import PlacekeyAPI, _lookup_partition
+from .placekey import placekeys_are_valid
+
+
+def map_geo_to_placekey(latitudes, longitudes):
+    """
+    Convert latitude and longitude columns into Placekeys.
+
+    :param latitudes: Dask Series of latitudes (floats)
+    :param longitudes: Dask Series of longitudes (floats), partitioned like `latitudes`
+    :return: Dask Series of Placekeys (strings). Coordinates that can't be converted
+        give None
+
+    """
+    return dd.map_partitions(_geo_to_placekey_partition, latitudes, longitudes,
+                             meta=pd.Series(dtype=object, name='placekey'))
+
+
+def map_placekey_to_geo(placekeys):
+    """
+    Convert a Placekey column into the latitude and longitude of the center of each
+    Placekey.
+
+    :param placekeys: Dask Series of Placekeys (strings)
+    :return: Dask DataFrame with latitude and longitude columns (float64). Missing or
+        invalid Placekeys give NaN
+
+    """
+    return placekeys.map_partitions(_placekey_to_geo_partition,
+                                    meta=pd.DataFrame({'latitude': pd.Series(dtype='float64'),
+                                                       'longitude': pd.Series(dtype='float64')}))
+
+
+def map_placekey_format_is_valid(placekeys):
+    """
+    Check the format of a Placekey column, as :func:`placekey.placekey_format_is_valid`
+    does.
+
+    :param placekeys: Dask Series of Placekeys (strings)
+    :return: Dask Series of booleans. Missing values are not valid
+
+    """
+    return placekeys.map_partitions(_placekey_format_is_valid_partition,
+                                    meta=pd.Series(dtype=bool, name=placekeys.name))
+
+
+def lookup_placekeys(ddf, column_mapping, fields=None, concurrency=1, **client_kwargs):
+    """
+    Look up Placekeys for the rows of a Dask DataFrame with the Placekey API, one
+    partition at a time. Each partition is looked up as
+    :meth:`placekey.api.PlacekeyAPI._placekey_pandas_df` does, in bulk batches.
+
+    The rate limits of the client are a budget for the whole computation: they are
+    divided between the `concurrency` processes that look up partitions at once, and the
+    partitions looked up in the same process share a client.
+
+    :param ddf: A Dask DataFrame
+    :param column_mapping: Mapping from Placekey API inputs to column names (dict)
+    :param fields: A list of requested outputs other than placekey. Defaults to None
+    :param concurrency: Number of processes that look up partitions at once. Defaults to
+        1, which suits the threaded scheduler; use the number of worker processes with
+        the multiprocessing or distributed schedulers
+    :param client_kwargs: Arguments of :class:`placekey.api.PlacekeyAPI`, such as `api_key`
+        and `bulk_request_limit`. They must be picklable for schedulers with several
+        processes
+    :return: A Dask DataFrame with the columns of `ddf`, followed by a column for
+        placekey, each requested field and error
+
+    """
+    output_columns = PlacekeyAPI._output_columns(fields)
+    if set(output_columns) & set(ddf.columns):
+        raise ValueError("The DataFrame already has output columns: {}".format(output_columns))
+    meta = ddf._meta.assign(**{c: pd.Series(dtype=object) for c in output_columns})
+    return ddf.map_partitions(_lookup_partition, column_mapping, fields, concurrency, client_kwargs, meta=meta)
+
+
+def _geo_to_placekey_partition(latitudes, longitudes):
+    placekeys = pd.Series(parallel.map_geo_to_placekey(latitudes, longitudes, processes=1), index=latitudes.index,
+                          dtype=object, name='placekey')
+    return placekeys.where(placekeys != '', None)
+
+
+def _placekey_to_geo_partition(placekeys):
+    lats, longs = parallel.map_placekey_to_geo(placekeys, processes=1)
+    return pd.DataFrame({'latitude': lats, 'longitude': longs}, index=placekeys.index)
+
+
+def _placekey_format_is_valid_partition(placekeys):
+    return pd.Series(placekeys_are_valid(placekeys), index=placekeys.index, name=placekeys.name)
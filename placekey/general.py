@@ -1,49 +1,294 @@
+import contextlib
+import contextvars
 import itertools
 import json
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from email.utils import parsedate_to_datetime
 from json import JSONDecodeError
 
 import requests
-from ratelimit import limits, RateLimitException
+from ratelimit import RateLimitException
 import backoff
 
-def _post_request_function(headers, url, calls, period, max_tries):
+from .metrics import RequestEvent
+
+try:
+    # A faster JSON library, used for request and response bodies when it is installed
+    import orjson
+except ImportError:
+    orjson = None
+
+# Default (connect, read) timeout of each attempt, in seconds
+DEFAULT_TIMEOUT = (10, 60)
+
+# Monotonic time by which the requests of the current context must be done, if any
+_deadline = contextvars.ContextVar('placekey_deadline', default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+        """
+        Raised when a request can't be made before the deadline set with
+        :func:`request_deadline`. Requests that hit the deadline are not retried.
         """
-        Construct a rate limited function for making requests.
 
-        :param url: request URL
-        :param calls: number of calls that can be made in time period
-        :param  period: length of rate limiting time period in seconds
-        :param max_tries: the maximum number of retries before giving up
+
+class ThrottleLimitExceeded(RateLimitException):
+        """
+        Raised by a request function created with `max_throttles` once that many attempts
+        of a request were answered with a 429, so that the caller can move on to another
+        API key.
         """
 
-        @backoff.on_exception(backoff.fibo, (RateLimitException, requests.exceptions.RequestException),
-                              max_tries=max_tries)
-        @limits(calls=calls, period=period)
-        def make_request(request_data = None):
+        def __init__(self, message="Too many throttled requests"):
+            super().__init__(message, 0)
+
+
+@contextlib.contextmanager
+def request_deadline(seconds):
+        """
+        Limit the time spent on the requests made within the block, including retries,
+        backoff and rate limiting. A request that would start after the deadline raises
+        :class:`DeadlineExceeded`, and the timeouts of requests in flight are shortened to
+        the time remaining. Nested deadlines can only shorten the outer one. The deadline
+        follows the context, so it applies to the thread that entered the block.
+
+        :param seconds: Number of seconds from now, or None for no deadline
+        """
+        if seconds is None:
+            yield
+            return
+        deadline = time.monotonic() + seconds
+        current = _deadline.get()
+        token = _deadline.set(deadline if current is None else min(current, deadline))
+        try:
+            yield
+        finally:
+            _deadline.reset(token)
+
+
+def _json_dumps(obj):
+        """
+        :return: The JSON encoding of `obj` as UTF-8 bytes, using orjson if it is installed
+        """
+        if orjson is not None:
             try:
-                payload = {
-                    "url": url,
-                    "headers": headers,
-                }
-                if request_data:
-                    payload["data"] = json.dumps(request_data).encode('utf-8')
-                response = requests.post(**payload)
+                return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+            except TypeError:
+                # Types orjson doesn't handle, such as integer subclasses
+                pass
+        return json.dumps(obj).encode('utf-8')
+
+
+def _json_loads(data):
+        """
+        :param data: A JSON document (bytes or string)
+        :return: The decoded document, using orjson if it is installed
+        """
+        if orjson is not None:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                # Documents orjson rejects but json accepts, such as NaN values
+                pass
+        return json.loads(data)
+
+
+def _time_remaining():
+        """
+        :return: The number of seconds left before the current deadline, or None if there
+            is no deadline
+        """
+        deadline = _deadline.get()
+        return None if deadline is None else deadline - time.monotonic()
+
+
+class RateLimiter:
+        """
+        A thread-safe rate limiter that adapts to the responses of the server. Each
+        endpoint allows at most `calls` requests in a sliding window of `period` seconds.
+
+        The endpoints share a single budget in two ways: a `Retry-After` (or exhausted
+        rate-limit) header on any response pauses every endpoint until the server is ready,
+        and a 429 response on any endpoint cuts the allowed rate of every endpoint by
+        `decrease_factor`. Each successful response then ramps the rate back up by
+        `ramp_up` of the configured limit, until it is reached again.
+
+        :param limits: A dictionary mapping endpoint names to (calls, period) tuples
+        :param ramp_up: Fraction of the configured rate regained after each successful
+            response. Defaults to 0.05.
+        :param decrease_factor: Factor applied to the allowed rate after a 429 response.
+            Defaults to 0.5.
+        :param min_fraction: The smallest fraction of the configured rate the limiter will
+            slow down to. Defaults to 0.1.
+        """
+
+        def __init__(self, limits, ramp_up=0.05, decrease_factor=0.5, min_fraction=0.1):
+            self.limits = dict(limits)
+            self.ramp_up = ramp_up
+            self.decrease_factor = decrease_factor
+            self.min_fraction = min_fraction
+
+            self.fraction = 1.0
+            self.blocked_until = 0.0
+            self.consecutive_throttles = 0
+            self._calls = {endpoint: deque() for endpoint in self.limits}
+            self._lock = threading.Lock()
+
+        def allowed_calls(self, endpoint):
+            """
+            :return: The number of calls currently allowed per period for an endpoint (int)
+            """
+            calls, _ = self.limits[endpoint]
+            return max(1, int(calls * self.fraction))
+
+        def acquire(self, endpoint, timeout=None):
+            """
+            Block until a request to `endpoint` can be made, and record it.
+
+            :param endpoint: Endpoint name (string)
+            :param timeout: The longest time to wait in seconds, or None to wait as long as
+                needed. :class:`DeadlineExceeded` is raised, without waiting, if the
+                request can't be made in time.
+            :return: The number of seconds spent waiting (float)
+            """
+            waited = 0.0
+            while True:
+                wait = self._try_acquire(endpoint)
+                if wait <= 0:
+                    return waited
+                if timeout is not None and waited + wait > timeout:
+                    raise DeadlineExceeded("The rate limit doesn't allow a request before the deadline")
+                time.sleep(wait)
+                waited += wait
+
+        def wait_time(self, endpoint):
+            """
+            :param endpoint: Endpoint name (string)
+            :return: The number of seconds until a request to `endpoint` can be made (float)
+            """
+            with self._lock:
+                return self._wait_time(endpoint, time.monotonic())
+
+        def _wait_time(self, endpoint, now):
+            if self.blocked_until > now:
+                return self.blocked_until - now
+
+            _, period = self.limits[endpoint]
+            calls = self._calls[endpoint]
+            while calls and calls[0] <= now - period:
+                calls.popleft()
+            allowed = self.allowed_calls(endpoint)
+            if len(calls) >= allowed:
+                return calls[len(calls) - allowed] + period - now
+            return 0.0
+
+        def _try_acquire(self, endpoint):
+            with self._lock:
+                now = time.monotonic()
+                wait = self._wait_time(endpoint, now)
+                if wait <= 0:
+                    self._calls[endpoint].append(now)
+                return wait
+
+        def update(self, endpoint, response):
+            """
+            Adjust the limiter to a server response.
+
+            :param endpoint: Endpoint name (string)
+            :param response: A `requests.Response`
+            """
+            retry_after = _parse_retry_after(response.headers)
+            with self._lock:
+                if retry_after is not None:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
 
                 if response.status_code == 429:
-                    raise RateLimitException("Rate limit exceeded", 0)
-                elif response.status_code == 503:
-                    raise requests.exceptions.RequestException("Service Unavailable")
-                elif response.status_code == 504:
-                    raise requests.exceptions.RequestException("Gateway Timeout")
+                    self.consecutive_throttles += 1
+                    self.fraction = max(self.min_fraction, self.fraction * self.decrease_factor)
+                else:
+                    self.consecutive_throttles = 0
+                    self.fraction = min(1.0, self.fraction + self.ramp_up)
 
-                return response
-            except requests.exceptions.RequestException as e:
-                raise e
 
-        return make_request
+def _parse_retry_after(headers):
+        """
+        Return the number of seconds the server asked clients to wait, based on the
+        `Retry-After` header or on rate-limit headers reporting no remaining calls.
+        Returns None if the headers don't ask for a pause.
+        """
+        retry_after = headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    return None
+
+        for prefix in ('X-RateLimit-', 'RateLimit-'):
+            remaining = headers.get(prefix + 'Remaining')
+            reset = headers.get(prefix + 'Reset')
+            if remaining is None or reset is None:
+                continue
+            try:
+                if float(remaining) > 0:
+                    return None
+                reset = float(reset)
+            except ValueError:
+                return None
+            # The reset is either a number of seconds or a Unix timestamp
+            return max(0.0, reset - time.time()) if reset > 1e9 else reset
+        return None
+
+
+def _post_request_function(headers, url, calls, period, max_tries, rate_limiter=None, endpoint=None,
+                           instrumentation=None, timeout=DEFAULT_TIMEOUT, hedge_after=None, session=None,
+                           max_throttles=None):
+        """
+        Construct a rate limited function for making requests.
+
+        :param url: request URL
+        :param calls: number of calls that can be made in time period
+        :param  period: length of rate limiting time period in seconds
+        :param max_tries: the maximum number of retries before giving up
+        :param rate_limiter: a `RateLimiter` to share with other request functions. A new
+            one is created from `calls` and `period` if this is None.
+        :param endpoint: the name of the endpoint in `rate_limiter`. Defaults to `url`.
+        :param instrumentation: a `placekey.metrics.Instrumentation` that receives a
+            `RequestEvent` for every call. Defaults to None.
+        :param timeout: the timeout of each attempt in seconds, either a number or a
+            (connect, read) tuple as in `requests`, or None for no timeout. Defaults to
+            `DEFAULT_TIMEOUT`, so that a stalled connection is retried instead of hanging.
+        :param hedge_after: if set, an attempt that hasn't been answered after this many
+            seconds is sent a second time, and the first response is used. Defaults to None.
+        :param session: a `requests.Session` to send requests with, so that connections are
+            reused. Defaults to None, in which case each request opens a new connection.
+        :param max_throttles: if set, the number of 429 responses after which the request
+            gives up with `ThrottleLimitExceeded`, even if `max_tries` allows more retries.
+            Other failures are still retried up to `max_tries`. Defaults to None.
+        """
+        def send(request_data, event, timeout):
+            payload = {
+                "url": url,
+                "headers": headers,
+                "timeout": timeout,
+            }
+            if request_data:
+                payload["data"] = _json_dumps(request_data)
+                event.request_bytes = len(payload["data"])
+            return (session or requests).post(**payload)
 
-def _get_request_function(headers, url, calls, period, max_tries):
+        return _request_function(send, url, calls, period, max_tries, rate_limiter, endpoint, instrumentation,
+                                 timeout, hedge_after, max_throttles)
+
+def _get_request_function(headers, url, calls, period, max_tries, rate_limiter=None, endpoint=None,
+                          instrumentation=None, timeout=DEFAULT_TIMEOUT, hedge_after=None, session=None,
+                          max_throttles=None):
         """
         Construct a rate limited function for making requests.
 
@@ -51,30 +296,147 @@ def _get_request_function(headers, url, calls, period, max_tries):
         :param calls: number of calls that can be made in time period
         :param  period: length of rate limiting time period in seconds
         :param max_tries: the maximum number of retries before giving up
+        :param rate_limiter: a `RateLimiter` to share with other request functions. A new
+            one is created from `calls` and `period` if this is None.
+        :param endpoint: the name of the endpoint in `rate_limiter`. Defaults to `url`.
+        :param instrumentation: a `placekey.metrics.Instrumentation` that receives a
+            `RequestEvent` for every call. Defaults to None.
+        :param timeout: the timeout of each attempt in seconds, either a number or a
+            (connect, read) tuple as in `requests`, or None for no timeout. Defaults to
+            `DEFAULT_TIMEOUT`, so that a stalled connection is retried instead of hanging.
+        :param hedge_after: if set, an attempt that hasn't been answered after this many
+            seconds is sent a second time, and the first response is used. Defaults to None.
+        :param session: a `requests.Session` to send requests with, so that connections are
+            reused. Defaults to None, in which case each request opens a new connection.
+        :param max_throttles: if set, the number of 429 responses after which the request
+            gives up with `ThrottleLimitExceeded`, even if `max_tries` allows more retries.
+            Other failures are still retried up to `max_tries`. Defaults to None.
+        """
+        def send(params, event, timeout):
+            payload = {
+                "url": url,
+                "headers": headers,
+                "timeout": timeout,
+            }
+            if params:
+                payload["params"] = params
+            return (session or requests).get(**payload)
+
+        return _request_function(send, url, calls, period, max_tries, rate_limiter, endpoint, instrumentation,
+                                 timeout, hedge_after, max_throttles)
+
+def _request_function(send, url, calls, period, max_tries, rate_limiter, endpoint, instrumentation,
+                      timeout=None, hedge_after=None, max_throttles=None):
+        """
+        Wrap `send` with rate limiting, retries, timeouts, hedging and instrumentation.
         """
+        endpoint = endpoint or url
+        if rate_limiter is None:
+            rate_limiter = RateLimiter({endpoint: (calls, period)})
+        if hedge_after is not None:
+            send = _hedged(send, hedge_after, rate_limiter, endpoint)
+
+        def on_backoff(details):
+            event = details['args'][1]
+            event.retries += 1
+            event.backoff_wait += details['wait']
 
+        # Backoff doesn't wait past the deadline, and requests that hit it or the throttle
+        # limit aren't retried
         @backoff.on_exception(backoff.fibo, (RateLimitException, requests.exceptions.RequestException),
-                              max_tries=max_tries)
-        @limits(calls=calls, period=period)
-        def make_request(params = None):
+                              max_tries=max_tries, max_time=_time_remaining, on_backoff=on_backoff,
+                              giveup=lambda e: isinstance(e, (DeadlineExceeded, ThrottleLimitExceeded)))
+        def attempt(request_data, event):
+            remaining = _time_remaining()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded("Deadline exceeded")
+            event.rate_limit_wait += rate_limiter.acquire(endpoint, timeout=remaining)
+            start = time.monotonic()
             try:
-                payload = {
-                    "url": url,
-                    "headers": headers,
-                }
-                if params:
-                    payload["params"] = params
-                response = requests.get(**payload)
+                response = send(request_data, event, _attempt_timeout(timeout, _time_remaining()))
+            finally:
+                event.network_time += time.monotonic() - start
+            rate_limiter.update(endpoint, response)
+            event.status = response.status_code
+            event.response_bytes = len(response.content or b'')
 
-                if response.status_code == 429:
-                    raise RateLimitException("Rate limit exceeded", 0)
-                elif response.status_code == 503:
-                    raise requests.exceptions.RequestException("Service Unavailable")
-                elif response.status_code == 504:
-                    raise requests.exceptions.RequestException("Gateway Timeout")
+            if response.status_code == 429:
+                event.throttles += 1
+                if max_throttles is not None and event.throttles >= max_throttles:
+                    raise ThrottleLimitExceeded()
+                raise RateLimitException("Rate limit exceeded", 0)
+            elif response.status_code == 503:
+                raise requests.exceptions.RequestException("Service Unavailable")
+            elif response.status_code == 504:
+                raise requests.exceptions.RequestException("Gateway Timeout")
+
+            return response
+
+        def make_request(request_data = None):
+            event = RequestEvent(endpoint, batch_size=_batch_size(request_data))
+            start = time.monotonic()
+            try:
+                return attempt(request_data, event)
+            except Exception as e:
+                event.error = type(e).__name__
+                raise
+            finally:
+                event.latency = time.monotonic() - start
+                if instrumentation is not None:
+                    instrumentation.record_request(event)
+
+        return make_request
+
+def _attempt_timeout(timeout, remaining):
+        """
+        :return: The timeout of an attempt, shortened to the time remaining before the
+            deadline, if any
+        """
+        if remaining is None:
+            return timeout
+        remaining = max(remaining, 0.001)
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+def _hedged(send, hedge_after, rate_limiter, endpoint):
+        """
+        Wrap `send` so that a request that is still waiting for a response after
+        `hedge_after` seconds is sent a second time, if the rate limit allows it right away.
+        Whichever response arrives first is used; the other is left to finish in the
+        background.
+        """
+        executor = ThreadPoolExecutor(thread_name_prefix='placekey-hedge')
+
+        def hedged_send(request_data, event, timeout):
+            primary = executor.submit(send, request_data, event, timeout)
+            try:
+                return primary.result(timeout=hedge_after)
+            except FutureTimeoutError:
+                pass
+            if rate_limiter.wait_time(endpoint) > 0:
+                return primary.result()
+
+            rate_limiter.acquire(endpoint)
+            event.hedges += 1
+            hedge = executor.submit(send, request_data, event, timeout)
+            done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+            # The first request to finish failed, so the other one gets its chance
+            for future in pending:
+                return future.result()
+            return primary.result()
 
-                return response
-            except requests.exceptions.RequestException as e:
-                raise e
+        return hedged_send
 
-        return make_request
\ No newline at end of file
+def _batch_size(request_data):
+        if isinstance(request_data, dict):
+            if 'queries' in request_data:
+                return len(request_data['queries'])
+            if 'query' in request_data:
+                return 1
+        return 0
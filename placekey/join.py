@@ -0,0 +1,307 @@
+"""
+Joining datasets on Placekeys locally, without querying the Placekey API. Placekeys are
+encoded as integers (H3 indexes, or codes for whole Placekeys) before matching, which
+avoids hashing and comparing long Python strings for every row.
+
+"""
+
+import h3.api.basic_int as h3_int
+
+from .placekey import RESOLUTION, _h3_parents, placekeys_to_h3_ints
+
+JOIN_MODES = ('exact', 'where', 'parent', 'grid')
+
+
+def join_placekeys(left, right, on='placekey', left_on=None, right_on=None, how='inner',
+                   mode='exact', resolution=None, k=1, suffixes=('_x', '_y')):
+    """
+    Join two pandas DataFrames on Placekey columns.
+
+    The `mode` controls which rows match:
+
+    * "exact": the Placekeys are identical, including their what parts.
+    * "where": the Placekeys have the same where part, whatever their what parts.
+    * "parent": the where parts have the same parent H3 cell at `resolution`.
+    * "grid": the where parts are at most `k` H3 cells apart.
+
+    For "grid" joins only the distinct cells of the left side are expanded into their
+    neighborhoods, and neighbors that don't occur on the right side are dropped before
+    any rows are matched.
+
+    :param left: pandas DataFrame
+    :param right: pandas DataFrame
+    :param on: Name of the Placekey column in both DataFrames. Default is "placekey"
+    :param left_on: Name of the Placekey column in `left`. Defaults to `on`
+    :param right_on: Name of the Placekey column in `right`. Defaults to `on`
+    :param how: One of "inner", "left", "right" or "outer". Default is "inner"
+    :param mode: One of "exact", "where", "parent" or "grid". Default is "exact"
+    :param resolution: H3 resolution of the parent cells for "parent" joins (int)
+    :param k: Maximal grid distance for "grid" joins. Default is 1
+    :param suffixes: Suffixes added to column names that occur in both DataFrames
+    :return: The joined pandas DataFrame. Exact joins follow `pandas.merge`: missing
+        Placekeys match each other, joins on a shared column name keep a single Placekey
+        column, and rows come in the same order. Exact "right" and "outer" joins are done
+        with `pandas.merge`.
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    left_on = left_on or on
+    right_on = right_on or on
+    if how not in ('inner', 'left', 'right', 'outer'):
+        raise ValueError("how must be one of 'inner', 'left', 'right' or 'outer'")
+    if mode not in JOIN_MODES:
+        raise ValueError("mode must be one of {}".format(JOIN_MODES))
+    if mode == 'parent' and (resolution is None or not 0 <= resolution <= RESOLUTION):
+        raise ValueError("parent joins need a resolution between 0 and {}".format(RESOLUTION))
+
+    if mode == 'exact' and how in ('right', 'outer'):
+        # pandas.merge orders these joins by key, which the matching below doesn't reproduce
+        keys = {'on': left_on} if left_on == right_on else {'left_on': left_on, 'right_on': right_on}
+        return pd.merge(left, right, how=how, suffixes=suffixes, **keys)
+
+    left_keys, right_keys = _join_keys(left[left_on], right[right_on], mode, resolution)
+    if mode == 'grid':
+        left_idx, right_idx = _match_grid(left_keys, right_keys, k)
+    else:
+        left_idx, right_idx = _match_equal(left_keys, right_keys)
+
+    # Follow pandas.merge, which orders inner and left joins by the left rows, and the
+    # matches of each left row by the right rows
+    if how in ('left', 'outer'):
+        unmatched = np.setdiff1d(np.arange(len(left)), left_idx)
+        left_idx = np.concatenate([left_idx, unmatched])
+        right_idx = np.concatenate([right_idx, np.full(len(unmatched), -1)])
+    order = np.lexsort((right_idx, left_idx))
+    left_idx, right_idx = left_idx[order], right_idx[order]
+    if how in ('right', 'outer'):
+        unmatched = np.setdiff1d(np.arange(len(right)), right_idx)
+        left_idx = np.concatenate([left_idx, np.full(len(unmatched), -1)])
+        right_idx = np.concatenate([right_idx, unmatched])
+
+    merge_on = mode == 'exact' and left_on == right_on
+    overlap = set(left.columns) & set(right.columns)
+    if merge_on:
+        overlap.discard(left_on)
+    left_part = _take(left, left_idx).rename(columns={c: c + suffixes[0] for c in overlap})
+    right_part = _take(right, right_idx).rename(columns={c: c + suffixes[1] for c in overlap})
+
+    if merge_on:
+        key = left_part[left_on].where(left_idx >= 0, right_part[right_on])
+        left_part[left_on] = key
+        right_part = right_part.drop(columns=[right_on])
+    return pd.concat([left_part, right_part], axis=1)
+
+
+def _join_keys(left_placekeys, right_placekeys, mode, resolution):
+    """
+    Encode the Placekeys of both sides as int64 keys. Rows that can't match anything
+    get the key 0.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if mode == 'exact':
+        # Codes over the union of both columns, shifted so that they are never 0. Missing
+        # values get a code too, as pandas.merge matches them with each other.
+        codes, _ = pd.factorize(pd.concat([left_placekeys, right_placekeys], ignore_index=True),
+                                use_na_sentinel=False)
+        codes = codes.astype(np.int64) + 1
+        return codes[:len(left_placekeys)], codes[len(left_placekeys):]
+
+    left_keys = placekeys_to_h3_ints(left_placekeys)
+    right_keys = placekeys_to_h3_ints(right_placekeys)
+    if mode == 'parent':
+        left_keys = _h3_parents(left_keys, resolution)
+        right_keys = _h3_parents(right_keys, resolution)
+    return left_keys, right_keys
+
+
+def _match_equal(left_keys, right_keys):
+    """
+    :return: Arrays of the left and right positions of every pair of equal, non-zero keys
+    """
+    import numpy as np
+    import pandas as pd
+
+    left_frame = pd.DataFrame({'key': left_keys, 'left': np.arange(len(left_keys))})
+    right_frame = pd.DataFrame({'key': right_keys, 'right': np.arange(len(right_keys))})
+    pairs = left_frame[left_frame['key'] != 0].merge(right_frame[right_frame['key'] != 0], on='key')
+    return pairs['left'].to_numpy(), pairs['right'].to_numpy()
+
+
+def _match_grid(left_keys, right_keys, k):
+    """
+    :return: Arrays of the left and right positions of every pair of cells at most `k`
+        cells apart
+    """
+    import numpy as np
+    import pandas as pd
+
+    left_cells = np.unique(left_keys[left_keys != 0])
+    right_cells = np.unique(right_keys[right_keys != 0])
+
+    sources = []
+    neighbors = []
+    for cell in left_cells.tolist():
+        disk = h3_int.grid_disk(cell, k)
+        sources.extend([cell] * len(disk))
+        neighbors.extend(disk)
+    neighborhood = pd.DataFrame({
+        'key': np.asarray(sources, dtype=np.int64),
+        'neighbor': np.asarray(neighbors, dtype=np.int64)
+    })
+    neighborhood = neighborhood[np.isin(neighborhood['neighbor'].to_numpy(), right_cells)]
+
+    left_frame = pd.DataFrame({'key': left_keys, 'left': np.arange(len(left_keys))})
+    right_frame = pd.DataFrame({'neighbor': right_keys, 'right': np.arange(len(right_keys))})
+    pairs = left_frame.merge(neighborhood, on='key').merge(right_frame, on='neighbor')
+    return pairs['left'].to_numpy(), pairs['right'].to_numpy()
+
+
+def _take(df, positions):
+    """
+    Select rows by position, with -1 selecting a row of missing values.
+    """
+    return df.reset_index(drop=True).reindex(positions).reset_index(drop=True)
+
+
+def proximity_join(left, right, max_meters, partition_size=100000, max_k=2):
+    """
+    Find every pair of Placekeys from two datasets whose centers are at most `max_meters`
+    apart, like :func:`placekey.placekey_distance`.
+
+    Candidate pairs are generated on an H3 grid coarse enough that matching cells are at
+    most a few cells apart. The left Placekeys are processed in partitions of
+    `partition_size` rows, so memory use is bounded by the candidates of one partition
+    rather than by the size of either dataset. Every candidate is then checked with the
+    haversine distance.
+
+    :param left: Sequence of Placekeys (strings)
+    :param right: Sequence of Placekeys (strings)
+    :param max_meters: Maximal distance in meters between matched Placekeys (float)
+    :param partition_size: Number of left Placekeys processed at a time. Default is 100000
+    :param max_k: Maximal grid distance searched on the coarse grid. Larger values search a
+        finer grid with more cells per Placekey. Default is 2
+    :return: A tuple (left_idx, right_idx, distance) of numpy arrays with the positions of
+        each matched pair in `left` and `right`, and their distance in meters
+
+    """
+    import numpy as np
+
+    resolution, k = _proximity_grid(max_meters, max_k)
+    left_lat, left_lng, left_cells = _centers_and_cells(placekeys_to_h3_ints(left), resolution)
+    right_lat, right_lng, right_cells = _centers_and_cells(placekeys_to_h3_ints(right), resolution)
+
+    # Right positions sorted by cell, so that the rows of a cell form a contiguous range
+    right_order = np.argsort(right_cells, kind='stable')
+    sorted_right_cells = right_cells[right_order]
+
+    left_matches, right_matches, distances = [], [], []
+    for start in range(0, len(left_cells), partition_size):
+        chunk_cells = left_cells[start:start + partition_size]
+        valid = np.flatnonzero(chunk_cells != 0) + start
+        if not len(valid):
+            continue
+
+        # Neighborhoods of the distinct cells in this partition, as ranges of right rows
+        unique_cells, inverse = np.unique(left_cells[valid], return_inverse=True)
+        disks = [h3_int.grid_disk(cell, k) for cell in unique_cells.tolist()]
+        disk_sizes = np.fromiter((len(d) for d in disks), dtype=np.int64, count=len(disks))
+        neighbors = np.fromiter((n for d in disks for n in d), dtype=np.int64, count=disk_sizes.sum())
+        owners = np.repeat(np.arange(len(unique_cells)), disk_sizes)
+        lo = np.searchsorted(sorted_right_cells, neighbors, side='left')
+        hi = np.searchsorted(sorted_right_cells, neighbors, side='right')
+        found = hi > lo
+        owners, lo, hi = owners[found], lo[found], hi[found]
+
+        # Join left rows to the neighbor ranges of their cell
+        by_owner = np.argsort(owners, kind='stable')
+        owners, lo, hi = owners[by_owner], lo[by_owner], hi[by_owner]
+        first = np.searchsorted(owners, np.arange(len(unique_cells)), side='left')
+        last = np.searchsorted(owners, np.arange(len(unique_cells)), side='right')
+        row_ranges = last[inverse] - first[inverse]
+        left_rows = np.repeat(valid, row_ranges)
+        range_idx = _expand_ranges(first[inverse], row_ranges)
+
+        # Expand each neighbor range into right positions
+        range_sizes = hi[range_idx] - lo[range_idx]
+        candidate_left = np.repeat(left_rows, range_sizes)
+        candidate_right = right_order[_expand_ranges(lo[range_idx], range_sizes)]
+
+        distance = _haversine(left_lat[candidate_left], left_lng[candidate_left],
+                              right_lat[candidate_right], right_lng[candidate_right])
+        close = distance <= max_meters
+        left_matches.append(candidate_left[close])
+        right_matches.append(candidate_right[close])
+        distances.append(distance[close])
+
+    if not left_matches:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    return np.concatenate(left_matches), np.concatenate(right_matches), np.concatenate(distances)
+
+
+def _proximity_grid(max_meters, max_k):
+    """
+    Choose the finest H3 resolution at which points at most `max_meters` apart lie in
+    cells at most `max_k` cells apart.
+
+    The prefix distances of :func:`placekey.get_prefix_distance_dict` don't line up with
+    H3 resolutions, so the bound is based on H3 edge lengths instead. Edges can be about
+    half the average length, so cell centers are at least sqrt(3) / 2 average edges apart.
+
+    :return: A tuple (resolution, k)
+    """
+    import math
+
+    for resolution in range(RESOLUTION, -1, -1):
+        spacing = math.sqrt(3) / 2 * h3_int.average_hexagon_edge_length(resolution, unit='m')
+        k = int(math.ceil(max_meters / spacing)) + 1
+        if k <= max_k or resolution == 0:
+            return resolution, k
+
+
+def _centers_and_cells(h3_ints, resolution):
+    """
+    :return: Latitudes and longitudes of the cell centers, and the cells containing the
+        centers at `resolution`. Missing Placekeys have the cell 0
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(h3_ints)
+    lat = np.zeros(len(uniques))
+    lng = np.zeros(len(uniques))
+    cells = np.zeros(len(uniques), dtype=np.int64)
+    for i, h in enumerate(uniques.tolist()):
+        if h == 0:
+            continue
+        lat[i], lng[i] = h3_int.cell_to_latlng(h)
+        # Containing cells rather than H3 parents, as children can stick out of their parent
+        cells[i] = h3_int.latlng_to_cell(lat[i], lng[i], resolution)
+    return lat[codes], lng[codes], cells[codes]
+
+
+def _expand_ranges(starts, sizes):
+    """
+    Concatenate the ranges [start, start + size) into a single array.
+    """
+    import numpy as np
+
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return np.repeat(starts, sizes) + np.arange(sizes.sum()) - offsets
+
+
+def _haversine(lat_1, long_1, lat_2, long_2):
+    """
+    Vectorized version of :func:`placekey.placekey._geo_distance`, in meters.
+    """
+    import numpy as np
+
+    earth_radius = 6371  # In km
+    lat_1, long_1, lat_2, long_2 = (np.radians(x) for x in (lat_1, long_1, lat_2, long_2))
+    hav_lat = 0.5 * (1 - np.cos(lat_1 - lat_2))
+    hav_long = 0.5 * (1 - np.cos(long_1 - long_2))
+    radical = np.sqrt(hav_lat + np.cos(lat_1) * np.cos(lat_2) * hav_long)
+    return 2 * earth_radius * np.arcsin(np.minimum(radical, 1.0)) * 1000
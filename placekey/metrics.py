@@ -0,0 +1,320 @@
+"""
+Instrumentation of Placekey API requests. An instrumentation object passed to
+:class:`placekey.api.PlacekeyAPI` receives a :class:`RequestEvent` for every request,
+including its retries, and a :class:`BatchEvent` for every batch of places looked up.
+
+:class:`MetricsAggregator` keeps running totals in memory. The OpenTelemetry and
+Prometheus adapters forward the same events to those libraries, which are only imported
+when an adapter is created.
+
+"""
+
+import threading
+from collections import Counter, deque
+
+from .__version__ import __version__
+
+
+class RequestEvent:
+    """
+    A call of a request function, from the first attempt to the last retry.
+
+    :ivar endpoint: Endpoint name (string)
+    :ivar batch_size: Number of places in the request (int)
+    :ivar status: HTTP status of the last response, or None if no response was received
+    :ivar error: Name of the exception raised by the call, or None
+    :ivar latency: Total duration of the call in seconds (float)
+    :ivar network_time: Seconds spent waiting on the server (float)
+    :ivar rate_limit_wait: Seconds spent waiting on the rate limiter (float)
+    :ivar backoff_wait: Seconds spent backing off between retries (float)
+    :ivar retries: Number of retries after the first attempt (int)
+    :ivar throttles: Number of attempts answered with a 429 (int)
+    :ivar hedges: Number of duplicate requests sent for slow attempts (int)
+    :ivar request_bytes: Size of the last request body in bytes (int)
+    :ivar response_bytes: Size of the last response body in bytes (int)
+    """
+
+    def __init__(self, endpoint, batch_size=1):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.status = None
+        self.error = None
+        self.latency = 0.0
+        self.network_time = 0.0
+        self.rate_limit_wait = 0.0
+        self.backoff_wait = 0.0
+        self.retries = 0
+        self.throttles = 0
+        self.hedges = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    @property
+    def outcome(self):
+        """
+        :return: The HTTP status, or the exception name if no response was received (string)
+        """
+        if self.status is not None:
+            return str(self.status)
+        return self.error or 'unknown'
+
+    def __repr__(self):
+        return 'RequestEvent({})'.format(', '.join('{}={!r}'.format(k, v) for k, v in vars(self).items()))
+
+
+class BatchEvent:
+    """
+    A batch of places looked up with the Placekey API.
+
+    :ivar endpoint: Endpoint name (string)
+    :ivar batch_size: Number of places in the batch (int)
+    :ivar row_errors: Number of places that got an error instead of a Placekey (int)
+    :ivar latency: Duration of the lookup in seconds, including parsing (float)
+    """
+
+    def __init__(self, endpoint, batch_size, row_errors, latency):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.row_errors = row_errors
+        self.latency = latency
+
+    def __repr__(self):
+        return 'BatchEvent({})'.format(', '.join('{}={!r}'.format(k, v) for k, v in vars(self).items()))
+
+
+class Instrumentation:
+    """
+    Base class for instrumentation. Subclasses override the methods for the events they
+    are interested in. The methods can be called from several threads at once.
+    """
+
+    def record_request(self, event):
+        """
+        :param event: A :class:`RequestEvent`
+        """
+
+    def record_batch(self, event):
+        """
+        :param event: A :class:`BatchEvent`
+        """
+
+
+class CompositeInstrumentation(Instrumentation):
+    """
+    Forward events to several instrumentation objects.
+
+    :param instrumentations: Instrumentation objects
+    """
+
+    def __init__(self, *instrumentations):
+        self.instrumentations = instrumentations
+
+    def record_request(self, event):
+        for instrumentation in self.instrumentations:
+            instrumentation.record_request(event)
+
+    def record_batch(self, event):
+        for instrumentation in self.instrumentations:
+            instrumentation.record_batch(event)
+
+
+class MetricsAggregator(Instrumentation):
+    """
+    Aggregate events in memory, per endpoint.
+
+    :param max_samples: Number of recent request latencies kept for percentiles.
+        Defaults to 10000.
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _stats(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = {
+                'requests': 0, 'outcomes': Counter(), 'retries': 0, 'hedges': 0, 'latency': 0.0,
+                'network_time': 0.0, 'rate_limit_wait': 0.0, 'backoff_wait': 0.0,
+                'request_bytes': 0, 'response_bytes': 0, 'batches': 0, 'rows': 0,
+                'row_errors': 0, 'latencies': deque(maxlen=self.max_samples)
+            }
+        return stats
+
+    def record_request(self, event):
+        with self._lock:
+            stats = self._stats(event.endpoint)
+            stats['requests'] += 1
+            stats['outcomes'][event.outcome] += 1
+            stats['retries'] += event.retries
+            stats['hedges'] += event.hedges
+            stats['latency'] += event.latency
+            stats['network_time'] += event.network_time
+            stats['rate_limit_wait'] += event.rate_limit_wait
+            stats['backoff_wait'] += event.backoff_wait
+            stats['request_bytes'] += event.request_bytes
+            stats['response_bytes'] += event.response_bytes
+            stats['latencies'].append(event.latency)
+
+    def record_batch(self, event):
+        with self._lock:
+            stats = self._stats(event.endpoint)
+            stats['batches'] += 1
+            stats['rows'] += event.batch_size
+            stats['row_errors'] += event.row_errors
+
+    def summary(self):
+        """
+        :return: A dictionary mapping each endpoint to its totals, the count of each
+            outcome (HTTP status or exception name), and the mean, median, 95th percentile
+            and maximum of the recent request latencies
+        """
+        with self._lock:
+            summary = {}
+            for endpoint, stats in self._endpoints.items():
+                endpoint_summary = {k: v for k, v in stats.items() if k not in ('outcomes', 'latencies')}
+                endpoint_summary['outcomes'] = dict(stats['outcomes'])
+                latencies = sorted(stats['latencies'])
+                endpoint_summary['latency_mean'] = stats['latency'] / stats['requests'] if stats['requests'] else 0.0
+                endpoint_summary['latency_p50'] = _percentile(latencies, 0.5)
+                endpoint_summary['latency_p95'] = _percentile(latencies, 0.95)
+                endpoint_summary['latency_max'] = latencies[-1] if latencies else 0.0
+                summary[endpoint] = endpoint_summary
+            return summary
+
+    def reset(self):
+        """
+        Forget every recorded event.
+        """
+        with self._lock:
+            self._endpoints = {}
+
+
+class PrometheusInstrumentation(Instrumentation):
+    """
+    Export events as Prometheus metrics. Requires `prometheus_client`.
+
+    :param registry: The `CollectorRegistry` to register the metrics with. Defaults to
+        the default registry.
+    :param namespace: Prefix of the metric names. Defaults to "placekey".
+    """
+
+    def __init__(self, registry=None, namespace='placekey'):
+        try:
+            from prometheus_client import REGISTRY, Counter as PrometheusCounter, Histogram
+        except ImportError:
+            raise ImportError("PrometheusInstrumentation requires prometheus_client. "
+                              "Install it with `pip install prometheus_client`.")
+
+        registry = registry if registry is not None else REGISTRY
+        labels = ['endpoint', 'outcome']
+
+        def counter(name, documentation, labelnames=('endpoint',)):
+            return PrometheusCounter(name, documentation, labelnames, namespace=namespace, registry=registry)
+
+        self.request_duration = Histogram(
+            'request_duration_seconds', 'Duration of Placekey API requests, including retries',
+            labels, namespace=namespace, registry=registry)
+        self.network_time = counter('request_network_seconds', 'Seconds spent waiting on the server')
+        self.rate_limit_wait = counter('rate_limit_wait_seconds', 'Seconds spent waiting on the rate limiter')
+        self.backoff_wait = counter('backoff_wait_seconds', 'Seconds spent backing off between retries')
+        self.retries = counter('request_retries', 'Number of retried requests')
+        self.hedges = counter('request_hedges', 'Number of duplicate requests sent for slow attempts')
+        self.request_bytes = counter('request_bytes', 'Size of request bodies in bytes')
+        self.response_bytes = counter('response_bytes', 'Size of response bodies in bytes')
+        self.rows = counter('rows', 'Number of places looked up')
+        self.row_errors = counter('row_errors', 'Number of places that got an error')
+
+    def record_request(self, event):
+        self.request_duration.labels(event.endpoint, event.outcome).observe(event.latency)
+        self.network_time.labels(event.endpoint).inc(event.network_time)
+        self.rate_limit_wait.labels(event.endpoint).inc(event.rate_limit_wait)
+        self.backoff_wait.labels(event.endpoint).inc(event.backoff_wait)
+        self.retries.labels(event.endpoint).inc(event.retries)
+        self.hedges.labels(event.endpoint).inc(event.hedges)
+        self.request_bytes.labels(event.endpoint).inc(event.request_bytes)
+        self.response_bytes.labels(event.endpoint).inc(event.response_bytes)
+
+    def record_batch(self, event):
+        self.rows.labels(event.endpoint).inc(event.batch_size)
+        self.row_errors.labels(event.endpoint).inc(event.row_errors)
+
+
+class OpenTelemetryInstrumentation(Instrumentation):
+    """
+    Export events as OpenTelemetry metrics, and requests as spans. Requires
+    `opentelemetry-api`.
+
+    :param meter_provider: The `MeterProvider` to use. Defaults to the global one.
+    :param tracer_provider: The `TracerProvider` to use. Defaults to the global one.
+    """
+
+    def __init__(self, meter_provider=None, tracer_provider=None):
+        try:
+            from opentelemetry import metrics, trace
+        except ImportError:
+            raise ImportError("OpenTelemetryInstrumentation requires opentelemetry-api. "
+                              "Install it with `pip install opentelemetry-api`.")
+
+        meter = metrics.get_meter('placekey', __version__, meter_provider=meter_provider)
+        self.tracer = trace.get_tracer('placekey', __version__, tracer_provider=tracer_provider)
+        self.request_duration = meter.create_histogram(
+            'placekey.client.request.duration', unit='s',
+            description='Duration of Placekey API requests, including retries')
+        self.network_time = meter.create_counter(
+            'placekey.client.network.time', unit='s', description='Seconds spent waiting on the server')
+        self.rate_limit_wait = meter.create_counter(
+            'placekey.client.rate_limit.wait', unit='s', description='Seconds spent waiting on the rate limiter')
+        self.backoff_wait = meter.create_counter(
+            'placekey.client.backoff.wait', unit='s', description='Seconds spent backing off between retries')
+        self.retries = meter.create_counter(
+            'placekey.client.retries', description='Number of retried requests')
+        self.hedges = meter.create_counter(
+            'placekey.client.hedges', description='Number of duplicate requests sent for slow attempts')
+        self.request_bytes = meter.create_counter(
+            'placekey.client.request.size', unit='By', description='Size of request bodies')
+        self.response_bytes = meter.create_counter(
+            'placekey.client.response.size', unit='By', description='Size of response bodies')
+        self.rows = meter.create_counter(
+            'placekey.client.rows', description='Number of places looked up')
+        self.row_errors = meter.create_counter(
+            'placekey.client.row_errors', description='Number of places that got an error')
+
+    def record_request(self, event):
+        import time
+
+        attributes = {'placekey.endpoint': event.endpoint, 'placekey.outcome': event.outcome}
+        self.request_duration.record(event.latency, attributes)
+        endpoint = {'placekey.endpoint': event.endpoint}
+        self.network_time.add(event.network_time, endpoint)
+        self.rate_limit_wait.add(event.rate_limit_wait, endpoint)
+        self.backoff_wait.add(event.backoff_wait, endpoint)
+        self.retries.add(event.retries, endpoint)
+        self.hedges.add(event.hedges, endpoint)
+        self.request_bytes.add(event.request_bytes, endpoint)
+        self.response_bytes.add(event.response_bytes, endpoint)
+
+        # Events are recorded once a request is over, so the span is backdated
+        end = time.time_ns()
+        span = self.tracer.start_span('placekey.request', start_time=end - int(event.latency * 1e9),
+                                      attributes=dict(attributes, **{
+                                          'placekey.batch_size': event.batch_size,
+                                          'placekey.retries': event.retries,
+                                          'placekey.hedges': event.hedges,
+                                          'placekey.network_time': event.network_time,
+                                          'placekey.rate_limit_wait': event.rate_limit_wait,
+                                          'placekey.backoff_wait': event.backoff_wait,
+                                          'http.response.status_code': event.status or 0}))
+        span.end(end_time=end)
+
+    def record_batch(self, event):
+        endpoint = {'placekey.endpoint': event.endpoint}
+        self.rows.add(event.batch_size, endpoint)
+        self.row_errors.add(event.row_errors, endpoint)
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
@@ -0,0 +1,318 @@
+"""
+Bulk conversions between Placekeys, geos and polygons spread over a process pool.
+
+Inputs are copied once into shared memory and every worker writes its results directly
+into a shared output buffer, so no Placekey or coordinate is pickled on its way to or
+from a worker. Small inputs are converted in the calling process, with the same code
+and therefore the same results.
+
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import h3.api.basic_int as h3_int
+
+from .placekey import RESOLUTION, geo_to_placekey, placekeys_to_h3_ints
+
+PARALLEL_THRESHOLD = 100000
+PLACEKEY_DTYPE = 'S12'
+MAX_BOUNDARY_VERTICES = 10
+
+
+def map_geo_to_placekey(lats, longs, processes=None, chunk_size=None, min_parallel=PARALLEL_THRESHOLD):
+    """
+    Convert arrays of latitudes and longitudes into Placekeys.
+
+    :param lats: Sequence of latitudes (floats)
+    :param longs: Sequence of longitudes (floats)
+    :param processes: Number of worker processes. Defaults to the number of CPUs
+    :param chunk_size: Number of rows converted by a worker at a time. Defaults to
+        splitting the input into four chunks per process
+    :param min_parallel: Inputs with fewer rows are converted in the calling process.
+        Default is 100000
+    :return: numpy array of Placekeys (strings). Coordinates that can't be converted,
+        such as NaN, give an empty string
+
+    """
+    import numpy as np
+
+    lats = np.ascontiguousarray(lats, dtype=np.float64)
+    longs = np.ascontiguousarray(longs, dtype=np.float64)
+    if lats.shape != longs.shape:
+        raise ValueError("lats and longs must have the same length")
+
+    outputs = _map(_geo_to_placekey_kernel, {'lat': lats, 'long': longs},
+                   {'placekey': (PLACEKEY_DTYPE, ())}, len(lats), processes, chunk_size, min_parallel)
+    return outputs['placekey'].astype(str)
+
+
+def map_placekey_to_geo(placekeys, processes=None, chunk_size=None, min_parallel=PARALLEL_THRESHOLD):
+    """
+    Convert an array of Placekeys into latitudes and longitudes.
+
+    :param placekeys: Sequence of Placekeys (strings)
+    :param processes: Number of worker processes. Defaults to the number of CPUs
+    :param chunk_size: Number of rows converted by a worker at a time. Defaults to
+        splitting the input into four chunks per process
+    :param min_parallel: Inputs with fewer rows are converted in the calling process.
+        Default is 100000
+    :return: A tuple (lats, longs) of numpy arrays (float64). Missing or invalid Placekeys
+        give NaN
+
+    """
+    placekeys = _placekeys_to_bytes(placekeys)
+    outputs = _map(_placekey_to_geo_kernel, {'placekey': placekeys},
+                   {'lat': ('float64', ()), 'long': ('float64', ())},
+                   len(placekeys), processes, chunk_size, min_parallel)
+    return outputs['lat'], outputs['long']
+
+
+def map_placekey_to_h3_int(placekeys, processes=None, chunk_size=None, min_parallel=PARALLEL_THRESHOLD):
+    """
+    Convert an array of Placekeys into H3 integers.
+
+    :param placekeys: Sequence of Placekeys (strings)
+    :param processes: Number of worker processes. Defaults to the number of CPUs
+    :param chunk_size: Number of rows converted by a worker at a time. Defaults to
+        splitting the input into four chunks per process
+    :param min_parallel: Inputs with fewer rows are converted in the calling process.
+        Default is 100000
+    :return: numpy array of H3 indexes (int64). Missing or invalid Placekeys give 0
+
+    """
+    placekeys = _placekeys_to_bytes(placekeys)
+    outputs = _map(_placekey_to_h3_int_kernel, {'placekey': placekeys}, {'h3': ('int64', ())},
+                   len(placekeys), processes, chunk_size, min_parallel)
+    return outputs['h3']
+
+
+def map_placekey_to_polygon(placekeys, geo_json=False, processes=None, chunk_size=None,
+                            min_parallel=PARALLEL_THRESHOLD):
+    """
+    Convert an array of Placekeys into shapely Polygons, like
+    :func:`placekey.placekey_to_polygon`. The workers compute the hexagon boundaries and
+    the polygons are assembled in the calling process.
+
+    :param placekeys: Sequence of Placekeys (strings)
+    :param geo_json: If True return the coordinates in GeoJSON format, as
+        :func:`placekey.placekey_to_polygon` does
+    :param processes: Number of worker processes. Defaults to the number of CPUs
+    :param chunk_size: Number of rows converted by a worker at a time. Defaults to
+        splitting the input into four chunks per process
+    :param min_parallel: Inputs with fewer rows are converted in the calling process.
+        Default is 100000
+    :return: numpy array of shapely Polygons (objects). Missing or invalid Placekeys give
+        None
+
+    """
+    import numpy as np
+    import shapely
+
+    placekeys = _placekeys_to_bytes(placekeys)
+    outputs = _map(_placekey_to_boundary_kernel, {'placekey': placekeys},
+                   {'boundary': ('float64', (MAX_BOUNDARY_VERTICES, 2))},
+                   len(placekeys), processes, chunk_size, min_parallel)
+    boundary = outputs['boundary']
+    if geo_json:
+        boundary = boundary[:, :, ::-1]
+
+    vertex_counts = (~np.isnan(boundary[:, :, 0])).sum(axis=1)
+    boundary = _orient_counter_clockwise(boundary, vertex_counts)
+
+    polygons = np.full(len(placekeys), None, dtype=object)
+    valid = vertex_counts > 0
+    if valid.any():
+        vertices = boundary[valid]
+        mask = ~np.isnan(vertices[:, :, 0])
+        indices = np.repeat(np.arange(len(vertices)), vertex_counts[valid])
+        rings = shapely.linearrings(vertices[mask], indices=indices)
+        polygons[valid] = shapely.polygons(rings)
+    return polygons
+
+
+def _map(kernel, inputs, output_specs, n, processes, chunk_size, min_parallel):
+    """
+    Run `kernel` over `n` rows of `inputs`, in the calling process or in a process pool.
+
+    :param kernel: A module level function taking dictionaries of input and output arrays
+        and filling the output arrays
+    :param inputs: A dictionary of numpy arrays with `n` rows
+    :param output_specs: A dictionary mapping output names to (dtype, row shape) tuples
+    :return: A dictionary of output arrays
+    """
+    import numpy as np
+
+    processes = processes or os.cpu_count() or 1
+    if processes <= 1 or n < max(min_parallel, 2):
+        outputs = {name: np.empty((n,) + shape, dtype=dtype) for name, (dtype, shape) in output_specs.items()}
+        kernel(inputs, outputs)
+        return outputs
+
+    from multiprocessing import shared_memory
+
+    chunk_size = chunk_size or -(-n // (processes * 4))
+    segments = []
+    try:
+        input_buffers = {}
+        for name, array in inputs.items():
+            segment, shared = _shared_array(shared_memory, array.dtype, array.shape)
+            segments.append(segment)
+            shared[...] = array
+            input_buffers[name] = (segment.name, array.dtype.str, array.shape)
+
+        output_buffers = {}
+        for name, (dtype, shape) in output_specs.items():
+            segment, _ = _shared_array(shared_memory, np.dtype(dtype), (n,) + shape)
+            segments.append(segment)
+            output_buffers[name] = (segment.name, np.dtype(dtype).str, (n,) + shape)
+
+        tasks = [(kernel, input_buffers, output_buffers, start, min(start + chunk_size, n))
+                 for start in range(0, n, chunk_size)]
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks))) as executor:
+            # list() surfaces any exception raised in a worker
+            list(executor.map(_run_chunk, tasks))
+
+        return {name: _attach(segments, spec).copy() for name, spec in output_buffers.items()}
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+def _shared_array(shared_memory, dtype, shape):
+    import numpy as np
+
+    size = max(1, int(np.prod(shape)) * dtype.itemsize)
+    segment = shared_memory.SharedMemory(create=True, size=size)
+    return segment, np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _attach(segments, spec):
+    import numpy as np
+
+    name, dtype, shape = spec
+    segment = next(s for s in segments if s.name == name)
+    return np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _run_chunk(task):
+    """
+    Worker entry point: attach to the shared buffers and fill rows [start, stop).
+    """
+    import numpy as np
+    from multiprocessing import shared_memory
+
+    kernel, input_buffers, output_buffers, start, stop = task
+    segments = []
+    try:
+        def view(spec):
+            name, dtype, shape = spec
+            # The parent process owns the segments, so they are not tracked here
+            segment = shared_memory.SharedMemory(name=name, track=False) \
+                if _SUPPORTS_TRACK else shared_memory.SharedMemory(name=name)
+            segments.append(segment)
+            return np.ndarray(shape, dtype=dtype, buffer=segment.buf)[start:stop]
+
+        inputs = {name: view(spec) for name, spec in input_buffers.items()}
+        outputs = {name: view(spec) for name, spec in output_buffers.items()}
+        kernel(inputs, outputs)
+        del inputs, outputs
+    finally:
+        for segment in segments:
+            segment.close()
+
+
+def _supports_track():
+    import inspect
+    from multiprocessing import shared_memory
+
+    return 'track' in inspect.signature(shared_memory.SharedMemory).parameters
+
+
+_SUPPORTS_TRACK = _supports_track()
+
+
+def _placekeys_to_bytes(placekeys):
+    """
+    :return: numpy array of encoded Placekeys (bytes), with missing values as empty strings
+    """
+    import numpy as np
+    import pandas as pd
+
+    placekeys = pd.Series(placekeys, dtype=object)
+    placekeys = placekeys.where(placekeys.notna(), '').astype(str).to_numpy(dtype=str)
+    if not len(placekeys):
+        return np.array([], dtype='S1')
+    return np.char.encode(placekeys, 'utf-8')
+
+
+def _decode_placekeys(placekeys):
+    return placekeys_to_h3_ints(placekeys.astype(str))
+
+
+def _geo_to_placekey_kernel(inputs, outputs):
+    result = outputs['placekey']
+    for i, (lat, long) in enumerate(zip(inputs['lat'].tolist(), inputs['long'].tolist())):
+        try:
+            result[i] = geo_to_placekey(lat, long)
+        except (TypeError, ValueError):
+            result[i] = b''
+
+
+def _placekey_to_h3_int_kernel(inputs, outputs):
+    outputs['h3'][:] = _decode_placekeys(inputs['placekey'])
+
+
+def _placekey_to_geo_kernel(inputs, outputs):
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(_decode_placekeys(inputs['placekey']))
+    geos = np.full((len(uniques), 2), np.nan)
+    for i, h in enumerate(uniques.tolist()):
+        if h != 0 and h3_int.is_valid_cell(h):
+            geos[i] = h3_int.cell_to_latlng(h)
+    outputs['lat'][:] = geos[codes, 0]
+    outputs['long'][:] = geos[codes, 1]
+
+
+def _placekey_to_boundary_kernel(inputs, outputs):
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(_decode_placekeys(inputs['placekey']))
+    boundaries = np.full((len(uniques), MAX_BOUNDARY_VERTICES, 2), np.nan)
+    for i, h in enumerate(uniques.tolist()):
+        if h != 0 and h3_int.is_valid_cell(h) and h3_int.get_resolution(h) == RESOLUTION:
+            boundary = h3_int.cell_to_boundary(h)
+            boundaries[i, :len(boundary)] = boundary
+    outputs['boundary'][:] = boundaries[codes]
+
+
+def _orient_counter_clockwise(boundary, vertex_counts):
+    """
+    Reverse the rings with a clockwise orientation, keeping their first vertex, as
+    shapely's `polygon.orient(sign=1)` does.
+    """
+    import numpy as np
+
+    x = boundary[:, :, 0]
+    y = boundary[:, :, 1]
+    last = np.maximum(vertex_counts - 1, 0)
+    rows = np.arange(len(boundary))
+    # Shoelace formula, with the closing edge from the last vertex back to the first
+    area = np.nansum(x[:, :-1] * y[:, 1:] - x[:, 1:] * y[:, :-1], axis=1)
+    area += x[rows, last] * y[:, 0] - x[:, 0] * y[rows, last]
+    clockwise = area < 0
+
+    if clockwise.any():
+        flipped = boundary[clockwise]
+        counts = vertex_counts[clockwise]
+        positions = np.arange(MAX_BOUNDARY_VERTICES)
+        # Vertex j of the reversed ring is vertex (count - j) % count of the original one
+        source = np.where(positions < counts[:, None], (counts[:, None] - positions) % np.maximum(counts[:, None], 1),
+                          positions)
+        boundary = boundary.copy()
+        boundary[clockwise] = np.take_along_axis(flipped, source[:, :, None], axis=1)
+    return boundary
@@ -0,0 +1,153 @@
+"""
+Spatial partitioning of Placekeys for distributed storage.
+
+Partition keys are built from the base cell and the leading H3 digits of a Placekey's
+where part, as in :func:`placekey.placekey._shorten_h3_integer`. Unlike string prefixes
+of Placekeys, the key at a given level identifies an H3 cell of that resolution, and keys
+sort along the H3 hierarchy, so nearby places share partitions and datasets partitioned
+on them can be pruned on location.
+
+"""
+
+from .placekey import (BASE_CELL_SHIFT, BASE_RESOLUTION, RESOLUTION, _shorten_h3_integer,
+                       placekey_to_h3_int, placekeys_to_h3_ints)
+
+
+def partition_key(placekey, level):
+    """
+    Map a Placekey to the partition key of its H3 parent at resolution `level`. The key
+    combines the base cell and the first `level` digits of the H3 index.
+
+    :param placekey: Placekey (string)
+    :param level: Partition level, from 0 (base cells only) to 10 (int)
+    :return: Partition key (int)
+
+    """
+    _validate_level(level)
+    return _shorten_h3_integer(placekey_to_h3_int(placekey)) >> (3 * (BASE_RESOLUTION - level))
+
+
+def partition_keys(placekeys, level):
+    """
+    Vectorized version of :func:`partition_key`. Each distinct Placekey is decoded only
+    once.
+
+    :param placekeys: Sequence of Placekeys (strings)
+    :param level: Partition level, from 0 (base cells only) to 10 (int)
+    :return: numpy array of partition keys (int64). Missing or invalid Placekeys give -1
+
+    """
+    import numpy as np
+
+    _validate_level(level)
+    h3_ints = placekeys_to_h3_ints(placekeys).astype(np.uint64)
+    short = ((h3_ints + np.uint64(BASE_CELL_SHIFT)) & np.uint64(2 ** 52 - 1)) >> np.uint64(
+        3 * (15 - BASE_RESOLUTION))
+    keys = (short >> np.uint64(3 * (BASE_RESOLUTION - level))).astype(np.int64)
+    keys[h3_ints == 0] = -1
+    return keys
+
+
+class DensityPartitioner:
+    """
+    Assign Placekeys to a fixed number of partitions of similar size.
+
+    Partitions are contiguous ranges of partition keys at `level`, with boundaries chosen
+    from a sample so that each range holds about the same number of places. Dense metros
+    are spread over many partitions while sparse regions share one. A partition key that
+    holds more than its share of the sample can't be split; use a higher level for it to
+    be broken up.
+
+    :param boundaries: Sorted partition keys where each partition after the first starts
+        (sequence of ints)
+    :param level: Partition level of the boundaries, from 0 to 10 (int)
+
+    """
+
+    def __init__(self, boundaries, level):
+        import numpy as np
+
+        _validate_level(level)
+        self.boundaries = np.asarray(boundaries, dtype=np.int64)
+        self.level = level
+        if np.any(np.diff(self.boundaries) <= 0):
+            raise ValueError("boundaries must be strictly increasing")
+
+    @property
+    def num_partitions(self):
+        """
+        :return: The number of partitions (int)
+        """
+        return len(self.boundaries) + 1
+
+    @classmethod
+    def fit(cls, sample, num_partitions, level=8):
+        """
+        Choose partition boundaries from a histogram of a sample of Placekeys.
+
+        :param sample: Sequence of Placekeys (strings), representative of the data
+        :param num_partitions: Number of partitions (int). Fewer are created if the sample
+            has fewer distinct partition keys
+        :param level: Partition level, from 0 to 10 (int). Default is 8
+        :return: A :class:`DensityPartitioner`
+
+        """
+        import numpy as np
+
+        if num_partitions < 1:
+            raise ValueError("num_partitions must be at least 1")
+        keys = partition_keys(sample, level)
+        keys, counts = np.unique(keys[keys >= 0], return_counts=True)
+        if not len(keys):
+            raise ValueError("The sample has no valid Placekeys")
+
+        cumulative = np.cumsum(counts)
+        targets = cumulative[-1] * np.arange(1, num_partitions) / num_partitions
+        # Each partition ends with the first key whose cumulative count reaches its target
+        ends = np.searchsorted(cumulative, targets, side='left')
+        starts = np.unique(ends[ends + 1 < len(keys)] + 1)
+        return cls(keys[starts], level)
+
+    def partition(self, placekey):
+        """
+        :param placekey: Placekey (string)
+        :return: Partition number, from 0 to `num_partitions - 1` (int)
+        """
+        import numpy as np
+
+        return int(np.searchsorted(self.boundaries, partition_key(placekey, self.level), side='right'))
+
+    def partitions(self, placekeys):
+        """
+        Vectorized version of :meth:`partition`.
+
+        :param placekeys: Sequence of Placekeys (strings)
+        :return: numpy array of partition numbers (int64). Missing or invalid Placekeys
+            give -1
+        """
+        import numpy as np
+
+        keys = partition_keys(placekeys, self.level)
+        result = np.searchsorted(self.boundaries, keys, side='right').astype(np.int64)
+        result[keys < 0] = -1
+        return result
+
+    def to_dict(self):
+        """
+        :return: A JSON serializable description of the partitioner, to store with a
+            partitioned dataset (dict)
+        """
+        return {'level': self.level, 'boundaries': self.boundaries.tolist()}
+
+    @classmethod
+    def from_dict(cls, description):
+        """
+        :param description: A dictionary returned by :meth:`to_dict`
+        :return: A :class:`DensityPartitioner`
+        """
+        return cls(description['boundaries'], description['level'])
+
+
+def _validate_level(level):
+    if not 0 <= level <= RESOLUTION:
+        raise ValueError("level must be between 0 and {}".format(RESOLUTION))
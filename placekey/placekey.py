@@ -4,23 +4,21 @@ H3 indices. This module also includes additional utilities related to Placekeys.
 
 """
 
+import copy
+import os
 import re
 import json
+import threading
+import time
 from typing import List
 from math import asin, cos, radians, sqrt
 import ast
 
 import h3
 import h3.api.basic_int as h3_int
-import shapely
-from shapely.geometry import mapping, shape, Polygon, polygon
-from shapely.ops import transform
-from shapely.strtree import STRtree
-from shapely.wkt import loads as wkt_loads
-import boto3
-from botocore import UNSIGNED
-from botocore.config import Config
-from .general import _get_request_function
+
+# shapely, boto3 and the request helpers are imported where they are used, so that
+# `import placekey` stays fast for callers that only convert between Placekeys and geos.
 
 RESOLUTION = 10
 BASE_RESOLUTION = 12
@@ -54,18 +52,117 @@ WHERE_REGEX = re.compile(
     '^' + '-'.join([FIRST_TUPLE_REGEX, TUPLE_REGEX, TUPLE_REGEX]) + '$')
 WHAT_REGEX_V1 = re.compile('^[' + ALPHABET + ']{3,}(-[' + ALPHABET + ']{3,})?$')
 WHAT_REGEX_V2 = re.compile('^[01][abcdefghijklmnopqrstuvwxyz234567]{9}$')
-s3 = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+_s3_client = None
+
+
+def _get_s3_client():
+    """
+    :return: An unsigned boto3 S3 client for reading the free datasets, created on first use
+    """
+    global _s3_client
+    if _s3_client is None:
+        import boto3
+        from botocore import UNSIGNED
+        from botocore.config import Config
+        _s3_client = boto3.client("s3", config=Config(signature_version=UNSIGNED, connect_timeout=10,
+                                                       read_timeout=60))
+    return _s3_client
+
+
+def __getattr__(name):
+    # `s3` used to be created at import time, and is still available as a module attribute
+    if name == 's3':
+        return _get_s3_client()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+FREE_DATASET_METADATA_TTL = 3600
+_metadata_cache = {}
+_metadata_cache_dir = None
+_metadata_cache_loaded = False
+_metadata_lock = threading.Lock()
+
+
+def configure_free_dataset_metadata_cache(ttl: float = FREE_DATASET_METADATA_TTL, cache_dir: str = None):
+    """
+    Configure the cache shared by list_free_datasets, return_free_datasets_location_by_name
+    and return_free_dataset_joins_by_name. Responses are kept in memory for `ttl` seconds,
+    and also written to `cache_dir` if it is given so that other processes can reuse them.
+
+    :param ttl: Number of seconds a response is reused. Use 0 to disable caching. Default is 3600
+    :param cache_dir: Directory for an on-disk copy of the cache. Default is None (memory only)
+    """
+    global FREE_DATASET_METADATA_TTL, _metadata_cache_dir, _metadata_cache_loaded
+    with _metadata_lock:
+        FREE_DATASET_METADATA_TTL = ttl
+        _metadata_cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        _metadata_cache_loaded = False
+
+
+def clear_free_dataset_metadata_cache():
+    """
+    Remove every cached free dataset name and location, in memory and on disk.
+    """
+    with _metadata_lock:
+        _metadata_cache.clear()
+        if _metadata_cache_dir is not None:
+            _save_metadata_cache()
+
+
+def _metadata_cache_path():
+    return os.path.join(_metadata_cache_dir, 'free_dataset_metadata.json')
+
+
+def _save_metadata_cache():
+    os.makedirs(_metadata_cache_dir, exist_ok=True)
+    tmp_path = _metadata_cache_path() + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(_metadata_cache, f)
+    os.replace(tmp_path, _metadata_cache_path())
+
+
+def _cached_metadata(key, fetch):
+    """
+    Return the cached value for `key` if it is recent enough, otherwise call `fetch`
+    and cache its result. Errors raised by `fetch` are not cached.
+    """
+    global _metadata_cache_loaded
+    with _metadata_lock:
+        if _metadata_cache_dir is not None and not _metadata_cache_loaded:
+            _metadata_cache_loaded = True
+            if os.path.exists(_metadata_cache_path()):
+                with open(_metadata_cache_path()) as f:
+                    _metadata_cache.update(json.load(f))
+        entry = _metadata_cache.get(key)
+        if entry is not None and time.time() - entry[0] < FREE_DATASET_METADATA_TTL:
+            return copy.deepcopy(entry[1])
+
+    value = fetch()
+    with _metadata_lock:
+        if FREE_DATASET_METADATA_TTL > 0:
+            _metadata_cache[key] = [time.time(), value]
+            if _metadata_cache_dir is not None:
+                _save_metadata_cache()
+    return copy.deepcopy(value)
+
 
 def list_free_datasets():
     """
     :return: The names of every free placekey'd dataset Placekey offers
     """
+    return _cached_metadata('names', _fetch_free_dataset_names)
+
+
+def _fetch_free_dataset_names():
+    from .general import DEFAULT_TIMEOUT, _get_request_function
+
     func = _get_request_function(
         headers={},
         url="https://api.placekey.io/placekey-py/v1/get-public-dataset-names",
         calls=3,
         period=60,
-        max_tries=20
+        max_tries=20,
+        timeout=DEFAULT_TIMEOUT
     )
     response = func()
     if response.status_code == 200:
@@ -81,12 +178,20 @@ def return_free_datasets_location_by_name(name: str, url: bool = False):
     :param name: Return a URL or S3 URI? Default is False (S3 URI)
     :return: The public S3 location of the placekey'd dataset
     """
+    return _cached_metadata(
+        'location|{}|{}'.format(name, bool(url)), lambda: _fetch_free_dataset_location(name, url))
+
+
+def _fetch_free_dataset_location(name, url):
+    from .general import DEFAULT_TIMEOUT, _get_request_function
+
     func = _get_request_function(
         headers={},
         url="https://api.placekey.io/placekey-py/v1/get-public-dataset-location-from-name",
         calls=3,
         period=60,
-        max_tries=20
+        max_tries=20,
+        timeout=DEFAULT_TIMEOUT
     )
     response = func(params={
         'name': name,
@@ -98,7 +203,24 @@ def return_free_datasets_location_by_name(name: str, url: bool = False):
         raise ValueError(response.reason)
     else:
         raise Exception("Something went wrong. Please contact Placekey.")
-    
+
+
+def return_free_datasets_locations_by_names(names: List[str], url: bool = False):
+    """
+    Get the S3 locations of several free datasets by their names. Names are checked against
+    list_free_datasets first, and locations that were already looked up are served from the
+    cache, so only unknown locations are requested. Raises ValueError if a name is not correct.
+
+    :param names: Dataset Names (list of str)
+    :param url: Return URLs or S3 URIs? Default is False (S3 URIs)
+    :return: A dictionary mapping each name to the public S3 location of the dataset
+    """
+    unknown = set(names) - set(list_free_datasets())
+    if unknown:
+        raise ValueError("Unknown free datasets: {}".format(", ".join(sorted(unknown))))
+    return {name: return_free_datasets_location_by_name(name, url=url) for name in names}
+
+
 def return_free_dataset_joins_by_name(names: List[str], url: bool = False):
     """
     Get the S3 location of a free dataset join by their names. Find names using list_free_datasets. Raises ValueError if names are not correct.
@@ -107,12 +229,20 @@ def return_free_dataset_joins_by_name(names: List[str], url: bool = False):
     :param name: Return a URL or S3 URI? Default is False (S3 URI)
     :return: The public S3 locations of the joins in JSON form for each type: outer, inner, left, and right join
     """
+    return _cached_metadata(
+        'joins|{}|{}'.format(",".join(names), bool(url)), lambda: _fetch_free_dataset_joins(names, url))
+
+
+def _fetch_free_dataset_joins(names, url):
+    from .general import DEFAULT_TIMEOUT, _get_request_function
+
     func = _get_request_function(
         headers={},
         url="https://api.placekey.io/placekey-py/v1/get-public-join-from-names",
         calls=3,
         period=60,
-        max_tries=20
+        max_tries=20,
+        timeout=DEFAULT_TIMEOUT
     )
     response = func(params={
         'public_datasets': ",".join(names),
@@ -125,6 +255,172 @@ def return_free_dataset_joins_by_name(names: List[str], url: bool = False):
     else:
         raise Exception("Something went wrong. Please contact Placekey.")
 
+def open_free_dataset(name: str, columns: List[str] = None, cache_dir: str = None, engine: str = 'pandas',
+                      chunk_size: int = 8 * 1024 * 1024, max_workers: int = 8, s3_client=None,
+                      batch_size: int = 100000, materialize: bool = False):
+    """
+    Read a free dataset by its name. Find names using list_free_datasets. The dataset is
+    downloaded from S3 in ranged chunks in parallel and cached on local disk. Later calls
+    only check the object's ETag and read the local copy if it is unchanged.
+
+    By default the local copy is streamed in batches of rows, so that datasets larger than
+    memory can be processed. Pass `materialize=True` to read the whole dataset at once.
+
+    :param name: Dataset Name (str)
+    :param columns: Names of the columns to read. Defaults to None (every column)
+    :param cache_dir: Directory for the local copies of datasets. Defaults to ~/.cache/placekey
+    :param engine: Read pandas DataFrames ("pandas", the default) or pyarrow record batches
+        ("arrow"). Streaming with "arrow" requires pyarrow
+    :param chunk_size: Size in bytes of each ranged download
+    :param max_workers: Number of chunks downloaded in parallel
+    :param s3_client: boto3 S3 client to use. Defaults to an unsigned client for the public
+        buckets, and may point at any S3-compatible store
+    :param batch_size: Maximal number of rows of each streamed batch. Default is 100000
+    :param materialize: Read the whole dataset into a single DataFrame or Table instead of
+        streaming it. Default is False
+    :return: An iterator of pandas DataFrames ("pandas") or a `pyarrow.RecordBatchReader`
+        ("arrow"). With `materialize=True`, the dataset as a pandas DataFrame or a pyarrow
+        Table
+    """
+    if engine not in ('pandas', 'arrow'):
+        raise ValueError("engine must be either 'pandas' or 'arrow'")
+    s3_client = s3_client or _get_s3_client()
+    cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'placekey')
+
+    location = return_free_datasets_location_by_name(name).strip().strip('"')
+    if not location.startswith('s3://'):
+        raise ValueError("Unexpected dataset location: {}".format(location))
+    bucket, _, key = location[len('s3://'):].partition('/')
+
+    paths = [
+        _download_s3_object(s3_client, bucket, obj_key, size, etag, cache_dir, chunk_size, max_workers)
+        for obj_key, size, etag in _list_s3_objects(s3_client, bucket, key)
+    ]
+    if materialize:
+        return _read_dataset_files(paths, columns, engine)
+    return _stream_dataset_files(paths, columns, engine, batch_size)
+
+
+def _list_s3_objects(s3_client, bucket, key):
+    """
+    :return: A list of (key, size, ETag) tuples for the object `key`, or for every object
+        under the prefix `key` if it is not an object itself
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=key)
+        return [(key, head['ContentLength'], head['ETag'])]
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+
+    objects = []
+    kwargs = {'Bucket': bucket, 'Prefix': key}
+    while True:
+        page = s3_client.list_objects_v2(**kwargs)
+        objects.extend((obj['Key'], obj['Size'], obj['ETag'])
+                       for obj in page.get('Contents', []) if not obj['Key'].endswith('/'))
+        if not page.get('IsTruncated'):
+            break
+        kwargs['ContinuationToken'] = page['NextContinuationToken']
+    if not objects:
+        raise ValueError("No objects found at s3://{}/{}".format(bucket, key))
+    return sorted(objects)
+
+
+def _download_s3_object(s3_client, bucket, key, size, etag, cache_dir, chunk_size, max_workers):
+    """
+    Download an S3 object into `cache_dir` unless a copy with the same ETag is already there.
+
+    :return: The local path of the object
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    path = os.path.join(cache_dir, bucket, *key.split('/'))
+    etag_path = path + '.etag'
+    if os.path.exists(path) and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            if f.read() == etag and os.path.getsize(path) == size:
+                return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.truncate(size)
+
+    def download_range(start):
+        end = min(start + chunk_size, size) - 1
+        body = s3_client.get_object(
+            Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end), IfMatch=etag)['Body']
+        with open(tmp_path, 'r+b') as f:
+            f.seek(start)
+            f.write(body.read())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() surfaces any exception raised while downloading a range
+        list(executor.map(download_range, range(0, size, chunk_size)))
+
+    os.replace(tmp_path, path)
+    with open(etag_path, 'w') as f:
+        f.write(etag)
+    return path
+
+
+def _is_parquet(paths):
+    """
+    :return: Whether every local dataset file is a Parquet file rather than a CSV file
+    """
+    def has_parquet_magic(path):
+        with open(path, 'rb') as f:
+            return f.read(4) == b'PAR1'
+
+    return all(has_parquet_magic(p) for p in paths)
+
+
+def _read_dataset_files(paths, columns, engine):
+    """
+    Read local dataset files (Parquet or, optionally compressed, CSV) with column projection.
+    """
+    is_parquet = _is_parquet(paths)
+    if engine == 'arrow':
+        import pyarrow as pa
+        if is_parquet:
+            import pyarrow.parquet as pq
+            return pa.concat_tables([pq.read_table(p, columns=columns) for p in paths])
+        import pyarrow.csv as pa_csv
+        return pa.concat_tables([
+            pa_csv.read_csv(p, convert_options=pa_csv.ConvertOptions(include_columns=columns))
+            for p in paths])
+
+    import pandas as pd
+    if is_parquet:
+        frames = [pd.read_parquet(p, columns=columns) for p in paths]
+    else:
+        frames = [pd.read_csv(p, usecols=columns) for p in paths]
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def _stream_dataset_files(paths, columns, engine, batch_size):
+    """
+    Stream local dataset files in batches of at most `batch_size` rows, with column
+    projection. Only one batch per file is held in memory at a time.
+    """
+    is_parquet = _is_parquet(paths)
+    if engine == 'arrow':
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(paths, format='parquet' if is_parquet else 'csv')
+        return dataset.scanner(columns=columns, batch_size=batch_size).to_reader()
+
+    if is_parquet:
+        import pyarrow.parquet as pq
+        return (batch.to_pandas() for p in paths
+                for batch in pq.ParquetFile(p).iter_batches(batch_size=batch_size, columns=columns))
+
+    import pandas as pd
+    return (frame for p in paths for frame in pd.read_csv(p, usecols=columns, chunksize=batch_size))
+
+
 def _get_header_int():
     """
     :return: An integer corresponding to the header of an H3 integer
@@ -230,6 +526,119 @@ def placekey_to_h3_int(placekey):
     return _decode_to_h3_int(where)
 
 
+def placekeys_to_h3_ints(placekeys):
+    """
+    Convert a sequence of Placekeys to an array of H3 integers. Each distinct Placekey is
+    decoded only once. Missing values and Placekeys whose where part can't be decoded
+    are returned as 0, which is not a valid H3 index.
+
+    :param placekeys: Sequence of Placekeys (strings)
+    :return: numpy array of H3 indexes (int64)
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(pd.Series(placekeys, dtype=object))
+
+    def decode(placekey):
+        try:
+            _, where = _parse_placekey(placekey)
+            if not WHERE_REGEX.match(where):
+                return 0
+            return _decode_to_h3_int(where)
+        except (TypeError, ValueError):
+            return 0
+
+    decoded = np.fromiter((decode(p) for p in uniques), dtype=np.int64, count=len(uniques))
+    # Missing values have code -1, which picks the trailing 0
+    return np.append(decoded, 0)[codes]
+
+
+def placekey_to_parent(placekey, resolution):
+    """
+    Return the H3 cell at a coarser resolution that contains a Placekey.
+
+    :param placekey: Placekey (string)
+    :param resolution: H3 resolution of the parent, from 0 to 10 (int)
+    :return: H3 integer of the parent cell (int)
+
+    """
+    _validate_parent_resolution(resolution)
+    return h3_int.cell_to_parent(placekey_to_h3_int(placekey), resolution)
+
+
+def placekeys_to_parents(placekeys, resolution):
+    """
+    Vectorized version of :func:`placekey_to_parent`. The parents are computed with bit
+    operations on the H3 integers, without a call into H3 per row.
+
+    :param placekeys: Sequence of Placekeys (strings)
+    :param resolution: H3 resolution of the parents, from 0 to 10 (int)
+    :return: numpy array of H3 integers (int64). Missing or invalid Placekeys give 0
+
+    """
+    _validate_parent_resolution(resolution)
+    return _h3_parents(placekeys_to_h3_ints(placekeys), resolution)
+
+
+def placekey_children(placekey, resolution):
+    """
+    Return every Placekey that shares the H3 parent of a Placekey at `resolution`. A cell
+    at resolution r contains about 7 ** (10 - r) Placekeys.
+
+    :param placekey: Placekey (string)
+    :param resolution: H3 resolution of the shared parent, from 0 to 10 (int)
+    :return: Set of Placekeys (set)
+
+    """
+    return uncompact_placekeys([placekey_to_parent(placekey, resolution)])
+
+
+def compact_placekeys(placekeys):
+    """
+    Compact a set of Placekeys into the smallest set of H3 cells, at mixed resolutions,
+    that covers exactly the same area.
+
+    :param placekeys: Iterable of Placekeys (strings)
+    :return: List of H3 integers (list)
+
+    """
+    h3_integers = {placekey_to_h3_int(p) for p in placekeys}
+    return h3_int.compact_cells(list(h3_integers))
+
+
+def uncompact_placekeys(h3_integers):
+    """
+    Expand H3 cells, such as the output of :func:`compact_placekeys`, into the Placekeys
+    they contain.
+
+    :param h3_integers: Iterable of H3 integers at resolutions up to 10
+    :return: Set of Placekeys (set)
+
+    """
+    cells = h3_int.uncompact_cells(list(set(h3_integers)), RESOLUTION)
+    return {_encode_h3_int(h) for h in cells}
+
+
+def _validate_parent_resolution(resolution):
+    if not 0 <= resolution <= RESOLUTION:
+        raise ValueError("resolution must be between 0 and {}".format(RESOLUTION))
+
+
+def _h3_parents(h3_ints, resolution):
+    """
+    Vectorized parents of H3 cells at a coarser `resolution`. Zeros are left as is.
+    """
+    import numpy as np
+
+    cells = h3_ints.astype(np.uint64)
+    resolution_mask = np.uint64(0xF << 52)
+    unused_digits = np.uint64((1 << (3 * (15 - resolution))) - 1)
+    parents = (cells & ~resolution_mask) | np.uint64(resolution << 52) | unused_digits
+    return np.where(cells == 0, np.uint64(0), parents).astype(np.int64)
+
+
 def get_neighboring_placekeys(placekey, dist=1):
     """
     Return the unordered set of Placekeys whose grid distance is `<= dist` from the given
@@ -280,6 +689,8 @@ def placekey_to_polygon(placekey, geo_json=False):
     :return: A shapely Polygon object
 
     """
+    from shapely.geometry import Polygon, polygon
+
     p_to_hex = placekey_to_hex_boundary(placekey, geo_json=False)
     if geo_json:
         flipped_coords = [(y,x) for x, y in p_to_hex]
@@ -334,6 +745,10 @@ def polygon_to_placekeys(poly, include_touching=False, geo_json=False):
         boundary of poly respectively.
 
     """
+    from shapely.geometry import Polygon
+    from shapely.ops import transform
+    from shapely.strtree import STRtree
+
     if geo_json:
         poly = transform(lambda x, y: (y, x), poly)
 
@@ -379,6 +794,8 @@ def wkt_to_placekeys(wkt, include_touching=False, geo_json=False):
     :return: List of Placekeys
 
     """
+    from shapely.wkt import loads as wkt_loads
+
     return polygon_to_placekeys(
         wkt_loads(wkt), include_touching=include_touching, geo_json=geo_json)
 
@@ -400,6 +817,8 @@ def geojson_to_placekeys(geojson, include_touching=False, geo_json=True):
     :return: List of Placekeys
 
     """
+    from shapely.geometry import shape
+
     if isinstance(geojson, str):
         poly = shape(json.loads(geojson))
     else:
@@ -429,6 +848,25 @@ def placekey_format_is_valid(placekey):
         return _where_part_is_valid(where)
 
 
+def placekeys_are_valid(placekeys):
+    """
+    Vectorized version of :func:`placekey_format_is_valid`. Each distinct Placekey is
+    checked only once.
+
+    :param placekeys: Sequence of Placekeys (strings)
+    :return: numpy array of booleans. Missing values are not valid
+
+    """
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(pd.Series(placekeys, dtype=object))
+    valid = np.fromiter((isinstance(p, str) and placekey_format_is_valid(p) for p in uniques), dtype=bool,
+                        count=len(uniques))
+    # Missing values have code -1, which picks the trailing False
+    return np.append(valid, False)[codes]
+
+
 def placekey_distance(placekey_1, placekey_2):
     """
     Return the distance in meters between the centers of two Placekeys.
@@ -0,0 +1,232 @@
+"""
+A local stand-in for the Placekey API, for load testing and offline development.
+
+The server implements the `/v1/placekey` and `/v1/placekeys` endpoints used by
+:class:`placekey.api.PlacekeyAPI`. Places with a latitude and longitude get the Placekey
+computed by :func:`placekey.geo_to_placekey`; any other place gets an error. Latency,
+throttling, server errors and batch-wide errors can be injected at configurable rates,
+drawn from a seeded random generator so that runs are repeatable.
+
+Start it from the command line with `python -m placekey.server --port 8080`, or from
+Python::
+
+    with PlacekeyStubServer(latency=0.05, throttle_rate=0.1) as server:
+        pk_api = PlacekeyAPI('any-key', base_url=server.url)
+
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .placekey import geo_to_placekey
+
+MAX_BATCH_SIZE = 100
+
+
+class PlacekeyStubServer:
+    """
+    A threaded HTTP server that mimics the Placekey API.
+
+    :param host: Host to listen on. Defaults to "127.0.0.1".
+    :param port: Port to listen on. Defaults to 0, which picks a free port.
+    :param latency: Seconds to wait before answering each request (float)
+    :param throttle_rate: Fraction of requests answered with a 429 (float)
+    :param unavailable_rate: Fraction of requests answered with a 503 (float)
+    :param timeout_rate: Fraction of requests answered with a 504 (float)
+    :param batch_error_rate: Fraction of bulk requests answered with a batch-wide error
+        instead of per-place results (float)
+    :param retry_after: Value of the `Retry-After` header of 429 responses, in seconds.
+        Defaults to None, in which case the header is not sent.
+    :param api_keys: API keys that are accepted. Defaults to None, which accepts any key.
+    :param seed: Seed of the random generator that picks the failing requests.
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, throttle_rate=0.0, unavailable_rate=0.0,
+                 timeout_rate=0.0, batch_error_rate=0.0, retry_after=None, api_keys=None, seed=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.unavailable_rate = unavailable_rate
+        self.timeout_rate = timeout_rate
+        self.batch_error_rate = batch_error_rate
+        self.retry_after = retry_after
+        self.api_keys = set(api_keys) if api_keys is not None else None
+
+        self.statuses = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._httpd = ThreadingHTTPServer((host, port), _PlacekeyRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+
+    @property
+    def url(self):
+        """
+        :return: The base URL of the server, to pass as `base_url` to
+            :class:`placekey.api.PlacekeyAPI` (string)
+        """
+        host, port = self._httpd.server_address[:2]
+        return 'http://{}:{}/v1'.format(host, port)
+
+    @property
+    def request_count(self):
+        """
+        :return: The number of requests answered so far (int)
+        """
+        with self._lock:
+            return sum(self.statuses.values())
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+
+        :return: The server itself
+        """
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """
+        Serve requests in the calling thread until interrupted.
+        """
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """
+        Stop serving requests and close the socket.
+        """
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _draw_failure(self, bulk):
+        """
+        :return: The injected failure for a request, if any: an HTTP status, "batch_error"
+            or None
+        """
+        with self._lock:
+            draw = self._random.random()
+        for failure, rate in ((429, self.throttle_rate), (503, self.unavailable_rate),
+                              (504, self.timeout_rate), ('batch_error', self.batch_error_rate if bulk else 0.0)):
+            if draw < rate:
+                return failure
+            draw -= rate
+        return None
+
+    def _record(self, status):
+        with self._lock:
+            self.statuses[status] += 1
+
+
+class _PlacekeyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        path = self.path.rstrip('/')
+        bulk = path.endswith('/placekeys')
+        if not bulk and not path.endswith('/placekey'):
+            return self._respond(404, {'message': 'Not Found'})
+        if stub.api_keys is not None and self.headers.get('apikey') not in stub.api_keys:
+            return self._respond(401, {'message': 'Unauthorized'})
+
+        failure = stub._draw_failure(bulk)
+        if failure == 429:
+            headers = {'Retry-After': str(stub.retry_after)} if stub.retry_after is not None else {}
+            return self._respond(429, {'message': 'Rate limit exceeded'}, headers)
+        if failure == 503:
+            return self._respond(503, {'message': 'Service Unavailable'})
+        if failure == 504:
+            return self._respond(504, {'message': 'Gateway Timeout'})
+
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return self._respond(400, {'error': 'Invalid JSON'})
+
+        if not bulk:
+            return self._respond(200, _lookup(payload.get('query', {})))
+
+        queries = payload.get('queries', [])
+        if failure == 'batch_error':
+            return self._respond(400, {'error': 'All queries in the batch had errors'})
+        if len(queries) > MAX_BATCH_SIZE:
+            return self._respond(400, {'error': 'Batches can contain at most {} queries'.format(MAX_BATCH_SIZE)})
+        return self._respond(200, [_lookup(q) for q in queries])
+
+    def _respond(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting, e.g. after a read timeout
+            self.close_connection = True
+        self.server.stub._record(status)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _lookup(query):
+    response = {'query_id': query.get('query_id', '0')}
+    try:
+        response['placekey'] = geo_to_placekey(float(query['latitude']), float(query['longitude']))
+    except (KeyError, TypeError, ValueError):
+        response['error'] = 'Invalid address'
+    return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Placekey API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of 429 responses')
+    parser.add_argument('--unavailable-rate', type=float, default=0.0, help='fraction of 503 responses')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='fraction of 504 responses')
+    parser.add_argument('--batch-error-rate', type=float, default=0.0, help='fraction of batch-wide errors')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After of 429 responses')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = PlacekeyStubServer(
+        host=args.host, port=args.port, latency=args.latency, throttle_rate=args.throttle_rate,
+        unavailable_rate=args.unavailable_rate, timeout_rate=args.timeout_rate,
+        batch_error_rate=args.batch_error_rate, retry_after=args.retry_after, seed=args.seed)
+    print('Serving a Placekey API stand-in at {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
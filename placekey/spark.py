@@ -0,0 +1,91 @@
+"""
+Placekey functions for PySpark DataFrames.
+
+The UDFs are pandas UDFs: Spark hands them whole Arrow batches, which are converted with
+the vectorized functions of :mod:`placekey.parallel` and :mod:`placekey.placekey` rather
+than one Python call per row::
+
+    from placekey.spark import geo_to_placekey_udf
+
+    df = df.withColumn('placekey', geo_to_placekey_udf('latitude', 'longitude'))
+
+"""
+
+import pandas as pd
+
+try:
+    from pyspark.sql.functions import pandas_udf
+    from pyspark.sql.types import BooleanType, DoubleType, StringType, StructField, StructType
+except ImportError:
+    raise ImportError("placekey.spark requires pyspark. Install it with `pip install pyspark`.")
+
+from .api import PlacekeyAPI, _lookup_partition
+from .parallel import map_geo_to_placekey, map_placekey_to_geo
+from .placekey import placekeys_are_valid
+
+GEO_TYPE = StructType([StructField('latitude', DoubleType()), StructField('longitude', DoubleType())])
+
+
+@pandas_udf(StringType())
+def geo_to_placekey_udf(latitudes: pd.Series, longitudes: pd.Series) -> pd.Series:
+    """
+    Convert latitude and longitude columns into Placekeys. Coordinates that can't be
+    converted give null.
+    """
+    placekeys = pd.Series(map_geo_to_placekey(latitudes, longitudes, processes=1), index=latitudes.index,
+                          dtype=object)
+    return placekeys.where(placekeys != '', None)
+
+
+@pandas_udf(GEO_TYPE)
+def placekey_to_geo_udf(placekeys: pd.Series) -> pd.DataFrame:
+    """
+    Convert a Placekey column into a struct of the latitude and longitude of the center
+    of each Placekey. Missing or invalid Placekeys give null coordinates.
+    """
+    lats, longs = map_placekey_to_geo(placekeys, processes=1)
+    return pd.DataFrame({'latitude': lats, 'longitude': longs}, index=placekeys.index)
+
+
+@pandas_udf(BooleanType())
+def placekey_format_is_valid_udf(placekeys: pd.Series) -> pd.Series:
+    """
+    Check the format of a Placekey column, as :func:`placekey.placekey_format_is_valid`
+    does. Missing values are not valid.
+    """
+    return pd.Series(placekeys_are_valid(placekeys), index=placekeys.index)
+
+
+def lookup_placekeys(df, column_mapping, fields=None, concurrency=None, **client_kwargs):
+    """
+    Look up Placekeys for the rows of a Spark DataFrame with the Placekey API, one
+    partition at a time on the executors. Each partition is looked up as
+    :meth:`placekey.api.PlacekeyAPI._placekey_pandas_df` does, in bulk batches.
+
+    The rate limits of the client are a budget for the whole job: they are divided
+    between the `concurrency` tasks that can run at once, and the tasks that run one after
+    the other in the same Python worker share a client.
+
+    :param df: A Spark DataFrame
+    :param column_mapping: Mapping from Placekey API inputs to column names (dict)
+    :param fields: A list of requested outputs other than placekey. Defaults to None
+    :param concurrency: Number of tasks that can look up partitions at once. Defaults to
+        the default parallelism of the Spark context
+    :param client_kwargs: Arguments of :class:`placekey.api.PlacekeyAPI`, such as `api_key`
+        and `bulk_request_limit`. They must be picklable
+    :return: A Spark DataFrame with the columns of `df`, followed by a string column for
+        placekey, each requested field and error
+
+    """
+    if concurrency is None:
+        concurrency = df.sparkSession.sparkContext.defaultParallelism
+    output_columns = PlacekeyAPI._output_columns(fields)
+    if set(output_columns) & set(df.columns):
+        raise ValueError("The DataFrame already has output columns: {}".format(output_columns))
+    schema = StructType(df.schema.fields + [StructField(c, StringType()) for c in output_columns])
+
+    def lookup(batches):
+        for batch in batches:
+            yield _lookup_partition(batch, column_mapping, fields, concurrency, client_kwargs)
+
+    return df.mapInPandas(lookup, schema)
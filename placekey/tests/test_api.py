@@ -3,14 +3,24 @@ Placekey API client tests.
 
 To exclude slow tests run `pytest -m"not slow" placekey/tests/test_api.py`.
 """
+import json
+import logging
 import os
 import random
+import tempfile
 import unittest
+from unittest import mock
 import pandas as pd
 
 import pytest
+import requests
+from ratelimit import RateLimitException
 
+import placekey.placekey as pk
 from placekey.api import PlacekeyAPI
+from placekey.cache import SQLiteCache
+from placekey.general import RateLimiter
+from placekey.metrics import MetricsAggregator
 
 
 class TestAPI(unittest.TestCase):
@@ -152,4 +162,429 @@ class TestAPI(unittest.TestCase):
         self.assertTrue('city_y' in double_join)
 
 
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+        self.content = text.encode('utf-8')
+
+
+def _stub_bulk_request(calls):
+    """
+    Build a replacement for `PlacekeyAPI.make_bulk_request` that answers lat/long
+    queries locally and records each batch it receives in `calls`.
+    """
+    def make_bulk_request(request_data=None):
+        calls.append(request_data['queries'])
+        return _StubResponse(json.dumps([
+            {'query_id': q['query_id'], 'placekey': pk.geo_to_placekey(q['latitude'], q['longitude'])}
+            if 'latitude' in q else {'query_id': q['query_id'], 'error': 'Invalid address'}
+            for q in request_data['queries']
+        ]))
+
+    return make_bulk_request
+
+
+class TestAPIOffline(unittest.TestCase):
+    """
+    Tests for api.py that don't query the Placekey API
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.pk_api = PlacekeyAPI(api_key='not-a-key', cache=SQLiteCache(':memory:'))
+        self.pk_api.make_bulk_request = _stub_bulk_request(self.calls)
+
+    def test_lookup_placekeys_cache(self):
+        """
+        Test that cached places are not sent to the API again
+        """
+        places = [{'latitude': 37.7371, 'longitude': -122.44283},
+                  {'latitude': 40.0, 'longitude': -75.0}]
+        first = self.pk_api.lookup_placekeys([dict(p) for p in places])
+        self.assertEqual(len(self.calls), 1)
+
+        places.append({'latitude': 0.0, 'longitude': 0.0, 'query_id': 'new'})
+        second = self.pk_api.lookup_placekeys([dict(p) for p in places])
+        self.assertEqual(self.calls[-1], [{'latitude': 0.0, 'longitude': 0.0, 'query_id': 'new'}])
+        self.assertListEqual(second[:2], first)
+        self.assertDictEqual(second[2], {'query_id': 'new', 'placekey': '@dvt-smp-tvz'})
+        self.assertEqual(self.pk_api.cache.stats()['hits'], 2)
+
+        # Single and bulk lookups share cached responses, whatever `deduplicate` is
+        self.pk_api.make_request = lambda request_data=None: self.fail('The place should be cached')
+        self.assertDictEqual(self.pk_api.lookup_placekey(latitude=40.0, longitude=-75.0, query_id='single'),
+                             dict(first[1], query_id='single'))
+        place = {'street_address': ' 1 Main St ', 'city': 'San Francisco', 'region': 'CA'}
+        self.pk_api.make_request = lambda request_data=None: _StubResponse(json.dumps(
+            {'query_id': '0', 'placekey': '227@5vg-82n-pgk'}))
+        self.pk_api.lookup_placekey(**place)
+        calls = len(self.calls)
+        result = self.pk_api.lookup_placekeys([dict(place, street_address='1 MAIN ST')], deduplicate=False)
+        self.assertListEqual(result, [{'query_id': 'place_0', 'placekey': '227@5vg-82n-pgk'}])
+        self.assertEqual(len(self.calls), calls)
+
+    def test_lookup_placekeys_instrumentation(self):
+        """
+        Test that batches are reported with their row errors
+        """
+        metrics = MetricsAggregator()
+        self.pk_api.cache = None
+        self.pk_api.instrumentation = metrics
+        places = [{'latitude': 37.7371, 'longitude': -122.44283},
+                  {'street_address': 'nowhere', 'city': 'nowhere', 'region': 'CA'}]
+        self.pk_api.lookup_placekeys(places * 3, batch_size=4, deduplicate=False)
+
+        summary = metrics.summary()['bulk']
+        self.assertEqual(summary['batches'], 2)
+        self.assertEqual(summary['rows'], 6)
+        self.assertEqual(summary['row_errors'], 3)
+
+    def test_compute_locally(self):
+        """
+        Test that coordinate-only places are computed without the API when enabled
+        """
+        self.pk_api.cache = None
+        self.pk_api.compute_locally = True
+        places = [{'latitude': 37.7371, 'longitude': -122.44283},
+                  {'street_address': '1 Main St', 'city': 'San Francisco', 'region': 'CA'},
+                  {'latitude': 0.0, 'longitude': 0.0, 'query_id': 'zero'},
+                  {'latitude': 100.0, 'longitude': 0.0}]
+        results = self.pk_api.lookup_placekeys([dict(p) for p in places])
+        self.assertEqual(self.calls, [[dict(places[1], query_id='place_1')]])
+        self.assertListEqual([r['query_id'] for r in results], ['place_0', 'place_1', 'zero', 'place_3'])
+        self.assertDictEqual(results[0], {'query_id': 'place_0', 'placekey': pk.geo_to_placekey(37.7371, -122.44283)})
+        self.assertDictEqual(results[2], {'query_id': 'zero', 'placekey': '@dvt-smp-tvz'})
+        self.assertDictEqual(results[3], {'query_id': 'place_3', 'error': PlacekeyAPI.INVALID_COORDINATES_ERROR})
+
+        # Other fields need the API
+        self.pk_api.lookup_placekeys([dict(places[0])], fields=['building_placekey'])
+        self.assertEqual(len(self.calls), 2)
+
+        # The single place endpoint isn't stubbed, so this must not reach the network
+        self.assertDictEqual(self.pk_api.lookup_placekey(latitude=0.0, longitude=0.0),
+                             {'query_id': '0', 'placekey': '@dvt-smp-tvz'})
+
+    def test_lookup_placekeys_bisection(self):
+        """
+        Test that failing batches are split until the failing places are isolated
+        """
+        self.pk_api.cache = None
+        stub = _stub_bulk_request(self.calls)
+
+        def make_bulk_request(request_data=None):
+            queries = request_data['queries']
+            if any(q.get('city') == 'malformed' for q in queries):
+                self.calls.append(queries)
+                return _StubResponse(json.dumps({'error': 'Malformed query'}))
+            if any(q.get('city') == 'poison' for q in queries):
+                self.calls.append(queries)
+                return _StubResponse(json.dumps({'message': 'Internal server error'}))
+            return stub(request_data)
+
+        self.pk_api.make_bulk_request = make_bulk_request
+        places = [{'latitude': 37.0 + i * 0.01, 'longitude': -122.0} for i in range(40)]
+        places[5] = {'street_address': '1 Main St', 'city': 'malformed', 'region': 'CA'}
+        places[25] = {'street_address': '1 Main St', 'city': 'poison', 'region': 'CA'}
+        results = self.pk_api.lookup_placekeys(places, batch_size=20, deduplicate=False)
+
+        self.assertListEqual([r['query_id'] for r in results], ['place_{}'.format(i) for i in range(40)])
+        self.assertDictEqual(results[5], {'query_id': 'place_5', 'error': 'Malformed query'})
+        self.assertDictEqual(results[25], {'query_id': 'place_25', 'error': 'Internal server error'})
+        self.assertTrue(all('placekey' in r for i, r in enumerate(results) if i not in (5, 25)))
+        self.assertLess(len(self.calls), 25)
+
+        # A server that fails every batch stops the run instead of bisecting everything
+        self.calls.clear()
+        self.pk_api.make_bulk_request = lambda request_data=None: (
+            self.calls.append(request_data['queries']) or _StubResponse(json.dumps({'message': 'Down'})))
+        self.assertListEqual(self.pk_api.lookup_placekeys(places, batch_size=20, deduplicate=False), [])
+        self.assertLessEqual(len(self.calls), 2 * 5 + 3)
+
+        # Only the bad places fail, even when both halves of a batch hold one
+        self.pk_api.make_bulk_request = make_bulk_request
+        for bad_rows in [(10, 60), (3, 20, 40, 70, 90)]:
+            self.calls.clear()
+            places = [{'latitude': 37.0 + i * 0.001, 'longitude': -122.0} for i in range(100)]
+            for i in bad_rows:
+                places[i] = {'street_address': '1 Main St', 'city': 'malformed', 'region': 'CA'}
+            results = self.pk_api.lookup_placekeys(places, deduplicate=False)
+            self.assertListEqual([r['query_id'] for r in results], ['place_{}'.format(i) for i in range(100)])
+            self.assertListEqual([i for i, r in enumerate(results) if 'error' in r], list(bad_rows))
+            self.assertLessEqual(len(self.calls), 1 + 2 * len(bad_rows) * 7)
+
+        # A batch where every place fails isn't split down to single places
+        self.calls.clear()
+        self.pk_api.make_bulk_request = lambda request_data=None: (
+            self.calls.append(request_data['queries']) or _StubResponse(json.dumps({'error': 'Bad batch'})))
+        places = [{'latitude': 37.0 + i * 0.001, 'longitude': -122.0} for i in range(100)]
+        results = self.pk_api.lookup_placekeys(places, deduplicate=False)
+        self.assertListEqual(results, [{'query_id': 'place_{}'.format(i), 'error': 'Bad batch'} for i in range(100)])
+        self.assertEqual(len(self.calls), 1 + 2 + 4 + 8 + 16)
+
+    def test_preflight_validation(self):
+        """
+        Test that places that can't be looked up get an error without being sent
+        """
+        self.pk_api.cache = None
+        places = [{'latitude': 37.7371, 'longitude': -122.44283},
+                  {'street_address': '1 Main St', 'city': 'San Francisco', 'region': '  '},
+                  {'latitude': 37.7371},
+                  {'latitude': '37.7371', 'longitude': 'west'},
+                  {'latitude': 37.7371, 'longitude': -190.0},
+                  {'street_address': '1 Main St', 'region': 'CA', 'postal_code': '94105', 'city': ''}]
+        results = self.pk_api.lookup_placekeys([dict(p) for p in places])
+        self.assertEqual(self.calls, [[dict(places[0], query_id='place_0'), dict(places[5], query_id='place_5')]])
+        self.assertListEqual([r['query_id'] for r in results], ['place_{}'.format(i) for i in range(6)])
+        self.assertListEqual([r.get('error') for r in results], [
+            None, PlacekeyAPI.MISSING_INPUTS_ERROR, PlacekeyAPI.MISSING_INPUTS_ERROR,
+            PlacekeyAPI.INVALID_COORDINATES_ERROR, PlacekeyAPI.INVALID_COORDINATES_ERROR, 'Invalid address'])
+
+        # Validation can be turned off
+        self.calls.clear()
+        make_bulk_request = self.pk_api.make_bulk_request
+        self.pk_api.make_bulk_request = lambda request_data=None: (
+            self.calls.append(request_data['queries']) or _StubResponse(json.dumps({'error': 'Bad batch'})))
+        self.pk_api.lookup_placekeys([dict(p) for p in places], validate=False)
+        self.assertEqual(len(self.calls[0]), 6)
+
+        # DataFrames are validated on their columns
+        self.calls.clear()
+        self.pk_api.make_bulk_request = make_bulk_request
+        df = pd.DataFrame({'lat': [37.7371, None, 95.0], 'long': [-122.44283, None, 0.0],
+                           'address': [None, '1 Main St', None], 'state': [None, ' ', None]})
+        result = self.pk_api._placekey_pandas_df(
+            df, {'latitude': 'lat', 'longitude': 'long', 'street_address': 'address', 'region': 'state'})
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(self.calls[0]), 1)
+        self.assertListEqual(list(result['error'].iloc[1:]), [
+            PlacekeyAPI.MISSING_INPUTS_ERROR, PlacekeyAPI.INVALID_COORDINATES_ERROR])
+
+        # The single place endpoint isn't stubbed, so this must not reach the network
+        self.assertDictEqual(self.pk_api.lookup_placekey(street_address='1 Main St', query_id='a'),
+                             {'query_id': 'a', 'error': PlacekeyAPI.MISSING_INPUTS_ERROR})
+
+    def test_no_side_effects(self):
+        """
+        Test that lookups leave the places and the loggers as they were
+        """
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('placekey.tests.side_effects')
+        logger.setLevel(logging.ERROR)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        backoff_level = logging.getLogger('backoff').level
+        self.pk_api.logger = logger
+
+        places = [{'latitude': 37.7371, 'longitude': -122.44283}]
+        results = self.pk_api.lookup_placekeys((p for p in places), verbose=True)
+        self.assertDictEqual(places[0], {'latitude': 37.7371, 'longitude': -122.44283})
+        self.assertEqual(results[0]['query_id'], 'place_0')
+        self.assertGreater(len(records), 0)
+        self.assertEqual(logger.level, logging.ERROR)
+        self.assertEqual(logging.getLogger('backoff').level, backoff_level)
+
+        records.clear()
+        self.pk_api.lookup_placekeys(places)
+        self.assertListEqual(records, [])
+
+    def test_columnar_output(self):
+        """
+        Test returning responses as columns or as an Arrow table
+        """
+        places = [{'latitude': 37.7371, 'longitude': -122.44283},
+                  {'street_address': '1 Main St', 'city': 'San Francisco', 'region': 'CA'},
+                  {'street_address': '1 Main St'}]
+        records = self.pk_api.lookup_placekeys([dict(p) for p in places])
+        columns = self.pk_api.lookup_placekeys([dict(p) for p in places], output='columns')
+        self.assertListEqual(list(columns), ['query_id', 'placekey', 'error'])
+        self.assertListEqual(list(columns['query_id']), ['place_0', 'place_1', 'place_2'])
+        self.assertListEqual(list(columns['placekey']), [records[0]['placekey'], None, None])
+        self.assertListEqual(list(columns['error']), [r.get('error') for r in records])
+
+        pytest.importorskip('pyarrow')
+        table = self.pk_api.lookup_placekeys([dict(p) for p in places], output='arrow')
+        self.assertListEqual(table.to_pylist(), [dict(dict.fromkeys(columns), **r) for r in records])
+        self.assertEqual(self.pk_api.lookup_placekeys([], output='arrow').column_names, ['query_id'])
+
+        with self.assertRaises(ValueError):
+            self.pk_api.lookup_placekeys(places, output='dicts')
+
+    def test_lookup_placekeys_deduplicate(self):
+        """
+        Test that duplicate places are sent once and fanned back out
+        """
+        self.pk_api.cache = None
+        self.assertDictEqual(
+            self.pk_api._normalize_query({'city': '  San   Francisco ', 'query_id': 'a'}),
+            {'city': 'san francisco'})
+
+        places = [{'latitude': 37.7371, 'longitude': -122.44283, 'query_id': str(i % 3)}
+                  for i in range(3)] + [{'latitude': 0.0, 'longitude': 0.0}]
+        results = self.pk_api.lookup_placekeys(places, batch_size=2)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(self.calls[0]), 2)
+        self.assertListEqual(
+            [(r['query_id'], r['placekey']) for r in results],
+            [('0', '@5vg-82n-kzz'), ('1', '@5vg-82n-kzz'), ('2', '@5vg-82n-kzz'), ('place_3', '@dvt-smp-tvz')])
+
+        self.pk_api.lookup_placekeys(places, deduplicate=False)
+        self.assertEqual(len(self.calls[-1]), 4)
+
+    def test_placekey_pandas_df(self):
+        """
+        Test that DataFrame rows are turned into queries and results attached by position
+        """
+        df = pd.DataFrame({
+            "address": ["598 Portola Dr", None, None],
+            "region": ["CA", None, None],
+            "postal": ["94131", None, None],
+            "latitude": [None, 37.7371, 0.0],
+            "longitude": [None, -122.44283, 0.0]
+        }, index=[10, 5, 7])
+        column_mappings = {
+            "street_address": "address",
+            "region": "region",
+            "postal_code": "postal",
+            "latitude": "latitude",
+            "longitude": "longitude",
+            "city": "missing_column"
+        }
+        original = df.copy()
+
+        result = self.pk_api._placekey_pandas_df(df, column_mappings)
+        pd.testing.assert_frame_equal(df, original)
+        self.assertListEqual(
+            self.calls[0],
+            [{'street_address': '598 Portola Dr', 'region': 'CA', 'postal_code': '94131', 'query_id': 'place_0'},
+             {'latitude': 37.7371, 'longitude': -122.44283, 'query_id': 'place_1'},
+             {'latitude': 0.0, 'longitude': 0.0, 'query_id': 'place_2'}])
+        self.assertListEqual(list(result.index), [10, 5, 7])
+        self.assertListEqual(list(result['placekey'].iloc[1:]), ['@5vg-82n-kzz', '@dvt-smp-tvz'])
+        self.assertEqual(result['error'].loc[10], 'Invalid address')
+
+        outputs = self.pk_api._placekey_pandas_df(df, column_mappings, return_original_values=False)
+        self.assertListEqual(list(outputs['temp_query_id']), ['place_10', 'place_5', 'place_7'])
+        self.assertListEqual(list(outputs['placekey'].iloc[1:]), ['@5vg-82n-kzz', '@dvt-smp-tvz'])
+
+        # Output columns that are already in the DataFrame aren't overwritten or duplicated
+        calls = len(self.calls)
+        for column in ['placekey', 'error', 'address_placekey']:
+            with self.assertRaisesRegex(ValueError, 'already has output columns'):
+                self.pk_api._placekey_pandas_df(df.assign(**{column: 'x'}), column_mappings,
+                                                fields=['address_placekey'])
+        self.assertEqual(len(self.calls), calls)
+
+
+    def test_placekey_file(self):
+        """
+        Test chunked file-to-file lookups
+        """
+        pq = pytest.importorskip('pyarrow.parquet')
+        self.pk_api.cache = None
+        df = pd.DataFrame({
+            "name": ["a", "b", "c", "d", "e"],
+            "postal": ["01234", None, None, None, None],
+            "latitude": [None, 37.7371, 0.0, 37.7371, 10.0],
+            "longitude": [None, -122.44283, 0.0, -122.44283, 10.0]
+        })
+        column_mappings = {"postal_code": "postal", "latitude": "latitude", "longitude": "longitude"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, 'places.csv')
+            parquet_path = os.path.join(tmp_dir, 'places.parquet')
+            output_path = os.path.join(tmp_dir, 'output.parquet')
+            df.to_csv(csv_path, index=False)
+            df.to_parquet(parquet_path, index=False)
+
+            for input_path in [csv_path, parquet_path]:
+                self.calls.clear()
+                rows = self.pk_api.placekey_file(
+                    input_path, output_path, column_mappings, fields=['address_placekey'], chunksize=2)
+                self.assertEqual(rows, 5)
+                self.assertEqual(len(self.calls), 3)
+                result = pq.read_table(output_path).to_pandas()
+                self.assertListEqual(
+                    list(result.columns),
+                    ['name', 'postal', 'latitude', 'longitude', 'placekey', 'address_placekey', 'error'])
+                self.assertEqual(result['postal'].iloc[0], '01234')
+                self.assertEqual(result['error'].iloc[0], PlacekeyAPI.MISSING_INPUTS_ERROR)
+                self.assertListEqual(list(result['placekey'].iloc[1:4]),
+                                     ['@5vg-82n-kzz', '@dvt-smp-tvz', '@5vg-82n-kzz'])
+
+            # Output columns already in the input are rejected before anything is written
+            os.remove(output_path)
+            df.assign(placekey='x').to_csv(csv_path, index=False)
+            df.assign(address_placekey='x').to_parquet(parquet_path, index=False)
+            self.calls.clear()
+            for input_path in [csv_path, parquet_path]:
+                with self.assertRaisesRegex(ValueError, 'already has output columns'):
+                    self.pk_api.placekey_file(
+                        input_path, output_path, column_mappings, fields=['address_placekey'], chunksize=2)
+            self.assertEqual(len(self.calls), 0)
+            self.assertFalse(os.path.exists(output_path))
+
+    def test_api_key_pool(self):
+        """
+        Test spreading bulk requests across API keys and skipping throttled keys
+        """
+        pk_api = PlacekeyAPI(api_key=['c', 'a', 'b'], bulk_request_limit=1)
+        used_keys = []
+
+        def stub(key):
+            def make_bulk_request(request_data=None):
+                key.rate_limiter.acquire('bulk')
+                if key.api_key == 'c':
+                    raise RateLimitException("Rate limit exceeded", 0)
+                used_keys.append(key.api_key)
+                return _stub_bulk_request([])(request_data)
+            return make_bulk_request
+
+        for key in pk_api._keys:
+            key.make_bulk_request = stub(key)
+
+        places = [{'latitude': 10.0, 'longitude': float(i)} for i in range(4)]
+        results = pk_api.lookup_placekeys(places, batch_size=2)
+        self.assertEqual(len(results), 4)
+        self.assertListEqual(used_keys, ['a', 'b'])
+        self.assertGreater(pk_api._keys[0].cooldown_until, 0)
+        self.assertEqual(pk_api.headers['apikey'], 'c')
+
+        # Keys that fail with server errors are skipped for the rest of the request
+        used_keys.clear()
+        for key in pk_api._keys:
+            key.cooldown_until = 0.0
+            key.rate_limiter = RateLimiter({'single': (100, 1), 'bulk': (100, 1)})
+
+        def unavailable(key):
+            def make_bulk_request(request_data=None):
+                used_keys.append(key.api_key)
+                if key.api_key != 'b':
+                    raise requests.exceptions.RequestException("Service Unavailable")
+                return _stub_bulk_request([])(request_data)
+            return make_bulk_request
+
+        for key in pk_api._keys:
+            key.make_bulk_request = unavailable(key)
+        self.assertEqual(len(pk_api.lookup_placekeys(places[:2])), 2)
+        self.assertListEqual(sorted(used_keys), ['a', 'b', 'c'])
+
+        # When every key is throttled, the request waits for the first one to cool down
+        throttled = []
+
+        def throttled_once(key):
+            def make_bulk_request(request_data=None):
+                if key.api_key not in throttled:
+                    throttled.append(key.api_key)
+                    raise RateLimitException("Rate limit exceeded", 0)
+                return _stub_bulk_request([])(request_data)
+            return make_bulk_request
+
+        for key in pk_api._keys:
+            key.make_bulk_request = throttled_once(key)
+        with mock.patch('placekey.api.time.sleep') as sleep:
+            self.assertEqual(len(pk_api.lookup_placekeys(places[:2])), 2)
+        self.assertEqual(len(throttled), 3)
+        self.assertEqual(sleep.call_count, 1)
+        self.assertAlmostEqual(sleep.call_args.args[0], PlacekeyAPI.KEY_COOLDOWN, delta=1)
 
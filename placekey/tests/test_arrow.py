@@ -0,0 +1,95 @@
+"""
+Arrow and Parquet Placekey column tests.
+"""
+import os
+import tempfile
+import unittest
+
+import h3.api.basic_int as h3_int
+import numpy as np
+import pytest
+
+import placekey.placekey as pk
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+pc = pytest.importorskip('pyarrow.compute')
+
+from placekey.arrow import (PlacekeyType, decode_placekeys, encode_placekeys, read_placekey_parquet,
+                            write_placekey_parquet)
+
+
+class TestArrow(unittest.TestCase):
+    """
+    Tests for arrow.py
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.h3_ints = [h3_int.latlng_to_cell(lat, long, pk.RESOLUTION)
+                        for lat, long in zip(rng.uniform(-85, 85, 2000), rng.uniform(-180, 180, 2000))]
+        self.placekeys = [pk.h3_int_to_placekey(h) for h in self.h3_ints]
+        # Make sure the sample covers the scalar fallback for replaced profanities
+        self.assertTrue(any('e' in p or 'u' in p for p in self.placekeys))
+
+    def test_encode_placekeys(self):
+        """
+        Test that encoding matches h3_int_to_placekey, including nulls and slices
+        """
+        h3_array = pa.array(self.h3_ints, type=pa.uint64())
+        self.assertListEqual(encode_placekeys(h3_array).to_pylist(), self.placekeys)
+
+        with_nulls = pa.array([self.h3_ints[0], None, self.h3_ints[1]], type=pa.uint64())
+        self.assertListEqual(encode_placekeys(with_nulls).to_pylist(), [self.placekeys[0], None, self.placekeys[1]])
+        self.assertListEqual(encode_placekeys(with_nulls.slice(1)).to_pylist(), [None, self.placekeys[1]])
+
+    def test_decode_placekeys(self):
+        """
+        Test that decoding matches placekeys_to_h3_ints for valid and invalid Placekeys
+        """
+        decoded = decode_placekeys(pa.array(self.placekeys))
+        self.assertIsInstance(decoded.type, PlacekeyType)
+        self.assertListEqual(decoded.storage.to_pylist(), self.h3_ints)
+
+        placekeys = [
+            '227-222' + self.placekeys[0], self.placekeys[1][1:], None, '', 'bad', '@5vg-82n-pgk@x',
+            '@@5vg-82n-pgk', 'x@5vg-82n-pgk', '@5vg-82n-pgkx', '@a5g-82n-pgk', '@5vg-a2n-pgk']
+        expected = pk.placekeys_to_h3_ints(placekeys)
+        decoded = decode_placekeys(pa.array(placekeys)).storage.to_pylist()
+        self.assertListEqual([h or 0 for h in decoded], expected.tolist())
+
+        array = pa.array(self.placekeys[:100] + [None])
+        self.assertListEqual(decode_placekeys(pc.dictionary_encode(array)).storage.to_pylist(),
+                             decode_placekeys(array).storage.to_pylist())
+        self.assertListEqual(decode_placekeys(array.slice(10, 5)).storage.to_pylist(), self.h3_ints[10:15])
+        self.assertListEqual(encode_placekeys(decode_placekeys(array)).to_pylist(), array.to_pylist())
+
+    def test_parquet_round_trip(self):
+        """
+        Test writing and reading Placekey columns in both encodings
+        """
+        table = pa.table({'placekey': self.placekeys[:10] + [None], 'value': list(range(11))})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'places.parquet')
+            write_placekey_parquet(table, path, encoding='h3')
+            self.assertIsInstance(pq.read_schema(path).field('placekey').type, PlacekeyType)
+
+            h3_table = read_placekey_parquet(path)
+            self.assertListEqual(h3_table.column('placekey').combine_chunks().storage.to_pylist(),
+                                 self.h3_ints[:10] + [None])
+
+            dictionary_table = read_placekey_parquet(path, encoding='dictionary')
+            self.assertTrue(pa.types.is_dictionary(dictionary_table.schema.field('placekey').type))
+            self.assertListEqual(dictionary_table.column('placekey').to_pylist(), table.column('placekey').to_pylist())
+
+            # The default encoding keeps what parts and values that aren't Placekeys
+            values = ['227-222@5vg-82n-pgk', 'not a key', '@5vg-82n-pgk', None]
+            write_placekey_parquet(pa.table({'placekey': values}), path)
+            self.assertListEqual(read_placekey_parquet(path).column('placekey').to_pylist(), values)
+            with self.assertRaises(ValueError):
+                write_placekey_parquet(pa.table({'placekey': values}), path, encoding='h3')
+            with self.assertRaises(ValueError):
+                read_placekey_parquet(path, encoding='h3')
+
+            with self.assertRaises(ValueError):
+                read_placekey_parquet(path, encoding='json')
@@ -0,0 +1,60 @@
+"""
+Placekey API response cache tests.
+"""
+import os
+import tempfile
+import time
+import unittest
+
+from placekey.cache import SQLiteCache, make_cache_key
+
+
+class TestCache(unittest.TestCase):
+    """
+    Tests for cache.py
+    """
+
+    def test_make_cache_key(self):
+        """
+        Test that cache keys ignore query ids and the order of keys and fields
+        """
+        place = {'latitude': 37.7371, 'longitude': -122.44283, 'query_id': 'a'}
+        same_place = {'longitude': -122.44283, 'latitude': 37.7371, 'query_id': 'b'}
+        self.assertEqual(make_cache_key(place), make_cache_key(same_place))
+        self.assertEqual(
+            make_cache_key(place, ['address_placekey', 'building_placekey']),
+            make_cache_key(same_place, ['building_placekey', 'address_placekey']))
+        self.assertNotEqual(make_cache_key(place), make_cache_key(place, ['address_placekey']))
+
+    def test_persistence_and_stats(self):
+        """
+        Test that responses survive reopening the cache file and are counted as hits
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache.db')
+            cache = SQLiteCache(path)
+            cache.set('a', {'placekey': '@5vg-82n-kzz'})
+            cache.close()
+
+            cache = SQLiteCache(path)
+            self.assertEqual(cache.get('a'), {'placekey': '@5vg-82n-kzz'})
+            self.assertIsNone(cache.get('b'))
+            stats = cache.stats()
+            self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+            self.assertEqual(stats['hit_rate'], 0.5)
+            cache.close()
+
+    def test_ttl_and_max_entries(self):
+        """
+        Test expiry of old responses and eviction beyond the size limit
+        """
+        cache = SQLiteCache(':memory:', ttl=0.05)
+        cache.set('a', {'placekey': '@5vg-82n-kzz'})
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+
+        cache = SQLiteCache(':memory:', max_entries=2)
+        for key in ['a', 'b', 'c']:
+            cache.set(key, {'placekey': key})
+            time.sleep(0.01)
+        self.assertEqual(set(cache.get_many(['a', 'b', 'c'])), {'b', 'c'})
@@ -0,0 +1,68 @@
+"""
+Dask integration tests, run with the local schedulers.
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import placekey.placekey as pk
+from placekey.api import _share_rate_limit
+from placekey.server import PlacekeyStubServer
+
+dd = pytest.importorskip('dask.dataframe')
+
+from placekey.dask import (lookup_placekeys, map_geo_to_placekey, map_placekey_format_is_valid,
+                           map_placekey_to_geo)
+
+
+class TestDask(unittest.TestCase):
+    """
+    Tests for dask.py
+    """
+
+    def setUp(self):
+        self.df = pd.DataFrame({'lat': [37.7371, np.nan, 0.0, 40.0, 100.0],
+                                'long': [-122.44283, 1.0, 0.0, -75.0, 0.0]})
+        self.ddf = dd.from_pandas(self.df, npartitions=2)
+
+    def test_conversions(self):
+        """
+        Test the map_partitions helpers against the scalar functions
+        """
+        placekeys = map_geo_to_placekey(self.ddf['lat'], self.ddf['long']).compute(scheduler='sync')
+        self.assertListEqual(placekeys.tolist(), [
+            None if np.isnan(lat) else pk.geo_to_placekey(lat, long) for lat, long in self.df.itertuples(index=False)])
+
+        series = dd.from_pandas(pd.Series(['@5vg-82n-kzz', None, '@abc-234-xyz']), npartitions=2)
+        geos = map_placekey_to_geo(series).compute(scheduler='threads')
+        self.assertEqual(tuple(geos.iloc[0]), pk.placekey_to_geo('@5vg-82n-kzz'))
+        self.assertTrue(geos.iloc[1:].isna().all(axis=None))
+        self.assertListEqual(map_placekey_format_is_valid(series).compute().tolist(), [True, False, False])
+
+    def test_lookup_placekeys(self):
+        """
+        Test looking up partitions against the stand-in server
+        """
+        with PlacekeyStubServer() as server:
+            result = lookup_placekeys(self.ddf, {'latitude': 'lat', 'longitude': 'long'}, api_key='not-a-key',
+                                      base_url=server.url, bulk_request_limit=100, concurrency=2).compute()
+            # Rows that fail validation are never sent
+            self.assertEqual(server.request_count, 2)
+
+        self.assertListEqual(list(result.columns), ['lat', 'long', 'placekey', 'error'])
+        self.assertListEqual(result['placekey'].tolist(), [
+            pk.geo_to_placekey(37.7371, -122.44283), None, '@dvt-smp-tvz', pk.geo_to_placekey(40.0, -75.0), None])
+        self.assertListEqual(result['error'].notna().tolist(), [False, True, False, False, True])
+
+        with self.assertRaises(ValueError):
+            lookup_placekeys(self.ddf.assign(error=''), {'latitude': 'lat', 'longitude': 'long'}, api_key='a')
+
+    def test_share_rate_limit(self):
+        """
+        Test splitting a rate limit between concurrent clients
+        """
+        self.assertEqual(_share_rate_limit(10, 60, 1), (10, 60))
+        self.assertEqual(_share_rate_limit(10, 60, 3), (3, 60))
+        self.assertEqual(_share_rate_limit(10, 60, 20), (1, 120))
@@ -0,0 +1,210 @@
+"""
+Tests for the rate limiting and request helpers.
+"""
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+import numpy as np
+
+from placekey.general import (DEFAULT_TIMEOUT, DeadlineExceeded, RateLimiter, ThrottleLimitExceeded,
+                              _get_request_function, _json_dumps, _json_loads, _parse_retry_after,
+                              _post_request_function, request_deadline)
+from placekey.metrics import MetricsAggregator
+
+
+class _Response:
+    def __init__(self, status_code, headers=None, content=b''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+
+class TestRateLimiter(unittest.TestCase):
+    """
+    Tests for general.py
+    """
+
+    def test_window(self):
+        """
+        Test that calls beyond the limit wait for the window to move
+        """
+        limiter = RateLimiter({'bulk': (2, 0.2)})
+        self.assertEqual(limiter.acquire('bulk'), 0.0)
+        self.assertEqual(limiter.acquire('bulk'), 0.0)
+        start = time.monotonic()
+        limiter.acquire('bulk')
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_adapts_to_responses(self):
+        """
+        Test slowing down on 429 responses, ramping back up and sharing pauses
+        """
+        limiter = RateLimiter({'single': (100, 60), 'bulk': (10, 60)}, ramp_up=0.25)
+        limiter.update('bulk', _Response(429))
+        self.assertEqual(limiter.allowed_calls('single'), 50)
+        self.assertEqual(limiter.allowed_calls('bulk'), 5)
+        self.assertEqual(limiter.consecutive_throttles, 1)
+
+        limiter.update('single', _Response(200))
+        limiter.update('single', _Response(200))
+        self.assertEqual(limiter.allowed_calls('bulk'), 10)
+        self.assertEqual(limiter.consecutive_throttles, 0)
+
+        limiter.update('bulk', _Response(429, {'Retry-After': '0.2'}))
+        start = time.monotonic()
+        limiter.acquire('single')
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_parse_retry_after(self):
+        """
+        Test reading pauses from response headers
+        """
+        self.assertEqual(_parse_retry_after({'Retry-After': '3'}), 3.0)
+        self.assertIsNone(_parse_retry_after({'Retry-After': 'soon'}))
+        self.assertEqual(_parse_retry_after({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '12'}), 12.0)
+        self.assertIsNone(_parse_retry_after({'X-RateLimit-Remaining': '4', 'X-RateLimit-Reset': '12'}))
+        self.assertAlmostEqual(
+            _parse_retry_after({'RateLimit-Remaining': '0', 'RateLimit-Reset': str(time.time() + 30)}), 30, delta=1)
+        self.assertIsNone(_parse_retry_after({}))
+
+    def test_request_instrumentation(self):
+        """
+        Test that request functions report retries, waits and sizes
+        """
+        metrics = MetricsAggregator()
+        make_request = _post_request_function(
+            headers={}, url='https://example.com', calls=100, period=1, max_tries=3,
+            endpoint='bulk', instrumentation=metrics)
+        responses = [_Response(429), _Response(200, content=b'[{"placekey": "@5vg-7gq-tvz"}]')]
+        with mock.patch('placekey.general.requests.post', side_effect=responses) as post, \
+                mock.patch('backoff._sync.time.sleep'):
+            make_request({'queries': [{'query_id': '0'}, {'query_id': '1'}]})
+
+        self.assertEqual(post.call_count, 2)
+        summary = metrics.summary()['bulk']
+        self.assertEqual(summary['requests'], 1)
+        self.assertEqual(summary['retries'], 1)
+        self.assertDictEqual(summary['outcomes'], {'200': 1})
+        self.assertEqual(summary['request_bytes'], len(post.call_args.kwargs['data']))
+        self.assertEqual(summary['response_bytes'], 30)
+        self.assertGreaterEqual(summary['latency'], summary['network_time'])
+
+        with mock.patch('placekey.general.requests.post', side_effect=[_Response(429)] * 3), \
+                mock.patch('backoff._sync.time.sleep'):
+            with self.assertRaises(Exception):
+                make_request({'queries': []})
+        self.assertDictEqual(metrics.summary()['bulk']['outcomes'], {'200': 1, '429': 1})
+
+    def test_max_throttles(self):
+        """
+        Test that the throttle limit only applies to 429 responses
+        """
+        make_request = _post_request_function(
+            headers={}, url='https://example.com', calls=100, period=1, max_tries=20, max_throttles=3)
+        with mock.patch('placekey.general.requests.post', return_value=_Response(429)) as post, \
+                mock.patch('backoff._sync.time.sleep'):
+            with self.assertRaises(ThrottleLimitExceeded):
+                make_request({'query': {}})
+        self.assertEqual(post.call_count, 3)
+
+        with mock.patch('placekey.general.requests.post', side_effect=[_Response(503)] * 5 + [_Response(200)]) as post, \
+                mock.patch('backoff._sync.time.sleep'):
+            self.assertEqual(make_request({'query': {}}).status_code, 200)
+        self.assertEqual(post.call_count, 6)
+
+    def test_timeouts_and_deadline(self):
+        """
+        Test that attempts get a timeout, shortened by the deadline, and that retries stop
+        at the deadline
+        """
+        make_request = _post_request_function(
+            headers={}, url='https://example.com', calls=100, period=1, max_tries=20,
+            timeout=(5, 30))
+        with mock.patch('placekey.general.requests.post', return_value=_Response(200)) as post:
+            make_request({'query': {}})
+            self.assertEqual(post.call_args.kwargs['timeout'], (5, 30))
+            with request_deadline(2):
+                make_request({'query': {}})
+            self.assertLessEqual(post.call_args.kwargs['timeout'][1], 2)
+
+        start = time.monotonic()
+        with mock.patch('placekey.general.requests.post', return_value=_Response(503)) as post:
+            with request_deadline(0.3), self.assertRaises(DeadlineExceeded):
+                make_request({'query': {}})
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertLess(post.call_count, 20)
+
+        # Requests without an explicit timeout don't wait forever either
+        make_get = _get_request_function(headers={}, url='https://example.com', calls=100, period=1, max_tries=3)
+        with mock.patch('placekey.general.requests.get', return_value=_Response(200)) as get:
+            make_get({'name': 'x'})
+        self.assertEqual(get.call_args.kwargs['timeout'], DEFAULT_TIMEOUT)
+
+        limiter = RateLimiter({'bulk': (1, 60)})
+        limiter.acquire('bulk')
+        with self.assertRaises(DeadlineExceeded):
+            limiter.acquire('bulk', timeout=1)
+
+    def test_hedged_requests(self):
+        """
+        Test that a slow attempt is sent again and the first response is used
+        """
+        metrics = MetricsAggregator()
+        make_request = _post_request_function(
+            headers={}, url='https://example.com', calls=100, period=1, max_tries=1,
+            endpoint='bulk', instrumentation=metrics, hedge_after=0.05)
+        release = threading.Event()
+        calls = []
+
+        def post(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                release.wait(5)
+                return _Response(500)
+            return _Response(200)
+
+        with mock.patch('placekey.general.requests.post', side_effect=post):
+            start = time.monotonic()
+            response = make_request({'queries': []})
+            self.assertLess(time.monotonic() - start, 1)
+            release.set()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(metrics.summary()['bulk']['hedges'], 1)
+
+        # Fast responses aren't hedged
+        with mock.patch('placekey.general.requests.post', return_value=_Response(200)) as fast_post:
+            make_request({'queries': []})
+        self.assertEqual(fast_post.call_count, 1)
+
+        # When the first request to finish fails, the other one is waited for
+        outcomes = [(0.1, requests.exceptions.ConnectionError()), (0.3, _Response(200))]
+
+        def failing_post(**kwargs):
+            delay, result = outcomes.pop(0)
+            threading.Event().wait(delay)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        with mock.patch('placekey.general.requests.post', side_effect=failing_post):
+            self.assertEqual(make_request({'queries': []}).status_code, 200)
+
+    def test_json_backend(self):
+        """
+        Test that bodies are encoded and decoded the same with and without orjson
+        """
+        document = {'queries': [{'query_id': '0', 'latitude': np.float64(37.7), 'longitude': -122.4,
+                                 'city': 'São Paulo'}]}
+        encoded = _json_dumps(document)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(_json_loads(encoded), document)
+        self.assertTrue(np.isnan(_json_loads(b'[{"confidence_score": NaN}]')[0]['confidence_score']))
+
+        with mock.patch('placekey.general.orjson', None):
+            self.assertEqual(_json_loads(_json_dumps(document)), document)
+            self.assertEqual(_json_loads(encoded.decode('utf-8')), document)
@@ -0,0 +1,102 @@
+"""
+Local Placekey join tests.
+"""
+import unittest
+
+import random
+
+import h3.api.basic_int as h3_int
+import pandas as pd
+
+import placekey.placekey as pk
+from placekey.join import join_placekeys, proximity_join
+
+
+class TestJoin(unittest.TestCase):
+    """
+    Tests for join.py
+    """
+
+    def setUp(self):
+        self.left = pd.DataFrame({
+            'placekey': ['227@5vg-82n-pgk', '@5vg-82n-kzz', None, 'not a placekey'],
+            'value': [1, 2, 3, 4]
+        })
+        self.right = pd.DataFrame({
+            'placekey': ['@5vg-82n-pgk', '@5vg-82n-kzz', '227@5vg-82n-pgk', '@dvt-smp-tvz'],
+            'value': [10, 20, 30, 40]
+        })
+
+    def pairs(self, joined):
+        return list(zip(joined['value_x'], joined['value_y']))
+
+    def test_exact(self):
+        """
+        Test that exact joins match pandas.merge, including the order of the rows
+        """
+        left = pd.concat([self.left, self.left.iloc[::-1]], ignore_index=True)
+        right = pd.DataFrame({'placekey': [None] + list(self.right['placekey']) + ['@5vg-82n-kzz'],
+                              'value': [0, 10, 20, 30, 40, 50]})
+        for how in ['inner', 'left', 'right', 'outer']:
+            joined = join_placekeys(left, right, how=how)
+            if how == 'inner':
+                # pandas only documents that inner joins keep the order of the left rows,
+                # as left joins do
+                expected = pd.merge(left, right, on='placekey', how='left').dropna(subset=['value_y'])
+            else:
+                expected = pd.merge(left, right, on='placekey', how=how)
+            pd.testing.assert_frame_equal(joined.reset_index(drop=True), expected.reset_index(drop=True),
+                                          check_dtype=False)
+
+    def test_where(self):
+        """
+        Test joins that ignore what parts
+        """
+        joined = join_placekeys(self.left, self.right, mode='where')
+        self.assertListEqual(self.pairs(joined), [(1, 10), (1, 30), (2, 20)])
+        self.assertListEqual(list(joined.columns), ['placekey_x', 'value_x', 'placekey_y', 'value_y'])
+
+    def test_parent(self):
+        """
+        Test joins on parent cells
+        """
+        joined = join_placekeys(self.left, self.right, mode='parent', resolution=7)
+        self.assertListEqual(self.pairs(joined), [(1, 10), (1, 20), (1, 30), (2, 10), (2, 20), (2, 30)])
+        self.assertEqual(h3_int.cell_to_parent(pk.placekey_to_h3_int('@5vg-82n-pgk'), 7),
+                         h3_int.cell_to_parent(pk.placekey_to_h3_int('@5vg-82n-kzz'), 7))
+        with self.assertRaises(ValueError):
+            join_placekeys(self.left, self.right, mode='parent')
+
+    def test_grid(self):
+        """
+        Test joins on grid distance
+        """
+        distance = h3_int.grid_distance(pk.placekey_to_h3_int('@5vg-82n-pgk'),
+                                        pk.placekey_to_h3_int('@5vg-82n-kzz'))
+        self.assertListEqual(self.pairs(join_placekeys(self.left, self.right, mode='grid', k=0)),
+                             self.pairs(join_placekeys(self.left, self.right, mode='where')))
+        joined = join_placekeys(self.left, self.right, mode='grid', k=distance, how='left')
+        self.assertListEqual(
+            self.pairs(joined.fillna(0)),
+            [(1, 10), (1, 20), (1, 30), (2, 10), (2, 20), (2, 30), (3, 0), (4, 0)])
+
+    def test_proximity_join(self):
+        """
+        Test that proximity joins find the same pairs as pairwise distances
+        """
+        rng = random.Random(0)
+        left = [pk.geo_to_placekey(37.77 + rng.random() * 0.01, -122.42 + rng.random() * 0.01)
+                for _ in range(200)] + [None, 'not a placekey']
+        right = [pk.geo_to_placekey(37.77 + rng.random() * 0.01, -122.42 + rng.random() * 0.01)
+                 for _ in range(200)]
+
+        for max_meters in [50, 250]:
+            left_idx, right_idx, distance = proximity_join(left, right, max_meters, partition_size=64)
+            expected = {(i, j) for i, a in enumerate(left[:200]) for j, b in enumerate(right)
+                        if pk.placekey_distance(a, b) <= max_meters}
+            self.assertSetEqual(set(zip(left_idx.tolist(), right_idx.tolist())), expected)
+            for i, j, d in zip(left_idx, right_idx, distance):
+                self.assertAlmostEqual(d, pk.placekey_distance(left[i], right[j]), places=3)
+
+        left_idx, right_idx, distance = proximity_join([None], right, 100)
+        self.assertEqual((len(left_idx), len(right_idx), len(distance)), (0, 0, 0))
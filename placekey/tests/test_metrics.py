@@ -0,0 +1,105 @@
+"""
+Request instrumentation tests.
+"""
+import unittest
+
+import pytest
+
+from placekey.metrics import (BatchEvent, CompositeInstrumentation, MetricsAggregator,
+                              OpenTelemetryInstrumentation, PrometheusInstrumentation, RequestEvent)
+
+
+def _request_event(status=200, latency=0.5, retries=0, error=None):
+    event = RequestEvent('bulk', batch_size=100)
+    event.status = status
+    event.error = error
+    event.latency = latency
+    event.network_time = latency / 2
+    event.rate_limit_wait = latency / 4
+    event.retries = retries
+    event.request_bytes = 1000
+    event.response_bytes = 2000
+    return event
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Tests for metrics.py
+    """
+
+    def test_metrics_aggregator(self):
+        """
+        Test the in-memory totals and percentiles
+        """
+        metrics = MetricsAggregator()
+        for latency in [0.1, 0.2, 0.3, 0.4]:
+            metrics.record_request(_request_event(latency=latency))
+        metrics.record_request(_request_event(status=429, retries=2))
+        metrics.record_request(_request_event(status=None, error='ConnectionError'))
+        metrics.record_batch(BatchEvent('bulk', 100, 7, 0.5))
+
+        summary = metrics.summary()['bulk']
+        self.assertEqual(summary['requests'], 6)
+        self.assertDictEqual(summary['outcomes'], {'200': 4, '429': 1, 'ConnectionError': 1})
+        self.assertEqual(summary['retries'], 2)
+        self.assertAlmostEqual(summary['latency'], 2.0)
+        self.assertAlmostEqual(summary['network_time'], 1.0)
+        self.assertAlmostEqual(summary['latency_max'], 0.5)
+        self.assertEqual(summary['request_bytes'], 6000)
+        self.assertEqual((summary['batches'], summary['rows'], summary['row_errors']), (1, 100, 7))
+
+        metrics.reset()
+        self.assertDictEqual(metrics.summary(), {})
+
+    def test_composite_instrumentation(self):
+        """
+        Test that events are forwarded to every instrumentation
+        """
+        first, second = MetricsAggregator(), MetricsAggregator()
+        composite = CompositeInstrumentation(first, second)
+        composite.record_request(_request_event())
+        composite.record_batch(BatchEvent('bulk', 10, 1, 0.1))
+        self.assertEqual(first.summary(), second.summary())
+
+    def test_prometheus_instrumentation(self):
+        """
+        Test the Prometheus adapter
+        """
+        prometheus_client = pytest.importorskip('prometheus_client')
+        registry = prometheus_client.CollectorRegistry()
+        instrumentation = PrometheusInstrumentation(registry=registry)
+        instrumentation.record_request(_request_event(retries=1))
+        instrumentation.record_batch(BatchEvent('bulk', 100, 7, 0.5))
+
+        self.assertEqual(registry.get_sample_value(
+            'placekey_request_duration_seconds_count', {'endpoint': 'bulk', 'outcome': '200'}), 1)
+        self.assertEqual(registry.get_sample_value('placekey_request_retries_total', {'endpoint': 'bulk'}), 1)
+        self.assertEqual(registry.get_sample_value('placekey_row_errors_total', {'endpoint': 'bulk'}), 7)
+
+    def test_opentelemetry_instrumentation(self):
+        """
+        Test the OpenTelemetry adapter
+        """
+        pytest.importorskip('opentelemetry.sdk')
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+        reader = InMemoryMetricReader()
+        exporter = InMemorySpanExporter()
+        tracer_provider = TracerProvider()
+        tracer_provider.add_span_processor(SimpleSpanProcessor(exporter))
+        instrumentation = OpenTelemetryInstrumentation(
+            meter_provider=MeterProvider(metric_readers=[reader]), tracer_provider=tracer_provider)
+        instrumentation.record_request(_request_event())
+        instrumentation.record_batch(BatchEvent('bulk', 100, 7, 0.5))
+
+        names = {metric.name for resource in reader.get_metrics_data().resource_metrics
+                 for scope in resource.scope_metrics for metric in scope.metrics}
+        self.assertIn('placekey.client.request.duration', names)
+        self.assertIn('placekey.client.row_errors', names)
+        span, = exporter.get_finished_spans()
+        self.assertEqual(span.attributes['placekey.batch_size'], 100)
+        self.assertAlmostEqual((span.end_time - span.start_time) / 1e9, 0.5, places=3)
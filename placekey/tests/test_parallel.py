@@ -0,0 +1,73 @@
+"""
+Parallel bulk conversion tests.
+"""
+import math
+import unittest
+
+import numpy as np
+
+import placekey.placekey as pk
+from placekey.parallel import (map_geo_to_placekey, map_placekey_to_geo, map_placekey_to_h3_int,
+                               map_placekey_to_polygon)
+
+
+class TestParallel(unittest.TestCase):
+    """
+    Tests for parallel.py
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.lats = rng.uniform(-80, 80, 500)
+        self.longs = rng.uniform(-180, 180, 500)
+        self.lats[3] = np.nan
+
+    def test_map_geo_to_placekey(self):
+        """
+        Test that pooled and single process conversions match geo_to_placekey
+        """
+        pooled = map_geo_to_placekey(self.lats, self.longs, processes=2, min_parallel=0)
+        local = map_geo_to_placekey(self.lats, self.longs, processes=1)
+        self.assertListEqual(list(pooled), list(local))
+        self.assertEqual(pooled[3], '')
+        for i in [0, 1, 499]:
+            self.assertEqual(pooled[i], pk.geo_to_placekey(self.lats[i], self.longs[i]))
+        self.assertEqual(len(map_geo_to_placekey([], [])), 0)
+        with self.assertRaises(ValueError):
+            map_geo_to_placekey([1.0], [])
+
+    def test_map_placekey_conversions(self):
+        """
+        Test conversions from Placekeys, including missing and invalid ones
+        """
+        placekeys = list(map_geo_to_placekey(self.lats[:100], self.longs[:100]))
+        placekeys += [None, 'not a placekey', '227' + placekeys[0], '@abc-234-xyz']
+
+        lats, longs = map_placekey_to_geo(placekeys, processes=2, min_parallel=0)
+        h3_ints = map_placekey_to_h3_int(placekeys, processes=2, min_parallel=0)
+        for i in [0, 1, 102]:
+            geo = pk.placekey_to_geo(placekeys[i])
+            self.assertAlmostEqual(lats[i], geo[0])
+            self.assertAlmostEqual(longs[i], geo[1])
+            self.assertEqual(h3_ints[i], pk.placekey_to_h3_int(placekeys[i]))
+        for i in [3, 100, 101]:
+            self.assertTrue(math.isnan(lats[i]) and math.isnan(longs[i]))
+            self.assertEqual(h3_ints[i], 0)
+        # A where part that decodes to an invalid H3 index
+        self.assertTrue(math.isnan(lats[103]) and math.isnan(longs[103]))
+
+    def test_map_placekey_to_polygon(self):
+        """
+        Test that polygons match placekey_to_polygon, vertex for vertex
+        """
+        placekeys = list(map_geo_to_placekey(self.lats[:100], self.longs[:100])) + [None]
+        for geo_json in [False, True]:
+            polygons = map_placekey_to_polygon(placekeys, geo_json=geo_json, processes=2, min_parallel=0)
+            self.assertIsNone(polygons[3])
+            self.assertIsNone(polygons[100])
+            for placekey, polygon in zip(placekeys, polygons):
+                if polygon is not None:
+                    self.assertListEqual(
+                        list(polygon.exterior.coords),
+                        list(pk.placekey_to_polygon(placekey, geo_json=geo_json).exterior.coords))
+
@@ -0,0 +1,68 @@
+"""
+Placekey partitioning tests.
+"""
+import unittest
+
+import h3.api.basic_int as h3_int
+import numpy as np
+
+import placekey.placekey as pk
+from placekey.partition import DensityPartitioner, partition_key, partition_keys
+
+
+class TestPartition(unittest.TestCase):
+    """
+    Tests for partition.py
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # A dense metro and a sparse background
+        dense = [pk.geo_to_placekey(lat, long)
+                 for lat, long in zip(rng.normal(40.75, 0.02, 900), rng.normal(-73.98, 0.02, 900))]
+        sparse = [pk.geo_to_placekey(lat, long)
+                  for lat, long in zip(rng.uniform(25, 48, 100), rng.uniform(-124, -70, 100))]
+        self.placekeys = dense + sparse
+
+    def test_partition_key(self):
+        """
+        Test that partition keys identify the H3 parent at the given level
+        """
+        placekey = '@5vg-7gq-tvz'
+        h3_integer = pk.placekey_to_h3_int(placekey)
+        for level in range(pk.RESOLUTION + 1):
+            parent = h3_int.cell_to_parent(h3_integer, level)
+            self.assertEqual(partition_key(placekey, level), partition_key(pk.h3_int_to_placekey(parent), level))
+        self.assertEqual(partition_key(placekey, 0), h3_int.get_base_cell_number(h3_integer) + 1)
+        with self.assertRaises(ValueError):
+            partition_key(placekey, 11)
+
+    def test_partition_keys(self):
+        """
+        Test the vectorized partition keys, including missing and invalid Placekeys
+        """
+        placekeys = self.placekeys[:50] + [None, 'not a placekey']
+        keys = partition_keys(placekeys, 6)
+        self.assertListEqual(keys[:50].tolist(), [partition_key(p, 6) for p in placekeys[:50]])
+        self.assertListEqual(keys[50:].tolist(), [-1, -1])
+
+    def test_density_partitioner(self):
+        """
+        Test that partitions are balanced and survive serialization
+        """
+        partitioner = DensityPartitioner.fit(self.placekeys, 10, level=8)
+        partitions = partitioner.partitions(self.placekeys)
+        counts = np.bincount(partitions, minlength=partitioner.num_partitions)
+        self.assertEqual(partitioner.num_partitions, 10)
+        self.assertLess(counts.max(), 2 * len(self.placekeys) / 10)
+        self.assertListEqual(partitions[:5].tolist(), [partitioner.partition(p) for p in self.placekeys[:5]])
+        self.assertEqual(partitioner.partitions([None])[0], -1)
+
+        restored = DensityPartitioner.from_dict(partitioner.to_dict())
+        self.assertListEqual(restored.partitions(self.placekeys).tolist(), partitions.tolist())
+
+        # Prefix partitioning puts the dense metro into a single partition
+        prefix_counts = np.unique(partition_keys(self.placekeys, 2), return_counts=True)[1]
+        self.assertGreater(prefix_counts.max(), 0.8 * len(self.placekeys))
+        with self.assertRaises(ValueError):
+            DensityPartitioner.fit([None], 4)
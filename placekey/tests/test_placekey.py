@@ -4,7 +4,15 @@ in the parent directory of this repository.
 
 """
 
+import hashlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+from unittest import mock
+import pytest
 import h3.api.basic_int as h3_int
 from shapely.wkt import loads as wkt_loads
 from shapely.geometry import shape
@@ -12,6 +20,35 @@ from shapely.ops import transform
 import placekey.placekey as pk
 
 
+class _LocalS3:
+    """
+    A minimal in-memory stand-in for the boto3 S3 client calls used to read free datasets.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.ranges = []
+
+    def _etag(self, key):
+        return '"{}"'.format(hashlib.md5(self.objects[key]).hexdigest())
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ContentLength': len(self.objects[Key]), 'ETag': self._etag(Key)}
+
+    def list_objects_v2(self, Bucket, Prefix, **kwargs):
+        return {'Contents': [{'Key': k, 'Size': len(v), 'ETag': self._etag(k)}
+                             for k, v in self.objects.items() if k.startswith(Prefix)]}
+
+    def get_object(self, Bucket, Key, Range, IfMatch):
+        assert IfMatch == self._etag(Key)
+        start, end = (int(x) for x in Range[len('bytes='):].split('-'))
+        self.ranges.append((Key, start, end))
+        return {'Body': io.BytesIO(self.objects[Key][start:end + 1])}
+
+
 class TestPlacekey(unittest.TestCase):
     """
     Tests for placekey.py
@@ -86,6 +123,15 @@ class TestPlacekey(unittest.TestCase):
                 "converted placekey ({}) did not match H3 at resolution 10 ({})".format(
                     pk.placekey_to_h3(row['placekey']), row['h3_r10']))
 
+    def test_placekeys_to_h3_ints(self):
+        """
+        Test batch Placekey to H3 integer conversion
+        """
+        placekeys = [row['placekey'] for row in self.sample]
+        h3_ints = pk.placekeys_to_h3_ints(placekeys + ['227' + placekeys[0], None, 'bad'])
+        self.assertListEqual(
+            list(h3_ints), [row['h3_int_r10'] for row in self.sample] + [self.sample[0]['h3_int_r10'], 0, 0])
+
     def test_h3_to_placekey(self):
         """
         Test H3 to Placekey conversion
@@ -137,6 +183,32 @@ class TestPlacekey(unittest.TestCase):
         self.assertSetEqual(pk.get_neighboring_placekeys(key, 1), neighbors_dist1,
                             "placekey neighbors of distance 1 correct")
 
+    def test_placekey_hierarchy(self):
+        """
+        Test parents, children and compaction of Placekeys
+        """
+        key = '@5vg-7gq-tvz'
+        h3_integer = pk.placekey_to_h3_int(key)
+        self.assertEqual(pk.placekey_to_parent(key, 7), h3_int.cell_to_parent(h3_integer, 7))
+        self.assertEqual(pk.placekey_to_parent(key, pk.RESOLUTION), h3_integer)
+        with self.assertRaises(ValueError):
+            pk.placekey_to_parent(key, 11)
+
+        parents = pk.placekeys_to_parents([key, '@dvt-smp-tvz', None, 'not a placekey'], 5)
+        self.assertListEqual(
+            parents.tolist(),
+            [pk.placekey_to_parent(key, 5), pk.placekey_to_parent('@dvt-smp-tvz', 5), 0, 0])
+
+        children = pk.placekey_children(key, 8)
+        self.assertEqual(len(children), 49)
+        self.assertIn(key, children)
+        self.assertSetEqual({pk.placekey_to_parent(c, 8) for c in children}, {pk.placekey_to_parent(key, 8)})
+
+        placekeys = children | {'@dvt-smp-tvz'}
+        compacted = pk.compact_placekeys(placekeys)
+        self.assertSetEqual(set(compacted), {pk.placekey_to_parent(key, 8), pk.placekey_to_h3_int('@dvt-smp-tvz')})
+        self.assertSetEqual(pk.uncompact_placekeys(compacted), placekeys)
+
     def test_placekey_to_hex_boundary(self):
         """
         Test placekey to geo boundary conversion
@@ -250,6 +322,10 @@ class TestPlacekey(unittest.TestCase):
         self.assertFalse(pk.placekey_format_is_valid('@abc-234-xyz'), 'invalid where value')
         self.assertFalse(pk.placekey_format_is_valid('@@5vg-7gq-tvz'), 'multiple @ in placekey')
 
+        self.assertListEqual(
+            pk.placekeys_are_valid(['@5vg-7gq-tvz', '@abc-234-xyz', None, '@5vg-7gq-tvz', 12]).tolist(),
+            [True, False, False, True, False])
+
     def test_where_part_is_valid(self):
         """
         Test validation of where parts
@@ -357,6 +433,95 @@ class TestPlacekey(unittest.TestCase):
         self.assertCountEqual(poly_keys['boundary'], non_conformant_geojson_keys['boundary'],
                               "poly and non-conformant geojson conversions' interiors don't match")
         
+    def test_lazy_imports(self):
+        """
+        Test that importing placekey doesn't load heavy optional dependencies
+        """
+        output = subprocess.run(
+            [sys.executable, '-c',
+             'import sys, placekey as pk; pk.geo_to_placekey(0.0, 0.0); '
+             'print(sorted(m for m in ["boto3", "shapely", "pandas"] if m in sys.modules))'],
+            check=True, capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), '[]')
+        self.assertEqual(pk.placekey_to_wkt('@5vg-7gq-tvz')[:7], 'POLYGON')
+
+    def test_open_free_dataset(self):
+        """
+        Test ranged downloads, ETag-validated caching and column projection of free datasets
+        """
+        csv = b'placekey,name,city\n' + b''.join(
+            '@5vg-7gq-tvz,store {},San Francisco\n'.format(i).encode() for i in range(50))
+        s3 = _LocalS3({'datasets/stores/part-0.csv': csv, 'datasets/stores/part-1.csv': csv})
+        location = 'placekey.placekey.return_free_datasets_location_by_name'
+
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                mock.patch(location, return_value='s3://free/datasets/stores'):
+            df = pk.open_free_dataset('stores', columns=['placekey', 'name'], cache_dir=cache_dir,
+                                      chunk_size=100, s3_client=s3, materialize=True)
+            self.assertListEqual(list(df.columns), ['placekey', 'name'])
+            self.assertEqual(len(df), 100)
+            self.assertEqual(len(s3.ranges), 2 * -(-len(csv) // 100))
+            with open(os.path.join(cache_dir, 'free', 'datasets', 'stores', 'part-0.csv'), 'rb') as f:
+                self.assertEqual(f.read(), csv)
+
+            # Unchanged objects are read from the cache, in batches by default
+            s3.ranges.clear()
+            frames = list(pk.open_free_dataset('stores', columns=['name'], cache_dir=cache_dir, s3_client=s3,
+                                               batch_size=20))
+            self.assertListEqual(s3.ranges, [])
+            self.assertListEqual([len(f) for f in frames], [20, 20, 10] * 2)
+            self.assertListEqual(list(frames[0].columns), ['name'])
+
+            # Changed objects are downloaded again
+            s3.objects['datasets/stores/part-1.csv'] = csv + csv[csv.index(b'\n') + 1:]
+            df = pk.open_free_dataset('stores', cache_dir=cache_dir, s3_client=s3, materialize=True)
+            self.assertEqual(len(df), 150)
+            self.assertTrue(all(key.endswith('part-1.csv') for key, _, _ in s3.ranges))
+
+            pa = pytest.importorskip('pyarrow')
+            reader = pk.open_free_dataset('stores', columns=['name', 'placekey'], cache_dir=cache_dir,
+                                          s3_client=s3, engine='arrow', batch_size=20)
+            self.assertIsInstance(reader, pa.RecordBatchReader)
+            batches = list(reader)
+            self.assertTrue(all(b.num_rows <= 20 for b in batches))
+            self.assertEqual(sum(b.num_rows for b in batches), 150)
+            self.assertListEqual(reader.schema.names, ['name', 'placekey'])
+
+    def test_free_dataset_metadata_cache(self):
+        """
+        Test memoization of free dataset names and locations, in memory and on disk
+        """
+        names = mock.patch('placekey.placekey._fetch_free_dataset_names', return_value=['a', 'b'])
+        locations = mock.patch('placekey.placekey._fetch_free_dataset_location',
+                               side_effect=lambda name, url: 's3://free/' + name)
+        with tempfile.TemporaryDirectory() as cache_dir, names as fetch_names, locations as fetch_location:
+            try:
+                pk.configure_free_dataset_metadata_cache(ttl=60, cache_dir=cache_dir)
+                pk.clear_free_dataset_metadata_cache()
+
+                self.assertDictEqual(pk.return_free_datasets_locations_by_names(['a', 'b', 'a']),
+                                     {'a': 's3://free/a', 'b': 's3://free/b'})
+                self.assertEqual(pk.return_free_datasets_location_by_name('a'), 's3://free/a')
+                pk.list_free_datasets().append('c')
+                self.assertListEqual(pk.list_free_datasets(), ['a', 'b'])
+                self.assertEqual(fetch_names.call_count, 1)
+                self.assertEqual(fetch_location.call_count, 2)
+                with self.assertRaises(ValueError):
+                    pk.return_free_datasets_locations_by_names(['a', 'c'])
+
+                # A new process would read the on-disk copy
+                pk._metadata_cache.clear()
+                pk.configure_free_dataset_metadata_cache(ttl=60, cache_dir=cache_dir)
+                self.assertEqual(pk.return_free_datasets_location_by_name('b'), 's3://free/b')
+                self.assertEqual(fetch_location.call_count, 2)
+
+                pk.configure_free_dataset_metadata_cache(ttl=0)
+                pk.return_free_datasets_location_by_name('b')
+                self.assertEqual(fetch_location.call_count, 3)
+            finally:
+                pk.configure_free_dataset_metadata_cache()
+                pk.clear_free_dataset_metadata_cache()
+
     def test_reading_public_dataset_locations(self):
         dataset_list = pk.list_free_datasets()
         self.assertGreater(len(dataset_list), 0)
@@ -0,0 +1,130 @@
+"""
+Local Placekey API stand-in tests.
+"""
+import gc
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import requests
+
+import placekey.placekey as pk
+from placekey.api import PlacekeyAPI
+from placekey.server import PlacekeyStubServer
+
+
+class TestServer(unittest.TestCase):
+    """
+    Tests for server.py
+    """
+
+    def setUp(self):
+        self.server = PlacekeyStubServer().start()
+        self.pk_api = PlacekeyAPI('not-a-key', max_retries=5, bulk_request_limit=1000,
+                                  base_url=self.server.url)
+        # Retries back off without sleeping
+        self.sleep_patcher = mock.patch('backoff._sync.time.sleep')
+        self.sleep_patcher.start()
+        self.addCleanup(self.sleep_patcher.stop)
+        self.addCleanup(self.server.stop)
+
+    def test_lookups(self):
+        """
+        Test single and bulk lookups against the stand-in
+        """
+        self.assertDictEqual(self.pk_api.lookup_placekey(latitude=37.7371, longitude=-122.44283),
+                             {'query_id': '0', 'placekey': pk.geo_to_placekey(37.7371, -122.44283)})
+
+        places = [{'latitude': 37.7371, 'longitude': -122.44283}, {'street_address': '1 Main St', 'city': 'Nowhere', 'region': 'CA'}]
+        results = self.pk_api.lookup_placekeys(places, deduplicate=False)
+        self.assertListEqual(results, [
+            {'query_id': 'place_0', 'placekey': pk.geo_to_placekey(37.7371, -122.44283)},
+            {'query_id': 'place_1', 'error': 'Invalid address'}])
+
+        response = requests.post(self.server.url + '/placekeys', json={'queries': [{}] * 101})
+        self.assertEqual(response.status_code, 400)
+
+    def test_injected_failures(self):
+        """
+        Test that throttled and failed requests are retried, and that batch-wide errors
+        are spread over the places of the batch
+        """
+        self.server.throttle_rate = 0.2
+        self.server.unavailable_rate = 0.1
+        self.server.timeout_rate = 0.1
+        places = [{'latitude': 37.7 + i * 1e-3, 'longitude': -122.4} for i in range(200)]
+        results = self.pk_api.lookup_placekeys(places, batch_size=10, deduplicate=False)
+        self.assertEqual(len(results), 200)
+        self.assertTrue(all('placekey' in r for r in results))
+        self.assertGreater(self.server.statuses[429] + self.server.statuses[503] + self.server.statuses[504], 0)
+
+        self.server.throttle_rate = self.server.unavailable_rate = self.server.timeout_rate = 0.0
+        self.server.batch_error_rate = 1.0
+        results = self.pk_api.lookup_placekeys(places[:3], deduplicate=False)
+        self.assertListEqual([r['error'] for r in results], ['All queries in the batch had errors'] * 3)
+
+    def test_api_keys(self):
+        """
+        Test that unknown API keys are rejected when keys are configured
+        """
+        self.server.api_keys = {'good-key'}
+        response = requests.post(self.server.url + '/placekey', json={'query': {}}, headers={'apikey': 'bad-key'})
+        self.assertEqual(response.status_code, 401)
+        response = requests.post(self.server.url + '/placekey', json={'query': {}}, headers={'apikey': 'good-key'})
+        self.assertEqual(response.json(), {'query_id': '0', 'error': 'Invalid address'})
+
+    def test_deadline(self):
+        """
+        Test that a lookup against a slow server stops at its deadline with partial results
+        """
+        # Patching backoff's sleep would also remove the server's latency
+        self.sleep_patcher.stop()
+        self.server.latency = 0.3
+        places = [{'latitude': 37.7 + i * 1e-3, 'longitude': -122.4} for i in range(40)]
+        results = self.pk_api.lookup_placekeys(places, batch_size=10, deduplicate=False, deadline=0.5)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all('placekey' in r for r in results))
+
+    def test_shared_client(self):
+        """
+        Test that one client can serve several threads at once
+        """
+        def lookup(offset):
+            places = [{'latitude': 37.7 + (offset + i) * 1e-3, 'longitude': -122.4} for i in range(25)]
+            results = self.pk_api.lookup_placekeys(places, batch_size=10, verbose=offset % 2 == 0)
+            self.assertTrue(all('query_id' not in p for p in places))
+            sessions.add(id(self.pk_api.session.session))
+            return [r['placekey'] for r in results]
+
+        sessions = set()
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lookup, range(0, 400, 25)))
+        self.assertTrue(1 < len(sessions) <= 8)
+        self.assertListEqual(
+            [placekey for chunk in results for placekey in chunk],
+            [pk.geo_to_placekey(37.7 + i * 1e-3, -122.4) for i in range(400)])
+        # Each thread sent its requests with its own session, closed once the thread ended
+        gc.collect()
+        self.assertEqual(len(self.pk_api.session._sessions), 0)
+
+    def test_short_lived_threads(self):
+        """
+        Test that the sessions of threads that have ended are released
+        """
+        def lookup(i):
+            self.pk_api.lookup_placekey(latitude=37.7 + i * 1e-3, longitude=-122.4)
+            sessions.append(len(self.pk_api.session._sessions))
+
+        sessions = []
+        for start in range(0, 50, 5):
+            threads = [threading.Thread(target=lookup, args=(i,)) for i in range(start, start + 5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(sessions), 50)
+        # No more sessions were alive at once than threads were running
+        self.assertLessEqual(max(sessions), 5)
+        gc.collect()
+        self.assertEqual(len(self.pk_api.session._sessions), 0)
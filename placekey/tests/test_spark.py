@@ -0,0 +1,71 @@
+"""
+PySpark integration tests, run in Spark local mode.
+"""
+import unittest
+
+import pytest
+
+import placekey.placekey as pk
+from placekey.server import PlacekeyStubServer
+
+pyspark = pytest.importorskip('pyspark')
+pytest.importorskip('pyarrow')
+
+from pyspark.sql import SparkSession
+
+from placekey.spark import (geo_to_placekey_udf, lookup_placekeys, placekey_format_is_valid_udf,
+                            placekey_to_geo_udf)
+
+
+class TestSpark(unittest.TestCase):
+    """
+    Tests for spark.py
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.spark = SparkSession.builder.master('local[2]').appName('placekey-tests').getOrCreate()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.spark.stop()
+
+    def setUp(self):
+        self.df = self.spark.createDataFrame(
+            [(37.7371, -122.44283), (None, 1.0), (0.0, 0.0), (100.0, 0.0)], 'lat double, long double')
+
+    def test_udfs(self):
+        """
+        Test the pandas UDFs against the scalar functions
+        """
+        rows = (self.df
+                .withColumn('placekey', geo_to_placekey_udf('lat', 'long'))
+                .withColumn('geo', placekey_to_geo_udf('placekey'))
+                .withColumn('valid', placekey_format_is_valid_udf('placekey'))
+                .orderBy('lat')
+                .collect())
+        by_lat = {row['lat']: row for row in rows}
+
+        self.assertEqual(by_lat[37.7371]['placekey'], pk.geo_to_placekey(37.7371, -122.44283))
+        self.assertEqual(by_lat[0.0]['placekey'], '@dvt-smp-tvz')
+        self.assertEqual(by_lat[100.0]['placekey'], pk.geo_to_placekey(100.0, 0.0))
+        self.assertIsNone(by_lat[None]['placekey'])
+        self.assertEqual(tuple(by_lat[0.0]['geo']), pk.placekey_to_geo('@dvt-smp-tvz'))
+        self.assertIsNone(by_lat[None]['geo']['latitude'])
+        self.assertListEqual([by_lat[lat]['valid'] for lat in (37.7371, 0.0, None, 100.0)],
+                             [True, True, False, True])
+
+    def test_lookup_placekeys(self):
+        """
+        Test looking up partitions against the stand-in server
+        """
+        with PlacekeyStubServer() as server:
+            result = lookup_placekeys(self.df, {'latitude': 'lat', 'longitude': 'long'}, api_key='not-a-key',
+                                      base_url=server.url, bulk_request_limit=100).collect()
+
+        self.assertListEqual(result[0].__fields__, ['lat', 'long', 'placekey', 'error'])
+        by_lat = {row['lat']: row for row in result}
+        self.assertEqual(by_lat[37.7371]['placekey'], pk.geo_to_placekey(37.7371, -122.44283))
+        self.assertEqual(by_lat[0.0]['placekey'], '@dvt-smp-tvz')
+        self.assertIsNotNone(by_lat[None]['error'])
+        self.assertIsNotNone(by_lat[100.0]['error'])
@@ -29,6 +29,10 @@ setuptools.setup(
     url="https://github.com/Placekey/placekey-py",
     packages=setuptools.find_packages(),
     install_requires=['h3>=4.2.1,<5', 'shapely', 'requests', 'ratelimit', 'backoff', 'boto3', 'pandas'],
+    extras_require={
+        'parquet': ['pyarrow'],
+        'fast-json': ['orjson'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: Apache Software License",